@@ -246,6 +246,23 @@ class NumericData(odm.StdModel):
     ok = odm.BooleanField()
 
 
+class SortedNumericData(odm.StdModel):
+    pv = odm.FloatField(index='sorted')
+    vega = odm.FloatField(default=0.0)
+    delta = odm.IntegerField(index='sorted', default=0)
+
+
+class SortedOptionalData(odm.StdModel):
+    number = odm.IntegerField(index='sorted', required=False)
+    dt = odm.DateField(index='sorted', required=False)
+
+
+class PrefixData(odm.StdModel):
+    code = odm.SymbolField(index='lex', unique=True)
+    name = odm.SymbolField(index='lex')
+    group = odm.SymbolField(required=False)
+
+
 class DateData(odm.StdModel):
     dt1 = odm.DateField(required=False)
     dt2 = odm.DateTimeField(default=datetime.now)
@@ -33,7 +33,7 @@ class RedisColumnTS(redisb.RedisStructure):
                                               'merge', cache.merged_series)
 
     def allkeys(self):
-        return self.client.keys(self.id + '*')
+        return self.client.scankeys(self.id + '*')
 
     def fields(self):
         '''Return a tuple of ordered fields for this :class:`ColumnTS`.'''
@@ -205,10 +205,10 @@ redisb.BackendDataServer.struct_map['columnts'] = RedisColumnTS
 
 ##############################################################    SCRIPT
 class timeseries_run(redisb.RedisScript):
-    script = (redisb.read_lua_file('tabletools'),
-              redisb.read_lua_file('columnts.columnts'),
-              redisb.read_lua_file('columnts.stats'),
-              redisb.read_lua_file('columnts.runts'))
+    script = (redisb.lua_file('tabletools'),
+              redisb.lua_file('columnts.columnts'),
+              redisb.lua_file('columnts.stats'),
+              redisb.lua_file('columnts.runts'))
 
     def callback(self, response, redis_client=None, return_type=None, **opts):
         if return_type and response:
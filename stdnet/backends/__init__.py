@@ -1,5 +1,5 @@
 import sys
-from collections import namedtuple
+from collections import namedtuple, deque
 from inspect import isgenerator
 
 try:
@@ -9,6 +9,11 @@ except ImportError:     # pragma    noproxy
     def async(gen):
         raise NotImplementedError
 
+try:
+    StopAsyncIteration = StopAsyncIteration
+except NameError:   # pragma    nocover
+    StopAsyncIteration = StopIteration
+
 
 from stdnet.utils.exceptions import *
 from stdnet.utils import raise_error_trace
@@ -20,6 +25,7 @@ from stdnet.utils import (iteritems, int_or_float, to_string, urlencode,
 __all__ = ['BackendStructure',
            'BackendDataServer',
            'BackendQuery',
+           'AsyncQueryIterator',
            'session_result',
            'session_data',
            'instance_session_result',
@@ -304,6 +310,11 @@ indices are created.'''
         '''Ping the server'''
         pass
 
+    def outstanding(self):
+        '''Number of requests in progress with the server. Used by the
+``least_outstanding`` policy of :class:`stdnet.odm.ReadReplicas`.'''
+        return 0
+
     def instance_keys(self, obj):
         '''Return a list of database keys used by instance *obj*'''
         return [self.basekey(obj._meta, obj.pkvalue())]
@@ -324,6 +335,34 @@ must return a instance of the backend handler.'''
         '''Execute a :class:`stdnet.odm.Session` in the backend server.'''
         raise NotImplementedError()
 
+    def bulk_insert(self, meta, instances, batch_size, ids=False):
+        '''Insert new ``instances`` of model ``meta`` in batches of
+``batch_size`` without a :class:`stdnet.odm.Session`. Return the number of
+instances inserted or, if ``ids`` is ``True``, the list of their ids.'''
+        raise NotImplementedError()
+
+    def delete_query(self, query, batch_size, progress=None, callback=None):
+        '''Delete the elements of :class:`stdnet.odm.Query` ``query``, and of
+the related models which require them, ``batch_size`` at a time without a
+:class:`stdnet.odm.Session`. ``progress`` is called after each batch with the
+model metaclass, the number of elements deleted and the number left,
+``callback`` with the model metaclass and the list of ids deleted by the
+batch. Return the list of ids of ``query`` model deleted.'''
+        raise NotImplementedError()
+
+    def gather(self, queries):
+        '''Load the elements of a list of :class:`stdnet.odm.QueryElement`
+``queries`` and return the list of elements of each query. Used by
+:meth:`stdnet.odm.Session.gather`. By default queries are loaded one after
+the other, backends can override :meth:`_gather` to load them with fewer
+round-trips to the server.'''
+        return self.execute(self._gather(queries))
+
+    def subscribe_invalidations(self):
+        '''Subscribe to the invalidation messages published when instances
+are committed or deleted. Used by :class:`stdnet.odm.CacheInvalidator`.'''
+        raise NotImplementedError()
+
     def model_keys(self, meta):
         '''Return a list of database keys used by model *model*'''
         raise NotImplementedError()
@@ -332,6 +371,15 @@ must return a instance of the backend handler.'''
         '''Flush the database or drop all instances of a model/collection'''
         raise NotImplementedError()
 
+    # PRIVATE METHODS
+
+    def _gather(self, queries):
+        results = []
+        for query in queries:
+            items = yield query.backend_query().items()
+            results.append(items)
+        yield results
+
 
 class BackendQuery(object):
     '''Asynchronous query interface class.
@@ -411,6 +459,22 @@ class BackendQuery(object):
     def items(self, slic=None, callback=None):
         return self.backend.execute(self._slice_items(slic), callback)
 
+    def iterator(self, chunk_size):
+        '''Generator over the elements of this query, loaded from the backend
+server ``chunk_size`` elements at a time. Unlike :meth:`items`, loaded elements
+are not stored in the :attr:`cache` nor added to the :attr:`session`.
+Available for synchronous backends only.'''
+        if self.backend.is_async():
+            raise QuerySetError('Cannot iterate in chunks with an asynchronous'
+                                ' backend')
+        if self.execute_query():
+            cursor = 0
+            while cursor is not None:
+                cursor, items = self.backend.execute(
+                    self._page(cursor, chunk_size))
+                for el in items:
+                    yield el
+
     def delete(self, qs):
         with self.session.begin() as t:
             t.delete(qs)
@@ -435,6 +499,28 @@ class BackendQuery(object):
         '''
         raise NotImplementedError
 
+    def _load_items(self, slic):
+        '''Generator of the elements of the query in the slice ``slic``. By
+default the query is executed, if not already, and elements are loaded only
+when it is not empty. Backends can override it to execute the query and load
+its elements in a single round-trip.'''
+        result = yield self.execute_query()
+        items = ()
+        if result:
+            items = yield self._items(slic)
+        yield items
+
+    def _page(self, cursor, chunk_size):
+        '''Generator of a two-elements tuple containing the cursor for the
+next page (``None`` when there are no more pages) and the elements of the page
+starting at ``cursor``. By default the cursor is the position in the query.'''
+        items = yield self._items(slice(cursor, cursor + chunk_size))
+        items = list(items)
+        if len(items) < chunk_size:
+            yield None, items
+        else:
+            yield cursor + chunk_size, items
+
     # PRIVATE METHODS
 
     def _got_count(self, c):
@@ -452,19 +538,61 @@ class BackendQuery(object):
         if seq is not None:
             yield seq
         else:
-            result = yield self.execute_query()
-            items = ()
-            if result:
-                items = yield self._items(slic)
-            session = self.session
-            seq = []
-            model = self.model
-            for el in items:
-                if isinstance(el, model):
-                    session.add(el, modified=False)
-                seq.append(el)
-            self.__slice_cache[key] = seq
-            yield seq
+            items = yield self.backend.execute(self._load_items(slic))
+            yield self._cache_items(items, key)
+
+    def _cache_items(self, items, key=None):
+        # Add loaded instances to the session and store the elements in the
+        # slice cache. The whole query is stored with key ``None``.
+        session = self.session
+        seq = []
+        model = self.model
+        for el in items:
+            if isinstance(el, model):
+                session.add(el, modified=False)
+            seq.append(el)
+        self.__slice_cache[key] = seq
+        return seq
+
+
+class AsyncQueryIterator(object):
+    '''Asynchronous iterator over the elements of a :class:`BackendQuery`,
+loaded ``chunk_size`` elements at a time. It is returned by the
+:meth:`stdnet.odm.Query.iterator` method of asynchronous backends and
+supports the ``async for`` statement::
+
+    async for instance in query.iterator(100):
+        ...
+
+As for synchronous iterators, loaded elements are neither stored in the query
+cache nor added to the session.'''
+    def __init__(self, backend, query, chunk_size):
+        self.backend = backend
+        self.query = query
+        self.chunk_size = chunk_size
+        self.cursor = 0
+        self.items = deque()
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        return self.backend.execute(self._next())
+
+    def _next(self):
+        query = self.query
+        while not self.items:
+            if self.cursor is None:
+                raise StopAsyncIteration
+            elif not self.cursor:
+                count = yield query.count()
+                if not count:
+                    self.cursor = None
+                    continue
+            self.cursor, items = yield query._page(self.cursor,
+                                                   self.chunk_size)
+            self.items.extend(items)
+        yield self.items.popleft()
 
 
 def parse_backend(backend):
@@ -489,11 +617,18 @@ It returns a (scheme, host, params) tuple."""
 
 
 def _getdb(scheme, host, params):
+    # A "name+variant" scheme, such as redis+sharded, selects the
+    # VariantBackendDataServer class of the name backend module.
+    name, _, variant = scheme.partition('+')
     try:
-        module = import_module('stdnet.backends.%sb' % scheme)
+        module = import_module('stdnet.backends.%sb' % name)
     except ImportError:
         raise NotImplementedError
-    return getattr(module, 'BackendDataServer')(scheme, host, **params)
+    backend = getattr(module, '%sBackendDataServer' % variant.capitalize(),
+                      None)
+    if backend is None:
+        raise NotImplementedError
+    return backend(scheme, host, **params)
 
 
 def getdb(backend=None, **kwargs):
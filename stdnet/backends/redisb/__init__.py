@@ -1,15 +1,25 @@
 '''Redis backend implementation'''
 import json
+import threading
+from copy import copy
+from hashlib import sha1
 from functools import partial
+from itertools import islice, chain
 
 from .client import *
 
 import stdnet
-from stdnet import FieldValueError, CommitException, QuerySetError
-from stdnet.utils import (gen_unique_id, zip, ispy3k,
+from stdnet import (FieldValueError, CommitException, QuerySetError,
+                    ImproperlyConfigured)
+from stdnet.utils import (gen_unique_id, zip, ispy3k, to_string, to_bytes,
                           native_str, flat_mapping, unique_tuple)
+from stdnet.utils.structures import OrderedDict
 from stdnet.backends import (BackendStructure, session_result,
                              instance_session_result)
+try:
+    from stdnet.utils.aio import maybe_async
+except ImportError:     # asyncio is not available
+    maybe_async = None
 
 MIN_FLOAT = -1.e99
 
@@ -18,6 +28,8 @@ MIN_FLOAT = -1.e99
 OBJ = 'obj'     # the hash table for a instance
 TMP = 'tmp'     # temorary key
 ODM_SCRIPTS = ('odmrun', 'move2set', 'zdiffstore')
+# maximum number of where scripts registered at the same time
+MAX_WHERE_SCRIPTS = 100
 ############################################################################
 
 if ispy3k:
@@ -40,11 +52,11 @@ def pairs_to_dict(response, encoding):
 
 
 class odmrun(RedisScript):
-    script = (read_lua_file('tabletools'),
+    script = (lua_file('tabletools'),
               # timeseries must be included before utils
-              read_lua_file('commands.timeseries'),
-              read_lua_file('commands.utils'),
-              read_lua_file('odm'))
+              lua_file('commands.timeseries'),
+              lua_file('commands.utils'),
+              lua_file('odm'))
     required_scripts = ODM_SCRIPTS
 
     def callback(self, response, meta=None, backend=None, odm_command=None,
@@ -56,7 +68,7 @@ class odmrun(RedisScript):
         elif odm_command == 'commit':
             res = self._wrap_commit(response, **opts)
             return session_result(meta, res)
-        elif odm_command == 'load':
+        elif odm_command in ('load', 'read'):
             return self.load_query(response, backend, meta, **opts)
         elif odm_command == 'structure':
             return self.flush_structure(response, backend, meta, **opts)
@@ -75,11 +87,13 @@ class odmrun(RedisScript):
 
     def load_query(self, response, backend, meta, get=None, fields=None,
                    fields_attributes=None, redis_client=None, **options):
-        if get:
+        if options.get('count') or options.get('has'):
+            return int(response)
+        elif get:
             tpy = meta.dfields.get(get).to_python
             return [tpy(v, backend) for v in response]
         else:
-            data, related = response
+            data, related = response[:2]
             encoding = redis_client.encoding
             data = self.build(data, meta, fields, fields_attributes, encoding)
             related_fields = {}
@@ -89,7 +103,12 @@ class odmrun(RedisScript):
                     fields = tuple(native_str(f, encoding) for f in fields)
                     related_fields[fname] =\
                         self.load_related(meta, fname, rdata, fields, encoding)
-            return backend.objects_from_db(meta, data, related_fields)
+            data = backend.objects_from_db(meta, data, related_fields)
+            if options.get('ordering') == 'scan':
+                return int(response[2]), data
+            elif options.get('size'):
+                return int(response[3]), data
+            return data
 
     def build(self, response, meta, fields, fields_attributes, encoding):
         fields = tuple(fields) if fields else None
@@ -122,7 +141,31 @@ class odmrun(RedisScript):
 
 
 class check_structures(RedisScript):
-    script = read_lua_file('structures')
+    script = lua_file('structures')
+
+
+_where_scripts = OrderedDict()
+_where_scripts_lock = threading.Lock()
+
+
+def where_script(where):
+    '''The :class:`RedisScript` evaluating the lua ``where`` clause of a
+query. A script is compiled and registered once for each distinct clause. When
+more than :data:`MAX_WHERE_SCRIPTS` are registered, the least recently used is
+unregistered. The script instance, rather than its name, is passed to
+:meth:`execute_script` so that it runs even if another thread unregisters it
+in the meantime.'''
+    name = 'where.%s' % sha1(to_bytes(where)).hexdigest()
+    with _where_scripts_lock:
+        script = _where_scripts.pop(name, None)
+        if script is None:
+            source = partial(read_lua_file, 'where',
+                             context={'where_clause': where})
+            script = register_script(RedisScript(source, name))
+        _where_scripts[name] = script
+        while len(_where_scripts) > MAX_WHERE_SCRIPTS:
+            unregister_script(_where_scripts.popitem(last=False)[0])
+    return script
 
 
 ############################################################################
@@ -130,6 +173,8 @@ class check_structures(RedisScript):
 ############################################################################
 class RedisQuery(stdnet.BackendQuery):
     card = None
+    read_only = False
+    _backend = None
     _meta_info = None
     script_dep = {'script_dependency': ('build_query', 'move2set')}
 
@@ -139,28 +184,66 @@ class RedisQuery(stdnet.BackendQuery):
     def sism(self, r):
         return r
 
+    @property
+    def backend(self):
+        return self._backend or self.queryelem.backend
+
     @property
     def meta_info(self):
         if self._meta_info is None:
-            self._meta_info = json.dumps(self.backend.meta(self.meta))
+            self._meta_info = self.backend.meta_info(self.meta)
         return self._meta_info
 
-    def _build(self, pipe=None, **kwargs):
-        # Accumulate a query
-        if pipe is None:
-            pipe = self.backend.client.pipeline()
-        self.pipe = pipe
+    def _build(self, pipe=None, backend=None, **kwargs):
+        # Accumulate a query. When ``backend`` is given, the query is
+        # evaluated by it rather than by the backend of the queryelem.
+        if backend is not None:
+            self._backend = backend
         qs = self.queryelem
         backend = self.backend
+        if backend.read_only and pipe is None:
+            # the query tree is evaluated by the read script
+            self.read_only = True
+            self.tree = json.dumps(self._read_tree(qs))
+            self.query_key = None
+            self.temporary_key = False
+            return
+        if pipe is None:
+            # reads do not need MULTI/EXEC unless the query asks for it
+            pipe = self.backend.client.pipeline(transaction=qs._atomic)
+        self.pipe = pipe
         key, meta, keys, args = None, self.meta, [], []
         pkname = meta.pkname()
+        gf = qs._get_field
+        cache_key = None
+        if backend.query_cache and not (qs.keyword == 'set' and
+                                        qs.name == pkname and not len(qs) and
+                                        not qs.data.get('where') and
+                                        (not gf or gf == pkname)):
+            cache_key, cached = self._cache_key()
+            if cached:
+                if gf and gf != pkname:
+                    self.card = getattr(pipe, 'llen')
+                self.query_key = cache_key
+                self.temporary_key = False
+                return
         for child in qs:
-            if getattr(child, 'backend', None) == backend:
+            if getattr(child, 'backend', None) == qs.backend:
                 lookup, value = 'set', child
             else:
                 lookup, value = child
-            if lookup == 'set':
-                be = value.backend_query(pipe=pipe)
+            if lookup == 'set' and backend.cluster and value.meta != meta:
+                # values of a query on another slot are stored in a
+                # temporary set on the slot of this model
+                key = backend.tempkey(meta)
+                values = self.cluster_values(value, meta, qs.name)
+                if values:
+                    pipe.sadd(key, *values)
+                    pipe.expire(key, self.expire)
+                keys.append(key)
+                args.extend(('set', key))
+            elif lookup == 'set':
+                be = backend.bind_query(value, pipe)
                 keys.append(be.query_key)
                 args.extend(('set', be.query_key))
             else:
@@ -205,7 +288,6 @@ class RedisQuery(stdnet.BackendQuery):
         #
         # If we are getting a field (for a subsequent query maybe)
         # unwind the query and store the result
-        gf = qs._get_field
         if gf and gf != pkname:
             field_attribute = meta.dfields[gf].attname
             bkey = key
@@ -215,13 +297,188 @@ class RedisQuery(stdnet.BackendQuery):
             okey = backend.basekey(meta, OBJ, '*->' + field_attribute)
             pipe.sort(bkey, by='nosort', get=okey, store=key)
             self.card = getattr(pipe, 'llen')
-        if temp_key:
+        if temp_key and cache_key:
+            # materialize the result for queries with the same signature
+            pipe.execute_script('query_cache', (key, cache_key), 'store',
+                                backend.query_cache)
+            key, temp_key = cache_key, False
+        elif temp_key:
             pipe.expire(key, self.expire)
         self.query_key = key
+        self.temporary_key = temp_key
+
+    def _cache_key(self):
+        # The key of the materialized result of queries with the same
+        # canonical representation and the version of the models they
+        # depend on, and a flag indicating if the key exists.
+        backend = self.backend
+        metas = {}
+        signature = self._signature(self.queryelem, metas)
+        digest = sha1(signature.encode('utf-8')).hexdigest()
+        versions = [backend.basekey(metas[m], 'qver') for m in sorted(metas)]
+        key = backend.tempkey(self.meta, 'q' + digest)
+        if backend.cluster:
+            # version keys are on the hash slots of their models
+            client = backend.client
+            for version in versions:
+                key = '%s.%s' % (key, native_str(client.get(version) or '0',
+                                                 client.encoding))
+            return key, bool(client.exists(key))
+        key, exists = backend.client.execute_script('query_cache', versions,
+                                                    'key', key)
+        return native_str(key, backend.client.encoding), bool(exists)
+
+    def _signature(self, qs, metas):
+        # Canonical JSON representation of the QueryElement tree ``qs``.
+        # Children of commutative operations are sorted. ``metas`` collects
+        # the models the query depends on.
+        metas[qs.meta.modelkey] = qs.meta
+        children = []
+        for child in qs:
+            if getattr(child, 'backend', None) == qs.backend:
+                lookup, value = 'set', child
+            else:
+                lookup, value = child
+            if lookup == 'set':
+                value = self._signature(value.construct(), metas)
+            elif isinstance(value, tuple):
+                value, nested = value
+                nested = nested or ()
+                for _, meta in nested:
+                    if meta:
+                        metas[meta.modelkey] = meta
+                value = (value, [(name, meta.modelkey if meta else meta)
+                                 for name, meta in nested])
+            children.append(json.dumps((lookup, value), default=repr))
+        if qs.keyword == 'diff':
+            children = children[:1] + sorted(children[1:])
+        else:
+            children = sorted(children)
+        return json.dumps((qs.meta.modelkey, qs.keyword, qs.name, children,
+                           qs.data.get('where'), qs._get_field),
+                          default=repr)
+
+    def _read_tree(self, qs):
+        # The query tree of the QueryElement ``qs`` for the read script
+        backend = self.backend
+        meta = qs.meta
+        if qs.data.get('where'):
+            raise QuerySetError('Cannot perform a where query on a read-only '
+                                'backend')
+        args = []
+        for child in qs:
+            if getattr(child, 'backend', None) == qs.backend:
+                lookup, value = 'set', child
+            else:
+                lookup, value = child
+            if lookup == 'set' and backend.cluster and value.meta != meta:
+                values = [('value', to_string(v, backend.charset))
+                          for v in self.cluster_values(value, meta, qs.name)]
+                if qs.keyword == 'set' and values:
+                    args.extend(values)
+                    continue
+                # a node on the ids of this model. Ids are never empty.
+                value = {'meta': backend.meta(meta),
+                         'keyword': 'set',
+                         'name': meta.pkname(),
+                         'args': values or [('value', '')],
+                         'get': ''}
+            elif lookup == 'set':
+                value = self._read_tree(value.construct())
+            elif isinstance(value, tuple):
+                value = self.dump_nested(*value)
+            elif value is None:
+                value = ''
+            elif isinstance(value, float):
+                value = repr(value)
+            else:
+                value = to_string(value, backend.charset)
+            args.append(value if qs.keyword != 'set' else (lookup, value))
+        gf = qs._get_field
+        if gf and gf != meta.pkname():
+            gf = meta.dfields[gf].attname
+        else:
+            gf = ''
+        return {'meta': backend.meta(meta),
+                'keyword': qs.keyword,
+                'name': qs.name,
+                'args': args,
+                'get': gf}
+
+    def _read(self, options):
+        # Run the read script with ``options``
+        backend = self.backend
+        return backend.odmrun(backend.client, 'read', self.meta, (),
+                              self.meta_info, self.tree, json.dumps(options),
+                              **options)
+
+    def cluster_values(self, query, meta, name):
+        '''With the cluster key layout, the keys of other models are on
+different hash slots. ``query``, on a different model, is evaluated on its
+own and its values are returned serialised for the field with attribute
+``name`` of model ``meta``.'''
+        backend = self.backend
+        if name == meta.pk.attname:
+            field = meta.pk
+        else:
+            field = dict(((f.attname, f) for f in meta.indices))[name]
+        if backend.is_async():
+            raise QuerySetError('Queries across models with the cluster key '
+                                'layout require a synchronous connection')
+        query = query.construct()
+        if not query._get_field:
+            # load the ids only
+            query = copy(query)
+            query.data = dict(query.data, get_field=query.meta.pkname())
+        query = backend.Query(query, backend=backend)
+        return [field.serialise(value) for value in query.items()]
 
     def _execute_query(self):
         '''Execute the query without fetching data. Returns the number of
 elements in the query.'''
+        if self.read_only:
+            yield self._read({'count': True})
+            return
+        self._set_card()
+        self.card(self.query_key)
+        result = yield self.pipe.execute()
+        yield result[-1]
+
+    def _load_items(self, slic):
+        '''Unless the query is already executed, build, count and load
+elements of the query in the same pipeline, with one round-trip to the
+server.'''
+        if self.executed or self.queryelem._get_field:
+            items = yield super(RedisQuery, self)._load_items(slic)
+        elif self.read_only:
+            N, items = yield self._items(slic, size=True)
+            self._got_count(N)
+        else:
+            self._set_card()
+            pipe = self._items(slic, pipe=self.pipe, size=True)
+            result = yield pipe.execute()
+            N, items = result[-1]
+            self._got_count(N)
+        if self.backend.cluster and self.queryelem.select_related:
+            items = yield self.backend.execute(
+                self.load_cluster_related(items))
+        yield items
+
+    def _batch(self, pipe):
+        '''Add the script counting and loading all the elements of the query
+to ``pipe``, shared with other queries by :meth:`BackendDataServer.gather`.
+Return the position of its reply in the pipeline, or ``None`` if the query
+cannot be loaded in ``pipe``.'''
+        if self.executed or self.queryelem._get_field:
+            return
+        if not self.read_only:
+            if self.pipe is not pipe:
+                return
+            self._set_card()
+        self._items(None, pipe=pipe, size=True)
+        return len(pipe.command_stack) - 1
+
+    def _set_card(self):
         pipe = self.pipe
         if not self.card:
             if self.meta.ordering:
@@ -234,9 +491,6 @@ elements in the query.'''
                 self._check_member = self.sism
         else:
             self.ismember = None
-        self.card(self.query_key)
-        result = yield pipe.execute()
-        yield result[-1]
 
     def order(self, last):
         '''Perform ordering with respect model fields.'''
@@ -267,6 +521,9 @@ elements in the query.'''
         return json.dumps((value, nested_args))
 
     def _has(self, val):
+        if self.read_only:
+            return self.backend.execute(self._read({'has': to_string(val)}),
+                                        bool)
         r = self.ismember(self.query_key, val)
         return self._check_member(r)
 
@@ -279,32 +536,74 @@ elements in the query.'''
             stop = None
         return start, stop
 
-    def _items(self, slic):
+    def _page(self, cursor, chunk_size):
+        expire = self.expire if self.temporary_key else 0
+        if (self.queryelem.ordering or self.meta.ordering or
+                self.queryelem._get_field or self.read_only):
+            # ordered query, pages by rank
+            slic = slice(cursor, cursor + chunk_size)
+            items = yield self._items(slic, expire=expire)
+            cursor = cursor + chunk_size if len(items) == chunk_size else None
+        else:
+            # SSCAN can return an element more than once, the ids already
+            # returned since the first page are skipped
+            if not cursor:
+                self._scanned = set()
+            scanned = self._scanned
+            cursor, items = yield self._items(None, scan=(cursor, chunk_size),
+                                              expire=expire)
+            cursor = cursor or None
+            page = []
+            for item in items:
+                pk = item.pkvalue()
+                if pk not in scanned:
+                    scanned.add(pk)
+                    page.append(item)
+            items = page
+        if self.backend.cluster and self.queryelem.select_related:
+            items = yield self.backend.execute(
+                self.load_cluster_related(items))
+        yield cursor, items
+
+    def _items(self, slic, scan=None, expire=0, pipe=None, size=False):
         # Unwind the database query by creating a list of arguments for
-        # the load_query lua script
+        # the load_query lua script. If ``size`` is true the script also
+        # returns the size of the query. When a pipeline is given the load
+        # script is added to it.
         backend = self.backend
         meta = self.meta
         name = ''
         order = ()
         start, stop = self.get_redis_slice(slic)
-        if self.queryelem.ordering:
+        if scan:
+            # SSCAN cursor and count
+            name = 'scan'
+            start, stop = scan
+        elif self.queryelem.ordering:
             order = self.order(self.queryelem.ordering)
         elif meta.ordering:
             name = 'DESC' if meta.ordering.desc else 'ASC'
+            # the stop index is included by zrange
+            if stop:
+                stop -= 1
+            elif stop == 0:
+                start, stop = 1, 0
         elif start or stop is not None:
             order = self.order(meta.get_sorting(meta.pkname()))
         # Wen using the sort algorithm redis requires the number of element
         # not the stop index
         if order:
             name = 'explicit'
-            N = self.execute_query()
-            if stop is None:
-                stop = N
-            elif stop < 0:
-                stop += N
-            if start < 0:
-                start += N
-            stop -= start
+            # with size the slice is normalised by the script
+            if not size:
+                N = self.execute_query()
+                if stop is None:
+                    stop = N
+                elif stop < 0:
+                    stop += N
+                if start < 0:
+                    start += N
+                stop -= start
         elif stop is None:
             stop = -1
         get = self.queryelem._get_field
@@ -336,13 +635,53 @@ elements in the query.'''
                    'stop': stop,
                    'fields': fields_attributes,
                    'related': dict(self.related_lua_args()),
-                   'get': get}
+                   'get': get,
+                   'expire': expire,
+                   'size': size}
         joptions = json.dumps(options)
         options.update({'fields': fields,
                         'fields_attributes': fields_attributes})
-        return backend.odmrun(backend.client, 'load', meta, (self.query_key,),
+        client = backend.client if pipe is None else pipe
+        if self.read_only:
+            return backend.odmrun(client, 'read', meta, (),
+                                  self.meta_info, self.tree, joptions,
+                                  **options)
+        return backend.odmrun(client, 'load', meta, (self.query_key,),
                               self.meta_info, joptions, **options)
 
+    def cross_slot_related(self, field):
+        '''``True`` if the related model of ``field`` is stored on a
+different hash slot with the cluster key layout. Related instances of these
+fields are loaded by :meth:`load_cluster_related`.'''
+        return (self.backend.cluster and field not in self.meta.multifields
+                and field.relmodel._meta != self.meta)
+
+    def load_cluster_related(self, items):
+        '''Load related instances of :attr:`select_related` fields on
+other hash slots with separate queries.'''
+        related = self.queryelem.select_related or ()
+        for rel in related:
+            field = self.meta.dfields[rel]
+            if not field.relmodel or not self.cross_slot_related(field):
+                continue
+            relmeta = field.relmodel._meta
+            ids = set((getattr(instance, field.attname, None)
+                       for instance in items))
+            ids.discard(None)
+            if not ids:
+                continue
+            query = self.session.query(field.relmodel).filter(
+                **{relmeta.pkname(): tuple(ids)})
+            if related[rel]:
+                query = query.load_only(*related[rel])
+            objs = yield query.all()
+            objs = dict(((obj.pkvalue(), obj) for obj in objs))
+            for instance in items:
+                rid = getattr(instance, field.attname, None)
+                if rid is not None:
+                    setattr(instance, field.name, objs.get(rid))
+        yield items
+
     def related_lua_args(self):
         '''Generator of load_related arguments'''
         related = self.queryelem.select_related
@@ -351,6 +690,8 @@ elements in the query.'''
             for rel in related:
                 field = meta.dfields[rel]
                 relmodel = field.relmodel
+                if relmodel and self.cross_slot_related(field):
+                    continue
                 bk = self.backend.basekey(relmodel._meta) if relmodel else ''
                 fields = list(related[rel])
                 if meta.pkname() in fields:
@@ -680,23 +1021,23 @@ class NumberArray(RedisStructure):
 
 
 class ts_commands(RedisScript):
-    script = (read_lua_file('commands.timeseries'),
-              read_lua_file('tabletools'),
-              read_lua_file('ts'))
+    script = (lua_file('commands.timeseries'),
+              lua_file('tabletools'),
+              lua_file('ts'))
 
 
 class numberarray_resize(RedisScript):
-    script = (read_lua_file('numberarray'),
+    script = (lua_file('numberarray'),
               '''return array:new(KEYS[1]):resize(unpack(ARGV))''')
 
 
 class numberarray_all_raw(RedisScript):
-    script = (read_lua_file('numberarray'),
+    script = (lua_file('numberarray'),
               '''return array:new(KEYS[1]):all_raw()''')
 
 
 class numberarray_getset(RedisScript):
-    script = (read_lua_file('numberarray'),
+    script = (lua_file('numberarray'),
               '''local a = array:new(KEYS[1])
 if ARGV[1] == 'get' then
     return a:get(ARGV[2],true)
@@ -706,20 +1047,84 @@ end''')
 
 
 class numberarray_pushback(RedisScript):
-    script = (read_lua_file('numberarray'),
+    script = (lua_file('numberarray'),
               '''local a = array:new(KEYS[1])
 for _,v in ipairs(ARGV) do
     a:push_back(v,true)
 end''')
 
 
+class query_cache(RedisScript):
+    script = '''if ARGV[1] == 'key' then
+    -- append the model versions to the key and check if it exists
+    local key = ARGV[2]
+    for _, version in ipairs(KEYS) do
+        key = key .. '.' .. (redis.call('get', version) or '0')
+    end
+    return {key, redis.call('exists', key)}
+elseif redis.call('exists', KEYS[1]) == 1 then
+    -- store a query result
+    redis.call('rename', KEYS[1], KEYS[2])
+    redis.call('expire', KEYS[2], ARGV[2])
+end'''
+
+
 ############################################################################
 ##    REDIS BACKEND
 ############################################################################
 class BackendDataServer(stdnet.BackendDataServer):
+    '''Redis backend server.
+
+When the ``invalidation`` parameter of the
+:ref:`connection string <connection-string>` is set to ``1``, committed and
+deleted ids are published on the :meth:`invalidation_channel` so that other
+processes can evict them from their :class:`stdnet.odm.ModelCache`.
+
+When the ``query_cache`` parameter is set to a number of seconds, the
+results of queries are materialized in keys named after a canonical hash of
+the :class:`stdnet.odm.QueryElement` and reused by identical queries for
+that time. Commits and deletes increase a version counter of the model
+so that new queries do not reuse stale results. All clients writing to the
+database must use the same ``query_cache`` setting. The key of the result,
+which depends on the versions, is looked up with an additional round trip
+when a query is built, therefore the ``query_cache`` is not available with
+asynchronous connections.
+
+When the ``read_only`` parameter is set to ``1``, queries are evaluated by a
+script which does not write temporary keys, so that the backend can connect
+to a read-only replica and be used as the ``read_backend`` of a model.
+Queries with a ``where`` clause are not available.
+
+When the ``cluster`` parameter is set to ``1``, the model key of
+:meth:`basekey` is wrapped in a ``{...}`` hash tag so that all the keys of a
+model are on the same slot of a redis cluster, and scripts declare a key of
+that slot. Queries on related models are evaluated separately and their ids
+passed to the query, and related instances of ``load_related`` are loaded
+with separate queries.
+
+Backends with the same address, ``db`` and connection parameters share the
+redis-py connection pool of the process-wide
+:data:`stdnet.backends.redisb.client.pools` registry, so that creating a
+backend for each request does not open new connections. The
+``max_connections`` parameter limits the number of connections of the pool
+and connections left idle for more than ``idle_timeout`` seconds are closed.
+
+When the ``commit_chunk_size`` or ``commit_chunk_bytes`` parameters are set,
+the instances of a model committed by a session are split into several calls
+of the commit script with at most that number of instances or bytes of
+field data, so that a very large commit does not block the server for the
+whole time. The calls are sent on a pipeline without ``MULTI``/``EXEC``,
+after the atomic pipeline of the rest of the session, so that other clients
+are served between them. These commits are therefore not atomic. Their
+results are merged before being returned to the :class:`stdnet.odm.Session`.
+
+.. attribute:: invalidation_batch_size
+
+    Maximum number of ids in a single invalidation message.
+'''
     Query = RedisQuery
-    _redis_clients = {}
     default_port = 6379
+    invalidation_batch_size = 10000
     struct_map = {'set': Set,
                   'list': List,
                   'zset': Zset,
@@ -728,6 +1133,11 @@ class BackendDataServer(stdnet.BackendDataServer):
                   'numberarray': NumberArray,
                   'string': String}
 
+    def __init__(self, *args, **kwargs):
+        self._meta_info = {}
+        self._server_version = None
+        super(BackendDataServer, self).__init__(*args, **kwargs)
+
     def setup_connection(self, address):
         if len(address) == 2:
             address = tuple(address)
@@ -735,11 +1145,46 @@ class BackendDataServer(stdnet.BackendDataServer):
             address = address[0]
         if 'db' not in self.params:
             self.params['db'] = 0
-        rpy = redis_client(address=address, **self.params)
+        invalidation = self.params.pop('invalidation', 0)
+        self.invalidation = bool(int(invalidation))
+        self.query_cache = int(self.params.pop('query_cache', 0))
+        self.read_only = bool(int(self.params.pop('read_only', 0)))
+        self.cluster = bool(int(self.params.pop('cluster', 0)))
+        self.commit_chunk_size = int(self.params.pop('commit_chunk_size', 0))
+        self.commit_chunk_bytes = int(self.params.pop('commit_chunk_bytes',
+                                                      0))
+        rpy = self.connect(address, self.params)
+        if self.query_cache and rpy.is_async:
+            # the key of a cached result is looked up while building a query
+            raise ImproperlyConfigured('The query_cache parameter requires a '
+                                       'synchronous connection')
         if self.namespace:
             self.params['namespace'] = self.namespace
+        if self.invalidation:
+            self.params['invalidation'] = 1
+        if self.query_cache:
+            self.params['query_cache'] = self.query_cache
+        if self.read_only:
+            self.params['read_only'] = 1
+        if self.cluster:
+            self.params['cluster'] = 1
+        if self.commit_chunk_size:
+            self.params['commit_chunk_size'] = self.commit_chunk_size
+        if self.commit_chunk_bytes:
+            self.params['commit_chunk_bytes'] = self.commit_chunk_bytes
         return rpy
 
+    def connect(self, address, params):
+        '''Create the redis client connected to ``address``.'''
+        return redis_client(address=address, **params)
+
+    def basekey(self, meta, *args):
+        if not self.cluster:
+            return super(BackendDataServer, self).basekey(meta, *args)
+        key = '%s{%s}' % (self.namespace, meta.modelkey)
+        postfix = ':'.join((str(p) for p in args if p is not None))
+        return '%s:%s' % (key, postfix) if postfix else key
+
     def auto_id_to_python(self, value):
         return int(value)
 
@@ -749,7 +1194,18 @@ class BackendDataServer(stdnet.BackendDataServer):
     def ping(self):
         return self.client.ping()
 
+    def preload_scripts(self):
+        '''Load all the registered lua scripts in the redis server with one
+pipeline, rather than when they are first executed.'''
+        return self.client.preload_scripts()
+
+    def outstanding(self):
+        # connections checked out of the pool
+        pool = self.client.connection_pool
+        return len(getattr(pool, '_in_use_connections', ()))
+
     def disconnect(self):
+        # the connection pool is shared with other backends
         self.client.connection_pool.disconnect()
 
     def meta(self, meta):
@@ -758,68 +1214,257 @@ class BackendDataServer(stdnet.BackendDataServer):
         data['namespace'] = self.basekey(meta)
         return data
 
+    def meta_info(self, meta):
+        '''The JSON encoded :meth:`meta` passed to lua scripts. It is cached
+on the backend and invalidated by :meth:`setup_model`.'''
+        info = self._meta_info.get(meta)
+        if info is None:
+            info = json.dumps(self.meta(meta))
+            self._meta_info[meta] = info
+        return info
+
+    def setup_model(self, meta):
+        self._meta_info.pop(meta, None)
+
     def odmrun(self, client, odm_command, meta, keys, meta_info,
                *args, **options):
         options.update({'backend': self, 'meta': meta,
                         'odm_command': odm_command})
+        if self.cluster and not keys:
+            # a key on the slot of the model routes the script
+            keys = (self.basekey(meta, 'id'),)
         return client.execute_script('odmrun', keys, odm_command, meta_info,
                                      *args, **options)
 
     def where_run(self, client, meta_info, keys, where, load_only):
-        where = read_lua_file('where', context={'where_clause': where})
-        numkeys = len(keys)
-        keys.append(meta_info)
+        args = [meta_info]
         if load_only:
-            keys.append(json.dumps(load_only))
-        return client.eval(where, numkeys, *keys)
+            args.append(json.dumps(load_only))
+        return client.execute_script(where_script(where), keys, *args)
 
     def execute_session(self, session_data):
         '''Execute a session in redis.'''
         pipe = self.client.pipeline()
+        chunked = self.client.pipeline(transaction=False)
         for sm in session_data:  # loop through model sessions
             meta = sm.meta
             if sm.structures:
-                self.flush_structure(sm, pipe)
+                self.flush_structure(sm.structures, pipe)
             delquery = None
             if sm.deletes is not None:
-                delquery = sm.deletes.backend_query(pipe=pipe)
+                delquery = self.bind_query(sm.deletes, pipe)
             self.accumulate_delete(pipe, delquery)
             if sm.dirty:
-                meta_info = json.dumps(self.meta(meta))
-                lua_data = [len(sm.dirty)]
+                self.commit_instances(pipe, meta, sm.dirty, chunked)
+        return self.execute(self._execute_session(pipe, chunked))
+
+    def invalidation_channel(self):
+        '''The channel where invalidation messages are published.'''
+        return '%sinvalidation' % self.namespace
+
+    def subscribe_invalidations(self):
+        '''A redis ``PubSub`` subscribed to the :meth:`invalidation_channel`.
+Each message is a JSON encoded ``[modelkey, ids]`` list.'''
+        if self.is_async():
+            raise NotImplementedError('Invalidation subscription requires a '
+                                      'synchronous connection')
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self.invalidation_channel())
+        return pubsub
+
+    def commit_instances(self, pipe, meta, instances, chunked=None):
+        '''Add the ``commit`` script for ``instances`` of model ``meta`` to
+the ``pipe``. When the instances exceed the ``commit_chunk_size`` or the
+``commit_chunk_bytes`` of the backend, the script is added once for each
+chunk, to the ``chunked`` pipeline if given. The transaction mode of ``pipe``
+is not changed.'''
+        chunk_size = self.commit_chunk_size
+        chunk_bytes = self.commit_chunk_bytes
+        chunks = []
+        lua_data = []
+        processed = []
+        size = 0
+        for instance in instances:
+            state = instance.get_state()
+            if not meta.is_valid(instance):
+                raise FieldValueError(
+                    json.dumps(instance._dbdata['errors']))
+            score = MIN_FLOAT
+            if meta.ordering:
+                if meta.ordering.auto:
+                    score = meta.ordering.name.incrby
+                else:
+                    v = getattr(instance, meta.ordering.name, None)
+                    if v is not None:
+                        score = meta.ordering.field.scorefun(v)
+            data = instance._dbdata['cleaned_data']
+            action = state.action
+            prev_id = state.iid if state.persistent else ''
+            id = instance.pkvalue() or ''
+            data = flat_mapping(data)
+            nbytes = sum((len(to_string(v)) for v in data)) if chunk_bytes else 0
+            if processed and ((chunk_size and len(processed) >= chunk_size) or
+                              (chunk_bytes and size + nbytes > chunk_bytes)):
+                chunks.append((lua_data, processed))
+                lua_data = []
                 processed = []
-                for instance in sm.dirty:
-                    state = instance.get_state()
-                    if not meta.is_valid(instance):
-                        raise FieldValueError(
-                            json.dumps(instance._dbdata['errors']))
-                    score = MIN_FLOAT
-                    if meta.ordering:
-                        if meta.ordering.auto:
-                            score = meta.ordering.name.incrby
-                        else:
-                            v = getattr(instance, meta.ordering.name, None)
-                            if v is not None:
-                                score = meta.ordering.field.scorefun(v)
-                    data = instance._dbdata['cleaned_data']
-                    action = state.action
-                    prev_id = state.iid if state.persistent else ''
-                    id = instance.pkvalue() or ''
-                    data = flat_mapping(data)
-                    lua_data.extend((action, prev_id, id, score, len(data)))
-                    lua_data.extend(data)
-                    processed.append(state.iid)
-                self.odmrun(pipe, 'commit', meta, (), meta_info,
-                            *lua_data, iids=processed)
-        return pipe.execute()
+                size = 0
+            lua_data.extend((action, prev_id, id, score, len(data)))
+            lua_data.extend(data)
+            processed.append(state.iid)
+            size += nbytes
+        chunks.append((lua_data, processed))
+        if len(chunks) > 1 and chunked is not None:
+            pipe = chunked
+        for lua_data, processed in chunks:
+            self._commit_chunk(pipe, meta, lua_data, processed)
+        self.expire_queries(pipe, meta)
+
+    def _commit_chunk(self, pipe, meta, lua_data, processed):
+        self.odmrun(pipe, 'commit', meta, (), self.meta_info(meta),
+                    len(processed), *lua_data, iids=processed)
+
+    def expire_queries(self, pipe, meta):
+        '''When the ``query_cache`` is enabled, increase the version of model
+``meta`` so that cached query results are not reused.'''
+        if self.query_cache:
+            pipe.incr(self.basekey(meta, 'qver'))
+
+    def bulk_insert(self, meta, instances, batch_size, ids=False):
+        return self.execute(self._bulk_insert(meta, instances, batch_size,
+                                              ids))
+
+    def _bulk_insert(self, meta, instances, batch_size, ids):
+        tpy = meta.pk_to_python
+        instances = iter(instances)
+        saved = [] if ids else 0
+        while True:
+            batch = list(islice(instances, batch_size))
+            if not batch:
+                break
+            pipe = self.client.pipeline()
+            self.commit_instances(pipe, meta, batch)
+            response = yield pipe.execute()
+            errors = []
+            for result in response:
+                if not isinstance(result, session_result):
+                    continue
+                for r in result.results:
+                    if isinstance(r, Exception):
+                        errors.append(str(r))
+                    elif ids:
+                        saved.append(tpy(r.id, self))
+                    else:
+                        saved += 1
+            if errors:
+                raise CommitException('\n\n'.join(errors),
+                                      failures=len(errors))
+        yield saved
+
+    def _gather(self, queries):
+        if self.cluster:
+            # keys of different models are on different hash slots
+            results = yield super(BackendDataServer, self)._gather(queries)
+            yield results
+            return
+        # Build the queries and add their load script to the same pipeline
+        pipe = self.client.pipeline(
+            transaction=any((query._atomic for query in queries)))
+        loads = []
+        for query in queries:
+            if self.read_only:
+                backend_query = query.backend_query()
+            else:
+                backend_query = query.backend_query(pipe=pipe)
+            loads.append((backend_query, backend_query._batch(pipe)))
+        response = yield pipe.execute()
+        results = []
+        for backend_query, index in loads:
+            if index is None:
+                items = yield backend_query.items()
+            else:
+                N, items = response[index]
+                backend_query._got_count(N)
+                items = backend_query._cache_items(items)
+            results.append(items)
+        yield results
+
+    def _execute_session(self, pipe, chunked=None):
+        response = yield pipe.execute()
+        if chunked is not None and chunked.command_stack:
+            # large commits, other clients are served between the chunks
+            chunks = yield chunked.execute()
+            response = list(response) + list(chunks)
+        response = self._merge_results(response)
+        pipe = self._invalidation_pipe(response)
+        if pipe is not None:
+            yield pipe.execute()
+        yield response
+
+    def _invalidation_pipe(self, response):
+        # A pipeline publishing the invalidation messages of the
+        # session_results in response, None if there is nothing to publish
+        if self.invalidation:
+            messages = list(self._invalidation_messages(response))
+            if messages:
+                pipe = self.client.pipeline(transaction=False)
+                channel = self.invalidation_channel()
+                for message in messages:
+                    pipe.publish(channel, message)
+                return pipe
+
+    def _merge_results(self, response):
+        # Merge the results of a model, split in several script calls,
+        # into the first session_result of the model
+        merged = []
+        positions = {}
+        for result in response:
+            if isinstance(result, session_result):
+                index = positions.get(result.meta)
+                if index is not None:
+                    meta, results = merged[index]
+                    merged[index] = session_result(
+                        meta, chain(results, result.results))
+                    continue
+                positions[result.meta] = len(merged)
+            merged.append(result)
+        return merged
+
+    def _invalidation_messages(self, response):
+        # Compact invalidation messages, one for each model and batch of
+        # invalidation_batch_size ids
+        encoding = self.client.encoding
+        size = self.invalidation_batch_size
+        for index, result in enumerate(response):
+            if not isinstance(result, session_result):
+                continue
+            results = list(result.results)
+            response[index] = session_result(result.meta, results)
+            ids = [native_str(r.id, encoding) for r in results
+                   if not isinstance(r, Exception)]
+            for start in range(0, len(ids), size):
+                yield json.dumps([result.meta.modelkey,
+                                  ids[start:start+size]])
 
     def accumulate_delete(self, pipe, backend_query):
-        # Accumulate models queries for a delete. It loops through the
-        # related models to build related queries.
+        # Accumulate models queries for a delete.
         # We pass the pipe since the backend_query may have been evaluated
         # using a different pipe
+        for meta, keys, meta_info in self._delete_plan(pipe, backend_query):
+            self.odmrun(pipe, 'delete', meta, keys, meta_info)
+            self.expire_queries(pipe, meta)
+
+    def _delete_plan(self, pipe, backend_query, plan=None):
+        # Build the queries of a delete in pipe. It loops through the
+        # related models to build related queries and returns the list of
+        # (meta, keys, meta_info) to delete, related models first.
+        plan = [] if plan is None else plan
         if backend_query is None:
-            return
+            return plan
+        if backend_query.read_only:
+            # a read-only query has no key with the ids to delete
+            backend_query = self.Query(backend_query.queryelem, pipe=pipe,
+                                       backend=self)
         session = backend_query.session
         query = backend_query.queryelem
         keys = (backend_query.query_key,)
@@ -839,9 +1484,91 @@ class BackendDataServer(stdnet.BackendDataServer):
         for rmanager in rel_managers:
             # IMPORTANT. delete only if field is required
             if rmanager.field.required:
-                rq = rmanager.query_from_query(query).backend_query(pipe=pipe)
-                self.accumulate_delete(pipe, rq)
-        self.odmrun(pipe, 'delete', meta, keys, meta_info)
+                rq = self.bind_query(rmanager.query_from_query(query), pipe)
+                self._delete_plan(pipe, rq, plan)
+        plan.append((meta, keys, meta_info))
+        return plan
+
+    def delete_query(self, query, batch_size, progress=None, callback=None):
+        return self.execute(self._delete_query(query, batch_size, progress,
+                                               callback))
+
+    def server_version(self):
+        '''The version of the redis server as a tuple of integers.'''
+        return self.execute(self._get_server_version())
+
+    def _get_server_version(self):
+        if self._server_version is None:
+            info = yield self.client.info()
+            version = info.get('Server', info).get('redis_version', '0')
+            self._server_version = tuple((int(v) for v in
+                                          version.split('.')))
+        yield self._server_version
+
+    def _delete_query(self, query, batch_size, progress, callback):
+        # UNLINK is available from redis 4.0
+        version = yield self._get_server_version()
+        unlink = 1 if version >= (4,) else 0
+        # Build the query and the queries of related models first
+        pipe = self.client.pipeline()
+        backend_query = self.bind_query(query, pipe)
+        plan = self._delete_plan(pipe, backend_query)
+        for meta, _, _ in plan:
+            # cached queries of the models are not reused from now on
+            self.expire_queries(pipe, meta)
+        if pipe.command_stack:
+            yield pipe.execute()
+        # keys of filtered queries expire, they are kept alive until all
+        # their ids are deleted, however long it takes
+        temp_keys = [keys[0] for meta, keys, _ in plan
+                     if keys[0] != self.basekey(meta, 'id')]
+        deleted = []
+        for meta, keys, meta_info in plan:
+            tpy = meta.pk_to_python
+            ids = []
+            left = True
+            while left:
+                # each script call pops batch_size ids from the query key
+                pipe = self.client.pipeline(transaction=False)
+                for key in temp_keys:
+                    pipe.expire(key, backend_query.expire)
+                self.odmrun(pipe, 'delete', meta, keys, meta_info,
+                            batch_size, unlink)
+                self.expire_queries(pipe, meta)
+                if meta.ordering:
+                    pipe.zcard(keys[0])
+                else:
+                    pipe.scard(keys[0])
+                response = yield pipe.execute()
+                meta_result = response[len(temp_keys)]
+                result = session_result(meta, list(meta_result.results))
+                batch = [tpy(r.id, self) for r in result.results]
+                ids.extend(batch)
+                left = response[-1]
+                if callback:
+                    callback(meta, batch)
+                invalidation = self._invalidation_pipe([result])
+                if invalidation is not None:
+                    yield invalidation.execute()
+                if progress:
+                    progress(meta, len(ids), left)
+            if keys[0] in temp_keys:
+                temp_keys.remove(keys[0])
+                yield self.client.delete(keys[0])
+            if meta is backend_query.meta:
+                deleted = ids
+        yield deleted
+
+    def bind_query(self, query, pipe):
+        '''The :class:`RedisQuery` of ``query`` evaluated by this backend
+with commands added to ``pipe``. It is the backend query of ``query`` unless
+this is not its backend or it is read-only.'''
+        query = query.construct()
+        if query.backend == self:
+            backend_query = query.backend_query(pipe=pipe)
+            if not backend_query.read_only:
+                return backend_query
+        return self.Query(query, pipe=pipe, backend=self)
 
     def tempkey(self, meta, name=None):
         return self.basekey(meta, TMP, name if name is not None else
@@ -857,7 +1584,7 @@ class BackendDataServer(stdnet.BackendDataServer):
 
     def model_keys(self, meta):
         pattern = '%s*' % self.basekey(meta)
-        return self.execute(self.client.keys(pattern), self._decode_keys)
+        return self.execute(self.client.scankeys(pattern), self._decode_keys)
 
     def instance_keys(self, obj):
         meta = obj._meta
@@ -868,8 +1595,8 @@ class BackendDataServer(stdnet.BackendDataServer):
             keys.append(be.id)
         return keys
 
-    def flush_structure(self, sm, pipe):
-        for instance in sm.structures:
+    def flush_structure(self, structures, pipe):
+        for instance in structures:
             be = self.structure(instance, pipe)
             be.action = instance.action
             if be.action == 'update':
@@ -884,3 +1611,35 @@ class BackendDataServer(stdnet.BackendDataServer):
             return [decode(v, encoding) for v in value]
         else:
             return decode(value, encoding)
+
+
+class AsyncioBackendDataServer(BackendDataServer):
+    '''A redis :class:`BackendDataServer` for asyncio_ applications,
+selected by the ``redis+asyncio`` scheme of the
+:ref:`connection string <connection-string>`. Requires python 3.4 or above.
+
+The client is the :class:`stdnet.backends.redisb.client.aio.Redis` and all
+asynchronous operations, such as :meth:`stdnet.odm.Session.commit`,
+:meth:`stdnet.odm.Query.all` or structure methods, return an
+:class:`asyncio.Future`::
+
+    models = odm.Router('redis+asyncio://127.0.0.1:6379?db=3')
+    ...
+    with models.session().begin() as t:
+        t.add(models.instrument(name='eni', ccy='EUR', type='equity'))
+    yield from t.on_result
+    instruments = yield from models.instrument.filter(ccy='EUR').all()
+
+Queries can be iterated with ``async for``, loading items in chunks.
+
+.. _asyncio: https://docs.python.org/3/library/asyncio.html
+'''
+    def connect(self, address, params):
+        return asyncio_client(address, **params)
+
+    def execute(self, result, callback=None):
+        result = maybe_async(result)
+        return result.add_callback(callback) if callback else result
+
+
+from .sharded import ShardedBackendDataServer
@@ -2,15 +2,24 @@ try:
     from . import async
 except ImportError:
     async = None
+try:
+    from . import aio
+except ImportError:     # asyncio is not available
+    aio = None
 
-from .extensions import (RedisScript, read_lua_file, redis, get_script,
-                         RedisDb, RedisKey, RedisDataFormatter)
-from .client import Redis
+from .extensions import (RedisScript, read_lua_file, lua_file, redis,
+                         get_script, registered_scripts, register_script,
+                         unregister_script, RedisDb, RedisKey,
+                         RedisDataFormatter)
+from .client import Redis, ConnectionPool, pools
 
 RedisError = redis.RedisError
 
-__all__ = ['redis_client', 'RedisScript', 'read_lua_file', 'RedisError',
-           'RedisDb', 'RedisKey', 'RedisDataFormatter', 'get_script']
+__all__ = ['redis_client', 'asyncio_client', 'RedisScript', 'read_lua_file',
+           'lua_file', 'RedisError',
+           'RedisDb', 'RedisKey', 'RedisDataFormatter', 'get_script',
+           'registered_scripts', 'register_script', 'unregister_script',
+           'ConnectionPool', 'pools']
 
 
 def redis_client(address=None, connection_pool=None, timeout=None,
@@ -18,9 +27,12 @@ def redis_client(address=None, connection_pool=None, timeout=None,
     '''Get a new redis client.
 
     :param address: a ``host``, ``port`` tuple.
-    :param connection_pool: optional connection pool.
-    :param timeout: socket timeout.
+    :param connection_pool: optional connection pool. If not given, the
+        pool with the same parameters is obtained from the process-wide
+        :data:`pools` registry.
     :param timeout: socket timeout.
+    :param kwargs: connection parameters, including the ``max_connections``
+        and ``idle_timeout`` of the pool.
     '''
     if not connection_pool:
         if timeout == 0:
@@ -30,6 +42,17 @@ def redis_client(address=None, connection_pool=None, timeout=None,
             return async.pool.redis(address, **kwargs)
         else:
             kwargs['socket_timeout'] = timeout
-            return Redis(address[0], address[1], **kwargs)
-    else:
-        return Redis(connection_pool=connection_pool)
+            connection_pool = pools.get(address, **kwargs)
+    return Redis(connection_pool=connection_pool)
+
+
+def asyncio_client(address=None, **kwargs):
+    '''Get a new redis client for asyncio. Requires python 3.4 or above.
+
+    :param address: a ``host``, ``port`` tuple.
+    :param kwargs: the ``db``, ``password``, ``max_connections`` and ``loop``
+        parameters of :class:`stdnet.backends.redisb.client.aio.ConnectionPool`.
+    '''
+    if not aio:
+        raise ImportError('Asynchronous connection requires asyncio.')
+    return aio.redis_client(address, **kwargs)
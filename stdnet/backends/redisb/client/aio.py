@@ -0,0 +1,541 @@
+'''The :mod:`stdnet.backends.redisb.client.aio` module implements an
+asynchronous redis client for asyncio_. Commands return a
+:class:`stdnet.utils.aio.Future`.
+It is used by the ``redis+asyncio`` scheme of the
+:ref:`connection string <connection-string>`::
+
+    from stdnet import getdb
+
+    db = getdb('redis+asyncio://127.0.0.1:6379?db=3')
+
+All commands are pipelined on a single connection shared by the client, since
+redis replies in the same order commands are received. Blocking commands,
+such as ``BLPOP``, use a dedicated connection from the
+:class:`ConnectionPool`.
+'''
+import logging
+from collections import deque
+from functools import partial
+
+import asyncio
+
+from redis.connection import BaseParser
+from redis.exceptions import (ConnectionError, InvalidResponse,
+                              NoScriptError, WatchError)
+
+from stdnet.utils.aio import Future, get_event_loop, maybe_async
+
+from .extensions import (RedisExtensionsMixin, redis, BasePipeline,
+                         get_script, required_script)
+from .prefixed import PrefixedRedisMixin
+
+
+__all__ = ['RedisParser', 'RedisProtocol', 'ConnectionPool', 'Redis',
+           'PrefixedRedis', 'Pipeline', 'redis_client']
+
+
+LOGGER = logging.getLogger('stdnet.redis')
+BLOCKING_COMMANDS = frozenset(('BLPOP', 'BRPOP', 'BRPOPLPUSH'))
+parse_error = BaseParser().parse_error
+CRLF = b'\r\n'
+
+
+def encode(value, encoding='utf-8'):
+    if isinstance(value, bytes):
+        return value
+    elif isinstance(value, float):
+        value = repr(value)
+    elif not isinstance(value, str):
+        value = str(value)
+    return value.encode(encoding)
+
+
+def pack_command(args, encoding='utf-8'):
+    '''Pack a command into the redis protocol.'''
+    # command names such as "SCRIPT LOAD" are sent as separate arguments
+    args = tuple(args[0].split()) + tuple(args[1:])
+    output = [('*%d\r\n' % len(args)).encode('ascii')]
+    for value in args:
+        value = encode(value, encoding)
+        output.append(('$%d\r\n' % len(value)).encode('ascii'))
+        output.append(value)
+        output.append(CRLF)
+    return b''.join(output)
+
+
+class RedisParser(object):
+    '''A python parser for the redis protocol. Data is added to the parser
+via the :meth:`feed` method and replies are retrieved, one at a time, by
+:meth:`get`.
+
+Parsing resumes from where it stopped when more data arrives, so that large
+replies received in several chunks are parsed once only.'''
+    def __init__(self):
+        self._buffer = bytearray()
+        self._pos = 0
+        self._bulk = None
+        self._stack = []
+
+    def feed(self, data):
+        self._buffer.extend(data)
+
+    def get(self):
+        '''The next reply or ``False`` if not yet available. Error replies
+are returned as exception instances.'''
+        buffer = self._buffer
+        stack = self._stack
+        while True:
+            pos = self._pos
+            if self._bulk is not None:
+                length = self._bulk
+                if len(buffer) < pos + length + 2:
+                    return self._compact()
+                value = bytes(buffer[pos:pos+length])
+                self._pos = pos + length + 2
+                self._bulk = None
+            else:
+                end = buffer.find(CRLF, pos)
+                if end < 0:
+                    return self._compact()
+                rtype, line = buffer[pos:pos+1], bytes(buffer[pos+1:end])
+                self._pos = end + 2
+                if rtype == b'+':
+                    value = line
+                elif rtype == b':':
+                    value = int(line)
+                elif rtype == b'-':
+                    value = parse_error(line.decode('utf-8'))
+                elif rtype == b'$':
+                    length = int(line)
+                    if length >= 0:
+                        self._bulk = length
+                        continue
+                    value = None
+                elif rtype == b'*':
+                    length = int(line)
+                    if length > 0:
+                        stack.append((length, []))
+                        continue
+                    value = [] if length == 0 else None
+                else:
+                    self.__init__()
+                    raise InvalidResponse('Protocol Error: %r' % rtype)
+            # add the value to the arrays waiting for it
+            while stack:
+                length, array = stack[-1]
+                array.append(value)
+                if len(array) < length:
+                    break
+                stack.pop()
+                value = array
+            else:
+                self._compact()
+                return value
+
+    def _compact(self):
+        if self._pos:
+            del self._buffer[:self._pos]
+            self._pos = 0
+        return False
+
+
+class RedisProtocol(asyncio.Protocol):
+    '''A connection with a redis server. Requests are pipelined and
+their replies matched in order.'''
+    transport = None
+
+    def __init__(self, loop, on_close=None):
+        self.loop = loop
+        self.on_close = on_close
+        self.parser = RedisParser()
+        self.waiting = deque()
+        self.closed = False
+
+    @property
+    def pending(self):
+        '''Number of requests waiting for replies.'''
+        return len(self.waiting)
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        parser = self.parser
+        parser.feed(data)
+        reply = parser.get()
+        while reply is not False:
+            if not self.waiting:
+                # a reply nobody asked for, such as a message pushed by the
+                # server, cannot be matched with a request
+                LOGGER.warning('Unexpected reply from redis %r', reply)
+                reply = parser.get()
+                continue
+            future, expected, replies = self.waiting[0]
+            replies.append(reply)
+            if len(replies) == expected:
+                self.waiting.popleft()
+                if not future.cancelled():
+                    future.set_result(replies)
+            reply = parser.get()
+
+    def connection_lost(self, exc):
+        self.closed = True
+        waiting, self.waiting = self.waiting, deque()
+        for future, _, _ in waiting:
+            if not future.done():
+                future.set_exception(
+                    ConnectionError('Connection with redis lost'))
+        if self.on_close:
+            self.on_close(self)
+
+    def execute(self, commands):
+        '''Send ``commands`` to the server and return a :class:`Future`
+called back with the list of replies.'''
+        future = Future(loop=self.loop)
+        if self.closed:
+            future.set_exception(ConnectionError('Connection closed'))
+        else:
+            self.transport.write(b''.join((pack_command(c) for c in commands)))
+            self.waiting.append((future, len(commands), []))
+        return future
+
+    def close(self):
+        if self.transport and not self.closed:
+            if self.loop.is_closed():
+                # the transport was released with its event loop
+                self.closed = True
+            else:
+                self.transport.close()
+
+
+class ConnectionPool(object):
+    '''A pool of :class:`RedisProtocol` connections with a redis server.
+
+:parameter address: the ``host``, ``port`` tuple of the server.
+:parameter db: the redis database number.
+:parameter password: optional password.
+:parameter max_connections: maximum number of dedicated connections for
+    blocking commands. Requests in excess wait for a connection to be
+    released.
+:parameter loop: the event loop, by default the current event loop when
+    a connection is created.
+'''
+    def __init__(self, address, db=0, password=None, max_connections=None,
+                 loop=None, encoding='utf-8'):
+        self.address = tuple(address)
+        self.db = int(db or 0)
+        self.password = password
+        self.max_connections = int(max_connections or 32)
+        self.encoding = encoding
+        self._loop = loop
+        self._shared = None
+        self._available = deque()
+        self._waiting = deque()
+        self._in_use_connections = set()
+        self._size = 0
+
+    def __repr__(self):
+        return '%s:%s' % self.address
+    __str__ = __repr__
+
+    @property
+    def loop(self):
+        return self._loop or get_event_loop()
+
+    def request(self, commands, blocking=False):
+        '''Execute ``commands`` and return a :class:`Future` called back with
+the list of replies. If ``blocking`` is true, the commands are executed on a
+dedicated connection.'''
+        loop = self.loop
+        result = Future(loop=loop)
+        if blocking:
+            connection = self.acquire(loop)
+        else:
+            connection = self._shared_connection(loop)
+        connection.add_done_callback(
+            partial(self._send, commands, result, blocking))
+        return result
+
+    def acquire(self, loop=None):
+        '''A :class:`Future` called back with a dedicated connection which
+must be given back to the pool via :meth:`release`.'''
+        loop = loop or self.loop
+        future = Future(loop=loop)
+        while self._available:
+            connection = self._available.pop()
+            if connection.loop is loop and not connection.closed:
+                self._in_use_connections.add(connection)
+                future.set_result(connection)
+                return future
+            connection.close()
+        if self._size < self.max_connections:
+            self._connect(loop).add_done_callback(
+                partial(self._acquired, future))
+        else:
+            self._waiting.append(future)
+        return future
+
+    def release(self, connection):
+        '''Give back a connection obtained from :meth:`acquire`.'''
+        self._in_use_connections.discard(connection)
+        if connection.closed:
+            return
+        while self._waiting:
+            future = self._waiting.popleft()
+            if not future.done():
+                self._in_use_connections.add(connection)
+                future.set_result(connection)
+                return
+        self._available.append(connection)
+
+    def disconnect(self):
+        '''Close all connections.'''
+        connections = list(self._available) + list(self._in_use_connections)
+        if self._shared and self._shared.done() and \
+                not self._shared.exception():
+            connections.append(self._shared.result())
+        self._shared = None
+        self._available.clear()
+        for connection in connections:
+            connection.close()
+
+    def _shared_connection(self, loop):
+        shared = self._shared
+        if shared is not None:
+            if not shared.done():
+                if shared._loop is loop:
+                    return shared
+            elif not shared.exception():
+                connection = shared.result()
+                if connection.loop is loop and not connection.closed:
+                    return shared
+                connection.close()
+        self._shared = shared = self._connect(loop, shared=True)
+        return shared
+
+    def _connect(self, loop, shared=False):
+        future = Future(loop=loop)
+        if not shared:
+            self._size += 1
+        on_close = None if shared else self._lost
+        host, port = self.address
+        connect = loop.create_connection(
+            lambda: RedisProtocol(loop, on_close), host, port)
+        asyncio.ensure_future(connect, loop=loop).add_done_callback(
+            partial(self._connected, future, shared))
+        return future
+
+    def _connected(self, future, shared, fut):
+        if fut.exception():
+            if not shared:
+                self._size -= 1
+            future.set_exception(fut.exception())
+            return
+        connection = fut.result()[1]
+        commands = []
+        if self.password:
+            commands.append(('AUTH', self.password))
+        if self.db:
+            commands.append(('SELECT', self.db))
+        if commands:
+            # the connection is available once the server has accepted them
+            connection.execute(commands).add_done_callback(
+                partial(self._check_setup, future, shared, connection))
+        else:
+            future.set_result(connection)
+
+    def _check_setup(self, future, shared, connection, fut):
+        exc = fut.exception()
+        if not exc:
+            errors = [r for r in fut.result() if isinstance(r, Exception)]
+            exc = errors[0] if errors else None
+        if exc:
+            # the pool size is reduced by _lost once the connection is closed
+            connection.close()
+            future.set_exception(exc)
+        else:
+            future.set_result(connection)
+
+    def _acquired(self, future, fut):
+        if fut.exception():
+            future.set_exception(fut.exception())
+        else:
+            self._in_use_connections.add(fut.result())
+            future.set_result(fut.result())
+
+    def _lost(self, connection):
+        self._size -= 1
+        self._in_use_connections.discard(connection)
+        if self._waiting and self._size < self.max_connections:
+            self._connect(connection.loop).add_done_callback(
+                partial(self._acquired, self._waiting.popleft()))
+
+    def _send(self, commands, result, blocking, fut):
+        if fut.exception():
+            result.set_exception(fut.exception())
+            return
+        connection = fut.result()
+        replies = connection.execute(commands)
+        if blocking:
+            replies.add_done_callback(lambda _: self.release(connection))
+        replies.add_done_callback(partial(self._received, result))
+
+    def _received(self, result, fut):
+        if result.cancelled():
+            return
+        if fut.exception():
+            result.set_exception(fut.exception())
+        else:
+            result.set_result(fut.result())
+
+
+class Redis(RedisExtensionsMixin, redis.StrictRedis):
+    '''An asynchronous redis client for asyncio_ with the stdnet
+:class:`RedisExtensionsMixin`.'''
+    def __init__(self, connection_pool):
+        self.connection_pool = connection_pool
+        self.response_callbacks = self.__class__.RESPONSE_CALLBACKS.copy()
+
+    @property
+    def is_async(self):
+        return True
+
+    @property
+    def encoding(self):
+        return self.connection_pool.encoding
+
+    def address(self):
+        return self.connection_pool.address
+
+    def prefixed(self, prefix):
+        '''Return a new :class:`PrefixedRedis` client.
+        '''
+        return PrefixedRedis(self, prefix)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return Pipeline(self, transaction, shard_hint)
+
+    def execute_command(self, *args, **options):
+        '''Execute a command and return a :class:`Future` called back with
+the parsed response.'''
+        command_name = args[0]
+        result = self.connection_pool.request(
+            (args,), blocking=command_name in BLOCKING_COMMANDS)
+        return result.add_callback(
+            lambda replies: self._parse(replies[0], command_name, options))
+
+    def parse_response(self, response, command_name, **options):
+        '''Parses a response from the redis server.'''
+        if command_name in self.response_callbacks:
+            return self.response_callbacks[command_name](response, **options)
+        return response
+
+    def execute_script(self, name, keys, *args, **options):
+        result = super(Redis, self).execute_script(name, keys, *args,
+                                                   **options)
+        if self.is_pipeline:
+            return result
+
+        def _retry(exc):
+            if not isinstance(exc, NoScriptError):
+                raise exc
+            # scripts were flushed from the server, load them again
+            script = get_script(name)
+            self.loaded_scripts(True)
+            pipe = self.pipeline(transaction=False)
+            for required in script.required_scripts:
+                pipe.script_load(required_script(script, required).script)
+            yield pipe.execute()
+            yield script(self, keys, args, options)
+        return result.add_callback(lambda r: r, _retry)
+
+    def _parse(self, response, command_name, options):
+        if isinstance(response, Exception):
+            raise response
+        return self.parse_response(response, command_name, **options)
+
+    def _run(self, gen):
+        return maybe_async(gen, self.connection_pool.loop)
+
+
+class PrefixedRedis(PrefixedRedisMixin, Redis):
+    pass
+
+
+class Pipeline(BasePipeline, Redis):
+    '''An asynchronous pipeline. Commands are sent in one batch by
+:meth:`execute`.'''
+    def __init__(self, client, transaction=True, shard_hint=None):
+        self.client = client
+        self.response_callbacks = client.response_callbacks
+        self.transaction = transaction
+        self.shard_hint = shard_hint
+        self.watching = False
+        self.connection = None
+        self.reset()
+
+    @property
+    def connection_pool(self):
+        return self.client.connection_pool
+
+    @property
+    def is_pipeline(self):
+        return True
+
+    def address(self):
+        return self.client.address()
+
+    def execute(self, raise_on_error=True):
+        '''Send the queued commands and return a :class:`Future` called back
+with the list of responses.'''
+        stack = self.command_stack
+        self.reset()
+        if not stack:
+            result = Future(loop=self.connection_pool.loop)
+            result.set_result([])
+            return result
+        commands = [args for args, _ in stack]
+        if self.transaction:
+            commands = [('MULTI',)] + commands + [('EXEC',)]
+        result = self.connection_pool.request(commands)
+        return result.add_callback(
+            partial(self._parse_replies, stack, raise_on_error))
+
+    def _parse_replies(self, stack, raise_on_error, replies):
+        if self.transaction:
+            errors = [r for r in replies[1:-1] if isinstance(r, Exception)]
+            replies = replies[-1]
+            if errors:
+                raise errors[0]
+            elif isinstance(replies, Exception):
+                raise replies
+            elif replies is None:
+                raise WatchError('Watched variable changed.')
+        callbacks = self.response_callbacks
+        data = []
+        for r, (args, options) in zip(replies, stack):
+            if not isinstance(r, Exception) and args[0] in callbacks:
+                r = callbacks[args[0]](r, **options)
+            data.append(r)
+        retry = self._retry_scripts(stack, data)
+        if retry:
+            return self._retried(stack, data, raise_on_error, *retry)
+        if raise_on_error:
+            self.raise_first_error(stack, data)
+        return data
+
+    def _retried(self, stack, data, raise_on_error, pipe, positions):
+        # scripts flushed from the server are loaded and executed again
+        replies = yield pipe.execute(raise_on_error=False)
+        for index, position in positions:
+            data[index] = replies[position]
+        if raise_on_error:
+            self.raise_first_error(stack, data)
+        yield data
+
+
+def redis_client(address, db=0, password=None, max_connections=None,
+                 loop=None, **kwargs):
+    '''Create a new asynchronous :class:`Redis` client.'''
+    pool = ConnectionPool(address, db, password, max_connections, loop)
+    return Redis(pool)
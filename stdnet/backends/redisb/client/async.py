@@ -16,7 +16,7 @@ from pulsar.apps import redis
 from pulsar.apps.redis.client import BasePipeline
 
 from .extensions import (RedisExtensionsMixin, get_script, RedisError,
-                         all_loaded_scripts)
+                         all_loaded_scripts, required_script)
 from .prefixed import PrefixedRedisMixin
 
 
@@ -51,7 +51,7 @@ class Redis(RedisExtensionsMixin, redis.Redis):
         loaded = all_loaded_scripts[address]
         toload = script.required_scripts.difference(loaded)
         for name in toload:
-            s = get_script(name)
+            s = required_script(script, name)
             yield self.script_load(s.script)
         loaded.update(toload)
         yield script(self, keys, args, options)
@@ -77,7 +77,7 @@ class Pipeline(BasePipeline, Redis):
         loaded = all_loaded_scripts[address]
         toload = script.required_scripts.difference(loaded)
         for name in toload:
-            s = get_script(name)
+            s = required_script(script, name)
             self.script_load(s.script)
         loaded.update(toload)
         return script(self, keys, args, options)
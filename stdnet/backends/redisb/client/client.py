@@ -16,6 +16,17 @@ Prefixed Client
    :members:
    :member-order: bysource
 
+Connection Pools
+~~~~~~~~~~~~~~~~~~
+
+.. autoclass:: ConnectionPool
+   :members:
+   :member-order: bysource
+
+.. autoclass:: ConnectionPools
+   :members:
+   :member-order: bysource
+
 RedisScript
 ~~~~~~~~~~~~~~~
 
@@ -26,7 +37,9 @@ RedisScript
 '''
 import os
 import io
+import time
 import socket
+import threading
 from copy import copy
 
 from .extensions import RedisExtensionsMixin, redis, BasePipeline
@@ -77,3 +90,115 @@ class Pipeline(BasePipeline, Redis):
     @property
     def is_pipeline(self):
         return True
+
+    def execute(self, raise_on_error=True):
+        '''Execute the queued commands. Scripts failing because they were
+flushed from the server are loaded and executed again, in a pipeline with
+the same transaction mode, without executing the other commands a second
+time.'''
+        stack = self.command_stack
+        response = super(Pipeline, self).execute(raise_on_error=False)
+        retry = self._retry_scripts(stack, response)
+        if retry:
+            pipe, positions = retry
+            replies = pipe.execute(raise_on_error=False)
+            for index, position in positions:
+                response[index] = replies[position]
+        if raise_on_error:
+            self.raise_first_error(stack, response)
+        return response
+
+
+class ConnectionPool(redis.ConnectionPool):
+    '''A redis-py connection pool which closes connections left idle for
+more than ``idle_timeout`` seconds.
+
+After a fork, connections inherited from the parent process are discarded
+without closing their sockets, which are still used by the parent.
+'''
+    def __init__(self, idle_timeout=None, **kwargs):
+        self.idle_timeout = idle_timeout
+        super(ConnectionPool, self).__init__(**kwargs)
+
+    def get_connection(self, command_name, *keys, **options):
+        if self.idle_timeout:
+            self.close_idle()
+        return super(ConnectionPool, self).get_connection(command_name,
+                                                          *keys, **options)
+
+    def release(self, connection):
+        connection.last_used = time.time()
+        super(ConnectionPool, self).release(connection)
+
+    def close_idle(self):
+        '''Close available connections idle for more than
+:attr:`idle_timeout` seconds.'''
+        expired = time.time() - self.idle_timeout
+        available = self._available_connections
+        # released connections are appended, the oldest come first
+        while available and getattr(available[0], 'last_used', 0) < expired:
+            try:
+                connection = available.pop(0)
+            except IndexError:
+                break
+            connection.disconnect()
+            self._created_connections -= 1
+
+    def _checkpid(self):
+        if self.pid != os.getpid():
+            with self._check_lock:
+                if self.pid != os.getpid():
+                    self.reset()
+
+
+class ConnectionPools(object):
+    '''Process-wide registry of :class:`ConnectionPool` shared by the redis
+clients with the same connection parameters. The registry is emptied in a
+forked process.'''
+    def __init__(self):
+        self._reset()
+
+    def get(self, address, max_connections=None, idle_timeout=None,
+            **params):
+        '''Return the :class:`ConnectionPool` connected to the ``host``,
+``port`` tuple ``address``, creating it if needed.
+
+:param max_connections: maximum number of connections of the pool.
+:param idle_timeout: seconds after which available connections are closed.
+:param params: connection parameters such as ``db`` and ``password``.
+'''
+        if max_connections is not None:
+            max_connections = int(max_connections)
+        if idle_timeout is not None:
+            idle_timeout = float(idle_timeout)
+        host, port = address
+        key = (host, int(port), max_connections, idle_timeout,
+               tuple(sorted(((k, str(v)) for k, v in params.items()))))
+        if self._pid != os.getpid():
+            self._reset()
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                pool = ConnectionPool(host=host, port=int(port),
+                                      max_connections=max_connections,
+                                      idle_timeout=idle_timeout, **params)
+                self._pools[key] = pool
+            return pool
+
+    def clear(self):
+        '''Disconnect and remove all pools.'''
+        with self._lock:
+            pools, self._pools = self._pools, {}
+        for pool in pools.values():
+            pool.disconnect()
+
+    def __len__(self):
+        return len(self._pools)
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._pools = {}
+
+
+pools = ConnectionPools()
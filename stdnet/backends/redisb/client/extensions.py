@@ -2,10 +2,12 @@ import os
 from hashlib import sha1
 from collections import namedtuple
 from datetime import datetime
+from functools import partial
 from copy import copy
 
 from stdnet.utils.structures import OrderedDict
 from stdnet.utils import iteritems, format_int
+from stdnet.backends import execute_generator
 from stdnet import odm
 
 try:
@@ -15,11 +17,25 @@ except ImportError:     # pragma    nocover
     raise ImproperlyConfigured('Redis backend requires redis python client')
 
 from redis.client import BasePipeline
+from redis.exceptions import NoScriptError
 
 RedisError = redis.RedisError
 p = os.path
 DEFAULT_LUA_PATH = p.join(p.dirname(p.dirname(p.abspath(__file__))), 'lua')
 redis_connection = namedtuple('redis_connection', 'address db')
+# Commands which give the same result when executed again: read-only
+# commands, expiries and the set operations and sort storing their result,
+# which overwrite the destination key. When retrying a pipeline after a
+# NOSCRIPT error, they are executed again if they follow a failed script,
+# since they may depend on it. Other commands are never executed twice.
+RETRY_COMMANDS = frozenset((
+    'EXISTS', 'EXPIRE', 'EXPIREAT', 'GET', 'HEXISTS', 'HGET', 'HGETALL',
+    'HKEYS', 'HLEN', 'HMGET', 'HVALS', 'LINDEX', 'LLEN', 'LRANGE', 'MGET',
+    'PEXPIRE', 'PEXPIREAT', 'PTTL', 'SCARD', 'SDIFF', 'SDIFFSTORE', 'SINTER',
+    'SINTERSTORE', 'SISMEMBER', 'SMEMBERS', 'SORT', 'STRLEN', 'SUNION',
+    'SUNIONSTORE', 'TTL', 'TYPE', 'ZCARD', 'ZCOUNT', 'ZINTERSTORE', 'ZRANGE',
+    'ZRANGEBYSCORE', 'ZRANK', 'ZREVRANGE', 'ZREVRANGEBYSCORE', 'ZREVRANK',
+    'ZSCORE', 'ZUNIONSTORE'))
 
 ###########################################################
 #    GLOBAL REGISTERED SCRIPT DICTIONARY
@@ -32,7 +48,32 @@ def registered_scripts():
 
 
 def get_script(script):
+    '''The registered :class:`RedisScript` with name ``script``. If ``script``
+is already a :class:`RedisScript` instance it is returned as it is.'''
+    if isinstance(script, RedisScript):
+        return script
     return _scripts.get(script)
+
+
+def required_script(script, name):
+    '''The script ``name`` required by the :class:`RedisScript` ``script``.
+A script requires itself, and it may have been unregistered since it was
+obtained.'''
+    return script if name == script.name else get_script(name)
+
+
+def register_script(script):
+    '''Register a :class:`RedisScript` instance created at runtime, so that
+it can be executed by name with :meth:`RedisExtensionsMixin.execute_script`.'''
+    _scripts[script.name] = script
+    return script
+
+
+def unregister_script(name):
+    '''Remove the script ``name`` from the registered scripts.'''
+    for loaded in all_loaded_scripts.values():
+        loaded.discard(name)
+    return _scripts.pop(name, None)
 ###########################################################
 
 
@@ -56,6 +97,13 @@ def read_lua_file(dotted_module, path=None, context=None):
     return data
 
 
+def lua_file(dotted_module, path=None):
+    '''A lua script in the stdnet/lib/lua directory which is read only when
+the :attr:`RedisScript.script` is first needed. Use it in place of
+:func:`read_lua_file` for the :attr:`RedisScript.script` attribute.'''
+    return partial(read_lua_file, dotted_module, path)
+
+
 def parse_info(response):
     '''Parse the response of Redis's INFO command into a Python dict.
 In doing so, convert byte data into unicode.'''
@@ -96,8 +144,14 @@ def dict_update(original, data):
 
 class RedisExtensionsMixin(object):
     '''Extension for Redis clients.
-    '''
+
+.. attribute:: scan_count
+
+    Number of keys requested to ``SCAN`` at each iteration by the methods
+    matching a key pattern, such as :meth:`delpattern`. Default ``1000``.
+'''
     prefix = ''
+    scan_count = 1000
     RESPONSE_CALLBACKS = dict_update(
         redis.StrictRedis.RESPONSE_CALLBACKS,
         {'EVALSHA': script_callback,
@@ -122,7 +176,9 @@ class RedisExtensionsMixin(object):
 
         The script must be implemented via subclassing :class:`RedisScript`.
 
-        :param name: the name of the registered script.
+        :param name: the name of the registered script or a
+            :class:`RedisScript` instance, which is executed even if it is
+            not registered.
         :param keys: tuple/list of keys pased to the script.
         :param args: argument passed to the script.
         :param options: key-value parameters passed to the
@@ -132,26 +188,149 @@ class RedisExtensionsMixin(object):
         script = get_script(name)
         if not script:
             raise RedisError('No such script "%s"' % name)
-        address = self.address()
-        if address not in all_loaded_scripts:
-            all_loaded_scripts[address] = set()
-        loaded = all_loaded_scripts[address]
+        loaded = self.loaded_scripts()
         toload = script.required_scripts.difference(loaded)
         for name in toload:
-            s = get_script(name)
-            self.script_load(s.script)
+            self.script_load(required_script(script, name).script)
         loaded.update(toload)
-        return script(self, keys, args, options)
+        if self.is_pipeline or self.is_async:
+            return script(self, keys, args, options)
+        try:
+            return script(self, keys, args, options)
+        except NoScriptError:
+            # scripts were flushed from the server, load them again
+            self.loaded_scripts(True)
+            for name in script.required_scripts:
+                self.script_load(required_script(script, name).script)
+            return script(self, keys, args, options)
+
+    def loaded_scripts(self, reset=False):
+        '''The set of names of scripts loaded in the redis server. If
+``reset`` is ``True`` the set is emptied first.'''
+        address = self.address()
+        if reset or address not in all_loaded_scripts:
+            all_loaded_scripts[address] = set()
+        return all_loaded_scripts[address]
 
-    def countpattern(self, pattern):
-        '''delete all keys matching *pattern*.
+    def preload_scripts(self, names=None):
+        '''Load the registered scripts in the redis server with one pipeline,
+rather than when they are first executed. Call it at startup.
+
+:param names: optional list of script names. By default all registered
+    scripts are loaded.
+:return: the list of SHA-1 of loaded scripts.
+'''
+        if names is None:
+            names = registered_scripts()
+        pipe = self.pipeline(transaction=False)
+        for name in names:
+            script = get_script(name)
+            if not script:
+                raise RedisError('No such script "%s"' % name)
+            pipe.script_load(script.script)
+        self.loaded_scripts().update(names)
+        return pipe.execute()
+
+    def _retry_scripts(self, stack, response):
+        # Handle scripts of a pipeline which failed because they were
+        # flushed from the server. The other commands have already been
+        # executed, within MULTI/EXEC as well. Return a new pipeline, with
+        # the same transaction mode, loading the scripts and executing again,
+        # in order, the failed scripts and the RETRY_COMMANDS after the first
+        # failure, which may read their results, and the list of
+        # (position in response, position in the new pipeline replies)
+        # tuples. Return None when no script failed.
+        failed = [i for i, r in enumerate(response)
+                  if isinstance(r, NoScriptError) and
+                  stack[i][1].get('script')]
+        if not failed:
+            return
+        loaded = self.loaded_scripts(True)
+        toload = {}
+        for index in failed:
+            script = stack[index][1]['script']
+            for name in script.required_scripts:
+                toload[name] = required_script(script, name)
+        pipe = self.__class__(self.client, self.transaction, self.shard_hint)
+        for name in sorted(toload):
+            pipe.script_load(toload[name].script)
+        loaded.update(toload)
+        positions = []
+        for index in range(failed[0], len(stack)):
+            args, options = stack[index]
+            if options.get('script'):
+                if index not in failed:
+                    continue
+            elif args[0] not in RETRY_COMMANDS:
+                continue
+            # commands are added to the stack as they were sent
+            pipe.command_stack.append((args, options))
+            positions.append((index, len(pipe.command_stack) - 1))
+        return pipe, positions
+
+    def countpattern(self, pattern, count=None):
+        '''Count the keys matching *pattern*.
+
+        Keys are iterated with ``SCAN``, *count* keys at a time, so that
+        the server is not blocked. Keys returned more than once by ``SCAN``
+        are counted once. Keys added or removed during the iteration may be
+        counted or not.
         '''
-        return self.execute_script('countpattern', (), pattern)
+        seen = set()
+
+        def _count(keys):
+            size = len(seen)
+            seen.update(keys)
+            return len(seen) - size
+        return self._run(self._scan(pattern, count, _count, 0))
 
-    def delpattern(self, pattern):
+    def delpattern(self, pattern, count=None):
         '''delete all keys matching *pattern*.
+
+        Keys are iterated with ``SCAN`` and deleted *count* keys at a time.
+        '''
+        return self._run(self._scan(pattern, count,
+                                    lambda keys: self.delete(*keys), 0))
+
+    def scankeys(self, pattern, count=None):
+        '''The list of keys matching *pattern*, iterated with ``SCAN``
+        *count* keys at a time. Use it in place of ``KEYS``.
+        '''
+        seen = set()
+
+        def _new(keys):
+            keys = [key for key in keys if key not in seen]
+            seen.update(keys)
+            return keys
+        return self._run(self._scan(pattern, count, _new, []))
+
+    def keyinfo(self, pattern, count=None):
+        '''The list of :class:`RedisKey` matching *pattern*, loaded by the
+        ``keyinfo`` script *count* keys at a time.
         '''
-        return self.execute_script('delpattern', (), pattern)
+        return self._run(self._scan(
+            pattern, count, lambda keys: self.execute_script('keyinfo', keys),
+            []))
+
+    def _scan(self, pattern, count, callback, result):
+        # Iterate keys matching pattern with SCAN and add the result of
+        # callback on each batch of keys to result
+        count = count or self.scan_count
+        prefix = len(self.prefix)
+        cursor = 0
+        while True:
+            cursor, keys = yield self.scan(cursor, match=pattern, count=count)
+            if keys:
+                if prefix:
+                    keys = [key[prefix:] for key in keys]
+                value = yield callback(keys)
+                result += value
+            if not int(cursor):
+                break
+        yield result
+
+    def _run(self, gen):
+        return execute_generator(gen)
 
     def zdiffstore(self, dest, keys, withscores=False):
         '''Compute the difference of multiple sorted.
@@ -187,9 +366,12 @@ class RedisScriptMeta(type):
     def __new__(cls, name, bases, attrs):
         super_new = super(RedisScriptMeta, cls).__new__
         abstract = attrs.pop('abstract', False)
+        if not isinstance(attrs.get('script', property()), property):
+            # the source is assembled by the script property when needed
+            attrs['source'] = attrs.pop('script')
         new_class = super_new(cls, name, bases, attrs)
         if not abstract:
-            self = new_class(new_class.script, new_class.__name__)
+            self = new_class(new_class.source, new_class.__name__)
             _scripts[self.name] = self
         return new_class
 
@@ -201,7 +383,8 @@ class RedisScript(RedisScriptMeta('_RS', (object,), {'abstract': True})):
 
     .. attribute:: script
 
-        The lua script to run
+        The lua script to run. It can be a string, a :func:`lua_file` or a
+        list of them which are concatenated when the script is first needed.
 
     .. attribute:: required_scripts
 
@@ -217,14 +400,12 @@ class RedisScript(RedisScriptMeta('_RS', (object,), {'abstract': True})):
     .. _SHA-1: http://en.wikipedia.org/wiki/SHA-1
     '''
     abstract = True
-    script = None
+    source = None
     required_scripts = ()
 
     def __init__(self, script, name):
-        if isinstance(script, (list, tuple)):
-            script = '\n'.join(script)
         self.__name = name
-        self.script = script
+        self.source = script
         rs = set((name,))
         rs.update(self.required_scripts)
         self.required_scripts = rs
@@ -233,6 +414,16 @@ class RedisScript(RedisScriptMeta('_RS', (object,), {'abstract': True})):
     def name(self):
         return self.__name
 
+    @property
+    def script(self):
+        if not hasattr(self, '_script'):
+            source = self.source
+            if not isinstance(source, (list, tuple)):
+                source = (source,)
+            self._script = '\n'.join((s() if hasattr(s, '__call__') else s
+                                      for s in source))
+        return self._script
+
     @property
     def sha1(self):
         if not hasattr(self, '_sha1'):
@@ -269,29 +460,8 @@ class RedisScript(RedisScriptMeta('_RS', (object,), {'abstract': True})):
 ############################################################################
 ##    BATTERY INCLUDED REDIS SCRIPTS
 ############################################################################
-class countpattern(RedisScript):
-    script = '''\
-return # redis.call('keys', ARGV[1])
-'''
-
-    def preprocess_args(self, client, args):
-        if args and client.prefix:
-            args = tuple(('%s%s' % (client.prefix, a) for a in args))
-        return args
-
-
-class delpattern(countpattern):
-    script = '''\
-local n = 0
-for i,key in ipairs(redis.call('keys', ARGV[1])) do
-  n = n + redis.call('del', key)
-end
-return n
-'''
-
-
 class zpop(RedisScript):
-    script = read_lua_file('commands.zpop')
+    script = lua_file('commands.zpop')
 
     def callback(self, response, withscores=False, **options):
         if not response or not withscores:
@@ -300,23 +470,22 @@ class zpop(RedisScript):
 
 
 class zdiffstore(RedisScript):
-    script = read_lua_file('commands.zdiffstore')
+    script = lua_file('commands.zdiffstore')
 
 
 class move2set(RedisScript):
-    script = (read_lua_file('commands.utils'),
-              read_lua_file('commands.move2set'))
+    script = (lua_file('commands.utils'),
+              lua_file('commands.move2set'))
 
 
 class keyinfo(RedisScript):
-    script = read_lua_file('commands.keyinfo')
+    script = lua_file('commands.keyinfo')
 
-    def preprocess_args(self, client, args):
-        if args and client.prefix:
-            a = ['%s%s' % (client.prefix, args[0])]
-            a.extend(args[1:])
-            args = tuple(a)
-        return args
+    def __call__(self, client, keys, args, options):
+        if args and not keys:
+            # keys matching a pattern are loaded in batches
+            return client.keyinfo(*args)
+        return super(keyinfo, self).__call__(client, keys, args, options)
 
     def callback(self, response, redis_client=None, **options):
         client = redis_client
@@ -435,16 +604,25 @@ class RedisDbManager(odm.Manager):
 
 
 class KeyQuery(odm.QueryBase):
-    '''A lazy query for keys in a redis database.'''
+    '''A lazy query for keys in a redis database. Keys are iterated with
+``SCAN`` and their information is loaded in batches of ``scan_count`` keys.'''
     db = None
+    pattern = '*'
+    slice = None
+    scan_count = None
 
     def count(self):
-        return self.db.client.countpattern(self.pattern)
+        return self.db.client.countpattern(self.pattern, self.scan_count)
 
     def filter(self, db=None):
         self.db = db
         return self
 
+    def search(self, pattern):
+        o = copy(self)
+        o.pattern = pattern
+        return o
+
     def all(self):
         return list(self)
 
@@ -463,16 +641,36 @@ class KeyQuery(odm.QueryBase):
             return self[slic:slic+1][0]
 
     def __iter__(self):
+        # Keys are scanned and their information loaded in batches
         db = self.db
         c = db.client
+        start, num = 1, None
         if self.slice:
             start, num = self.get_start_num(self.slice)
-            qs = c.execute_script('keyinfo', (), self.pattern, start, num)
-        else:
-            qs = c.execute_script('keyinfo', (), self.pattern)
-        for q in qs:
-            q.database = db
-            yield q
+        count = self.scan_count or c.scan_count
+        cursor, prefix, seen = 0, len(c.prefix), set()
+        while num is None or num > 0:
+            cursor, keys = c.scan(cursor, match=self.pattern, count=count)
+            if prefix:
+                keys = [key[prefix:] for key in keys]
+            # SCAN can return a key more than once
+            keys = [key for key in keys if key not in seen]
+            seen.update(keys)
+            if start > len(keys):
+                start -= len(keys)
+                keys = ()
+            elif start > 1:
+                keys = keys[start-1:]
+                start = 1
+            if num is not None:
+                keys = keys[:num]
+                num -= len(keys)
+            if keys:
+                for q in c.execute_script('keyinfo', keys):
+                    q.database = db
+                    yield q
+            if not cursor:
+                break
 
     def get_start_num(self, slic):
         start, step, stop = slic.start, slic.step, slic.stop
@@ -35,6 +35,16 @@ def prefix_sort(pfix, args):
     return nargs
 
 
+def prefix_scan(pfix, args):
+    # prefix the MATCH pattern, or match all the keys with the prefix
+    args = list(args)
+    for n, a in enumerate(args):
+        if str(a).upper() == 'MATCH':
+            args[n+1] = '%s%s' % (pfix, args[n+1])
+            return args
+    return args + ['MATCH', '%s*' % pfix]
+
+
 def pop_list_result(pfix, result):
     if result:
         return (result[0][len(pfix):], result[1])
@@ -62,6 +72,8 @@ class PrefixedRedisMixin(object):
                                   'INFO', 'LASTSAVE', 'PING',
                                   'PSUBSCRIBE', 'PUBLISH', 'PUNSUBSCRIBE',
                                   'QUIT', 'RANDOMKEY', 'SAVE', 'SCRIPT',
+                                  'SCRIPT EXISTS', 'SCRIPT FLUSH',
+                                  'SCRIPT KILL', 'SCRIPT LOAD',
                                   'SELECT', 'SHUTDOWN', 'SLAVEOF',
                                   'SLOWLOG', 'SUBSCRIBE', 'SYNC',
                                   'TIME', 'UNSUBSCRIBE', 'UNWATCH'))
@@ -82,6 +94,7 @@ class PrefixedRedisMixin(object):
         'MIGRATE': prefix_all,
         'RENAME': prefix_all,
         'RENAMENX': prefix_all,
+        'SCAN': prefix_scan,
         'SDIFF': prefix_all,
         'SDIFFSTORE': prefix_all,
         'SINTER': prefix_all,
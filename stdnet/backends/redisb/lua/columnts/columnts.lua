@@ -45,10 +45,11 @@ local columnts = {
     --
     -- Delete timeseries
     del = function(self)
-        local keys = redis.call('keys', self.key .. '*')
-        if # keys > 0 then
-            redis.call('del', unpack(keys))
+        local keys = {self.key, self.fieldskey}
+        for _, name in ipairs(self:fields()) do
+            table.insert(keys, self:fieldkey(name))
         end
+        redis.call('del', unpack(keys))
     end,
     --
     -- Return the ordered list of times
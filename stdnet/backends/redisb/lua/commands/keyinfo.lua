@@ -1,22 +1,7 @@
--- Retrieve information about keys
--- A list of keys, sorted in alphabetical order, is returned
-local start, stop, keys, num
-if # ARGV > 0 then -- If argv is provided, it is the pattern to search
-    keys = redis.call('KEYS', ARGV[1])
-    if # ARGV > 1 then
-    	start = ARGV[2] + 0
-    	num = ARGV[3] + 0
-    else
-    	start = 1
-    	num = # keys
-    end
-elseif # KEYS > 0 then -- If keys are provided, use them
-    keys = KEYS
-    start = 1
-    num = # keys
-else -- Nothing to do
-    return {}
-end
+-- Retrieve information about the keys in KEYS.
+-- Keys matching a pattern are scanned by the client and passed in batches.
+local keys = KEYS
+local start, num = 1, # keys
 local type_table = {}
 type_table['set'] = 'scard'
 type_table['zset'] = 'zcard'
@@ -7,6 +7,8 @@ local AUTO_ID, COMPOSITE_ID, CUSTOM_ID = 1, 2, 3
 local odm = {
     redis=nil,
     TMP_KEY_LENGTH = 12,
+    -- Maximum number of arguments in a variadic index command
+    INDEX_BATCH_SIZE = 1000,
     ModelMeta = {
         namespace = '',
         id_type = AUTO_ID,
@@ -15,7 +17,16 @@ local odm = {
         multi_fields = {},
         sorted = false,
         autoincr = false,
-        indices = {}
+        indices = {},
+        sorted_indices = {},
+        lex_indices = {}
+    },
+    -- Range selectors which can be resolved by a sorted index
+    score_bounds = {
+        ge = {'min', false},
+        gt = {'min', true},
+        le = {'max', false},
+        lt = {'max', true}
     },
     range_selectors = {
         ge = function (v, v1)
@@ -33,6 +44,9 @@ local odm = {
         startswith = function (v, v1)
             return string.sub(v, 1, string.len(v1)) == v1
         end,
+        istartswith = function (v, v1)
+            return string.sub(string.lower(v), 1, string.len(v1)) == string.lower(v1)
+        end,
         endswidth = function (v, v1)
             return string.sub(v, string.len(v) - string.len(v1) + 1) == v1
         end,
@@ -41,6 +55,57 @@ local odm = {
         end
     }
 }
+-- Convert a {value, exclusive} pair into a ZRANGEBYSCORE bound
+function odm.score_bound(bound)
+    local value = bound[1]
+    if value == math.huge then
+        return '+inf'
+    elseif value == -math.huge then
+        return '-inf'
+    end
+    value = string.format('%.17g', value)
+    if bound[2] then
+        value = '(' .. value
+    end
+    return value
+end
+-- Split ranges into the ZRANGEBYSCORE min and max bounds and the ranges
+-- which cannot be expressed as score bounds. Bounds are nil if no range is
+-- a score bound.
+function odm.score_range(ranges)
+    local remaining, min, max, bound, value, used = {}, {-math.huge}, {math.huge}, false
+    for _, range in ipairs(ranges) do
+        bound, value = odm.score_bounds[range.qtype], tonumber(range.value)
+        if bound and value and # range.nested == 0 then
+            used = true
+            if bound[1] == 'min' then
+                if value > min[1] or (value == min[1] and bound[2]) then
+                    min = {value, bound[2]}
+                end
+            elseif value < max[1] or (value == max[1] and bound[2]) then
+                max = {value, bound[2]}
+            end
+        else
+            table.insert(remaining, range)
+        end
+    end
+    if used then
+        return remaining, {odm.score_bound(min), odm.score_bound(max)}
+    end
+    return remaining
+end
+-- Convert a python slice into the offset and count of a SORT LIMIT
+function odm.sort_limits(start, stop, size)
+    if stop == nil then
+        stop = size
+    elseif stop < 0 then
+        stop = stop + size
+    end
+    if start < 0 then
+        start = start + size
+    end
+    return start, stop - start
+end
 -- Model pseudo-class
 odm.Model = {
     --[[
@@ -48,8 +113,11 @@ odm.Model = {
     --]]
     init = function (self, meta)
         self.meta = tabletools.json_clean(meta)
+        self.meta.sorted_indices = self.meta.sorted_indices or {}
+        self.meta.lex_indices = self.meta.lex_indices or {}
         self.idset = self.meta.namespace .. ':id'    -- key for set containing all ids
         self.auto_ids = self.meta.namespace .. ':ids' -- key for auto ids
+        self.index_ops = {}  -- index changes, applied by _flush_indices
         return self
     end,
     --[[
@@ -70,6 +138,7 @@ odm.Model = {
             p = idx0 + length_data
             results[count] = self:_commit_instance(action, prev_id, id, score, data)
         end
+        self:_flush_indices()
         return results
     end,
     --[[
@@ -81,7 +150,7 @@ odm.Model = {
             can be one of 'set', 'value' or a range filter.
     --]]
     query = function (self, destkey, field, queries)
-        local ranges, unique, qtype, oper, nested = {}, self.meta.indices[field]
+        local ranges, unique, qtype, oper, nested, handled = {}, self.meta.indices[field]
         for i, value in ipairs(queries) do
             if 2*math.floor(i/2) == i then
                 if qtype == 'set' then
@@ -95,7 +164,7 @@ odm.Model = {
                     local selector = odm.range_selectors[qtype]
                     if selector then
                         value, nested = unpack(cjson.decode(value))
-                        table.insert(ranges, {selector=selector, value=value, nested=nested})
+                        table.insert(ranges, {qtype=qtype, selector=selector, value=value, nested=nested})
                     else
                         error('Cannot understand query type "' .. qtype .. '".')
                     end
@@ -104,6 +173,16 @@ odm.Model = {
                 qtype = value
             end
         end
+        if # ranges > 0 and self.meta.sorted_indices[field] then
+            -- Resolve score ranges with the sorted index
+            ranges, handled = self:_scoreranges(destkey, field, ranges, oper)
+            oper = oper or handled
+        end
+        if # ranges > 0 and self.meta.lex_indices[field] then
+            -- Resolve a prefix lookup with the lexicographical index
+            ranges, handled = self:_lexranges(destkey, field, ranges, oper)
+            oper = oper or handled
+        end
         if # ranges > 0 then
             if not oper then
                 self:_selectranges(destkey, self.idset, field, ranges)
@@ -114,24 +193,35 @@ odm.Model = {
         return self:setsize(destkey)
     end,
     --[[
-        Delete a query stored in key id
+        Delete a query stored in key id. When count is given, only count
+        ids are removed from the key and deleted. When unlink is true the
+        keys of multi fields are removed with UNLINK.
     --]]
-    delete = function (self, key)
-        local ids, results = redis_members(key), {}
+    delete = function (self, key, count, unlink)
+        local ids, results, remove = nil, {}, 'del'
+        if count then
+            ids = self:popids(key, count)
+        else
+            ids = redis_members(key)
+        end
+        if unlink then
+            remove = 'unlink'
+        end
         for _, id in ipairs(ids) do
             local idkey = self:object_key(id)
-            self:_update_indices(false, id)
+            self:_update_indices(false, id, self:_index_values(idkey))
             local num = odm.redis.call('del', idkey) + 0
             self:remove_from_set(self.idset, id)
             if self.meta.multi_fields then
                 for _, name in ipairs(self.meta.multi_fields) do
-                    odm.redis.call('del', idkey .. ':' .. name)
+                    odm.redis.call(remove, idkey .. ':' .. name)
                 end
             end
             if num == 1 then
                 table.insert(results, id)
             end
         end
+        self:_flush_indices()
         return results
     end,
     --[[
@@ -146,15 +236,29 @@ odm.Model = {
     --[[
         Load instances from ids stored in a query temporary key
         :param key: the key containing the set of ids
-        :param options: dictionary of options 
+        :param options: dictionary of options. If ``size`` is set the
+            size of the query is returned as fourth element and the
+            ``explicit`` ordering slice is relative to it.
     --]]
     load = function (self, key, options)
-        local result, ids, related_items
+        local result, ids, related_items, cursor, size
         options = tabletools.json_clean(options)
+        if options.expire and options.expire > 0 then
+            odm.redis.call('expire', key, options.expire)
+        end
         if options.get and options.get ~= '' then
             return redis_members(key)
+        elseif options.ordering == 'scan' then
+            -- a page of an unordered set, start is the scan cursor
+            ids = odm.redis.call('sscan', key, options.start, 'count', options.stop)
+            cursor, ids = ids[1], ids[2]
         elseif options.ordering == 'explicit' then
-            ids = self:_explicit_ordering(key, options.start, options.stop, options.order)
+            local start, stop = options.start, options.stop
+            if options.size then
+                size = self:setsize(key)
+                start, stop = odm.sort_limits(start, stop, size)
+            end
+            ids = self:_explicit_ordering(key, start, stop, options.order)
         elseif options.ordering == 'DESC' then
             ids = odm.redis.call('zrevrange', key, options.start, options.stop)
         elseif options.ordering == 'ASC' then
@@ -162,7 +266,121 @@ odm.Model = {
         else
             ids = odm.redis.call('smembers', key)
         end
-        -- Now load fields
+        result, related_items = self:_load_ids(ids, options)
+        if options.size then
+            return {result, related_items, 0, size or self:setsize(key)}
+        end
+        return {result, related_items, cursor}
+    end,
+    --[[
+        Evaluate a query tree and load its instances without writing to the
+        database, so that it can run against read-only replicas.
+        :param node: the query tree, see read_query
+        :param options: the options of load. In addition, if ``count`` is
+            set only the size of the query is returned, if ``has`` is set
+            returns 1 if the query contains the ``has`` id, 0 otherwise.
+    --]]
+    read = function (self, node, options)
+        local query, ids, result, related_items, start, stop, size
+        options = tabletools.json_clean(options)
+        query = self:read_query(node)
+        if node.get ~= '' then
+            -- a list of field values
+            if options.count then
+                return # query
+            end
+            return query
+        elseif options.count then
+            return tabletools.count(query)
+        elseif options.has then
+            return query[options.has] and 1 or 0
+        end
+        start, stop = options.start, options.stop
+        if options.get and options.get ~= '' then
+            ids = {}
+            for id, _ in pairs(query) do
+                table.insert(ids, id)
+            end
+            return ids
+        end
+        if options.ordering == 'explicit' then
+            if options.size then
+                size = tabletools.count(query)
+                start, stop = odm.sort_limits(start, stop, size)
+            end
+            ids = self:_read_ordering(query, start, stop, options.order)
+        elseif options.ordering == 'DESC' or options.ordering == 'ASC' then
+            ids = self:_read_range(query, start, stop, options.ordering == 'DESC')
+        else
+            ids = {}
+            for id, _ in pairs(query) do
+                table.insert(ids, id)
+            end
+        end
+        result, related_items = self:_load_ids(ids, options)
+        if options.size then
+            return {result, related_items, 0, size or tabletools.count(query)}
+        end
+        return {result, related_items}
+    end,
+    --[[
+        Evaluate a query tree node. A node is a table with
+            meta: the model metadata of the node
+            keyword: 'set', 'intersect', 'union' or 'diff'
+            name: the field to query when keyword is 'set'
+            args: array of {query_type, value} pairs for 'set' nodes,
+                  where value is a node when query_type is 'set'.
+                  An array of nodes for the other keywords.
+            get: the field to unwind, or an empty string
+        Returns a table mapping ids to scores, or the list of values of
+        the ``get`` field.
+    --]]
+    read_query = function (self, node)
+        local ids, child, values
+        if node.keyword == 'set' then
+            ids = self:_read_set(node.name, node.args)
+        else
+            for i, arg in ipairs(node.args) do
+                child = self:_read_ids(self:_read_child(arg))
+                if i == 1 then
+                    ids = child
+                elseif node.keyword == 'intersect' then
+                    for id, _ in pairs(ids) do
+                        if not child[id] then
+                            ids[id] = nil
+                        end
+                    end
+                elseif node.keyword == 'union' then
+                    for id, score in pairs(child) do
+                        ids[id] = score
+                    end
+                elseif node.keyword == 'diff' then
+                    for id, _ in pairs(child) do
+                        ids[id] = nil
+                    end
+                else
+                    error('Could not perform ' .. node.keyword .. ' operation')
+                end
+            end
+            ids = ids or {}
+        end
+        if node.get ~= '' then
+            values = {}
+            for id, _ in pairs(ids) do
+                local value = odm.redis.call('hget', self:object_key(id), node.get)
+                if value then
+                    table.insert(values, value)
+                end
+            end
+            return values
+        end
+        return ids
+    end,
+    --
+    --          INTERNAL METHODS
+    --
+    _load_ids = function (self, ids, options)
+        local result, related_items
         if options.fields and # options.fields > 0 then
             if # options.fields == 1 and options.fields[1] == self.meta.id_name then
                 result = ids
@@ -183,11 +401,9 @@ odm.Model = {
         else
             related_items = {}
         end
-        return {result, related_items}
+        return result, related_items
     end,
     --
-    --          INTERNAL METHODS
-    --
     object_key = function (self, id)
         return self.meta.namespace .. ':obj:' .. id
     end,
@@ -204,6 +420,16 @@ odm.Model = {
         return idxkey
     end,
     --
+    -- Sorted set mapping field values (as scores) to instance ids
+    sorted_index_key = function (self, field)
+        return self.meta.namespace .. ':sdx:' .. field
+    end,
+    --
+    -- Sorted set, with all scores set to 0, of lower(value)\0value\0id members
+    lex_index_key = function (self, field)
+        return self.meta.namespace .. ':ldx:' .. field
+    end,
+    --
     --[[
         A temporary key in the model namespace
     --]]
@@ -237,6 +463,17 @@ odm.Model = {
         end
     end,
     --
+    -- Remove and return count ids from setid. Requires redis 3.2 or above.
+    popids = function(self, setid, count)
+        if self.meta.sorted then
+            local ids = odm.redis.call('zrange', setid, 0, count-1)
+            odm.redis.call('zremrangebyrank', setid, 0, count-1)
+            return ids
+        else
+            return odm.redis.call('spop', setid, count)
+        end
+    end,
+    --
     setadd = function(self, setid, score, id, autoincr)
         if autoincr then
             score = odm.redis.call('zincrby', setid, score, id)
@@ -310,6 +547,13 @@ odm.Model = {
     end,
     --
     _union = function(self, destkey, field, value)
+        if self.meta.sorted_indices[field] and tonumber(value) then
+            local sdxkey = self:sorted_index_key(field)
+            for _, id in ipairs(odm.redis.call('zrangebyscore', sdxkey, value, value)) do
+                self:_add(destkey, field, id)
+            end
+            return
+        end
         local idxkey = self:index_key(field, value)
         if self.meta.sorted then
             odm.redis.call('zunionstore', destkey, 2, destkey, idxkey)
@@ -332,6 +576,76 @@ odm.Model = {
         end
     end,
     --
+    --[[
+        Select ids from the sorted index of field. Only ranges which can be
+        expressed as score bounds are used, the remaining ranges are returned
+        so that they can be processed by _selectranges.
+    --]]
+    _scoreranges = function(self, destkey, field, ranges, oper)
+        local remaining, ids = odm.score_range(ranges)
+        if not ids then
+            return ranges, false
+        end
+        ids = odm.redis.call('zrangebyscore', self:sorted_index_key(field), unpack(ids))
+        self:_store_ids(destkey, field, ids, oper)
+        return remaining, true
+    end,
+    --[[
+        Select ids from the lexicographical index of field for the first
+        startswith or istartswith range. The remaining ranges are returned.
+    --]]
+    _lexranges = function(self, destkey, field, ranges, oper)
+        local remaining, ids, prefix, lower, n, id, value = {}, {}
+        for _, range in ipairs(ranges) do
+            if not prefix and # range.nested == 0 and
+                    (range.qtype == 'startswith' or range.qtype == 'istartswith') then
+                prefix = range
+            else
+                table.insert(remaining, range)
+            end
+        end
+        if not prefix then
+            return ranges, false
+        end
+        lower = string.lower(tostring(prefix.value))
+        for _, member in ipairs(odm.redis.call('zrangebylex', self:lex_index_key(field),
+                                               '[' .. lower, '[' .. lower .. '\255')) do
+            id = string.match(member, '%z([^%z]*)$')
+            n = (string.len(member) - string.len(id) - 2)/2
+            value = string.sub(member, n + 2, 2*n + 1)
+            if prefix.qtype == 'istartswith' or prefix.selector(value, prefix.value) then
+                table.insert(ids, id)
+            end
+        end
+        self:_store_ids(destkey, field, ids, oper)
+        return remaining, true
+    end,
+    --
+    -- Store ids into destkey. If oper is true, intersect with destkey.
+    _store_ids = function(self, destkey, field, ids, oper)
+        if oper then
+            local matched = {}
+            for _, id in ipairs(ids) do
+                if self:_in_set(destkey, id) then
+                    table.insert(matched, id)
+                end
+            end
+            odm.redis.call('del', destkey)
+            ids = matched
+        end
+        for _, id in ipairs(ids) do
+            self:_add(destkey, field, id)
+        end
+    end,
+    --
+    _in_set = function(self, setid, id)
+        if self.meta.sorted then
+            return odm.redis.call('zscore', setid, id) ~= false
+        else
+            return odm.redis.call('sismember', setid, id) + 0 == 1
+        end
+    end,
+    --
     _selectranges = function(self, destkey, fromkey, field, ranges)
         local ordered, ids, scores, value, key, status = self.meta.sorted
         if ordered then
@@ -399,14 +713,15 @@ odm.Model = {
         		prev_id = id
         		action = 'add'
         	end
-            local idkey, original_data, field = self:object_key(prev_id), {}
+            local idkey, original_data, values = self:object_key(prev_id), {}
+            local same_key = prev_id .. '' == id .. ''
             if action ~= 'add' then  -- override or update
                 original_data = odm.redis.call('hgetall', idkey)
                 -- remove indices
-                self:_update_indices(false, prev_id)
+                self:_update_indices(false, prev_id, tabletools.asdict(original_data))
                 -- when overriding, remove all data from previous hash table
                 -- only if the previous id is the same as the current one.
-                if action == 'override' and prev_id .. '' == id .. '' then
+                if action == 'override' and same_key then
                     odm.redis.call('del', idkey)
                 end
             end
@@ -421,11 +736,25 @@ odm.Model = {
             if # data > 0 then
                 odm.redis.call('hmset', idkey, unpack(data))
             end
-            errors = self:_update_indices(true, id, prev_id, score)
+            -- the indexed values of the instance, without reading them back
+            -- unless the hash table could contain data not known here
+            if created_id or (same_key and action ~= 'add') then
+                values = tabletools.asdict(data)
+                if action == 'update' then
+                    for field, value in pairs(tabletools.asdict(original_data)) do
+                        if values[field] == nil then
+                            values[field] = value
+                        end
+                    end
+                end
+            else
+                values = self:_index_values(idkey)
+            end
+            errors = self:_update_indices(true, id, values, prev_id, score)
             -- An error has occurred. Rollback changes.
             if # errors > 0 then
                 -- Remove indices
-                self:_update_indices(false, id)
+                self:_update_indices(false, id, values)
                 if action == 'add' then
                     self:remove_from_set(self.idset, id)
                     if created_id then
@@ -436,7 +765,7 @@ odm.Model = {
                     id = prev_id
                     idkey = self:object_key(id)
                     odm.redis.call('hmset', idkey, unpack(original_data))
-                    self:_update_indices(true, id, prev_id, score)
+                    self:_update_indices(true, id, tabletools.asdict(original_data), prev_id, score)
                 end
             end
         end
@@ -447,11 +776,16 @@ odm.Model = {
         end
     end,
     --
-    _update_indices = function (self, update, id, oldid, score)
+    --[[
+        Add or remove the indices of instance id. values is a table mapping
+        field names to field values. Unique constraints are checked and
+        updated immediately, all other index changes are collected and
+        applied by _flush_indices.
+    --]]
+    _update_indices = function (self, update, id, values, oldid, score)
         local idkey, errors, idxkey, value = self:object_key(id), {}
         for field, unique in pairs(self.meta.indices) do
-            -- obtain the field value
-            value = odm.redis.call('hget', idkey, field)
+            value = values[field]
             if unique then
                 idxkey = self:map_key(field) -- id for the hash table mapping field value to instance ids
                 if update then
@@ -466,7 +800,9 @@ odm.Model = {
 	                            -- remove the field from the instance hashtable so that
 	                            -- the next call to _update_indices won't delete the index. Important!
 	                            odm.redis.call('hdel', idkey, field)
+	                            values[field] = nil
 	                            table.insert(errors, 'Unique constraint "' .. field .. '" violated: "' .. value .. '" is already in database.')
+	                            value = nil
 	                        else
                                 odm.redis.call('hset', idxkey, value, id)
                             end
@@ -475,18 +811,324 @@ odm.Model = {
                 elseif value then
                     odm.redis.call('hdel', idxkey, value)
                 end
-            else
+            elseif not self.meta.sorted_indices[field] or not tonumber(value) then
+                -- instances without a numeric value, such as null fields,
+                -- are kept in the index set of sorted indices as well
                 idxkey = self:index_key(field, value)
-                if update then
-                    self:setadd(idxkey, score, id)
+                if not update then
+                    self:_index_op(idxkey, id, false, self.meta.sorted)
+                elseif self.meta.sorted then
+                    self:_index_op(idxkey, id, score, true)
                 else
-                    self:remove_from_set(idxkey, id)
+                    self:_index_op(idxkey, id, true, false)
+                end
+            end
+            -- sorted index, the field value is the score
+            if self.meta.sorted_indices[field] then
+                idxkey = self:sorted_index_key(field)
+                if not update then
+                    self:_index_op(idxkey, id, false, true)
+                elseif tonumber(value) then
+                    self:_index_op(idxkey, id, value, true)
                 end
             end
+            -- lexicographical index
+            if self.meta.lex_indices[field] and value then
+                idxkey = self:lex_index_key(field)
+                value = string.lower(value) .. '\0' .. value .. '\0' .. id
+                self:_index_op(idxkey, value, update and 0, true)
+            end
         end
         return errors
     end,
     --
+    -- Read the values of indexed fields from the hash table at idkey
+    _index_values = function (self, idkey)
+        local fields, values = {}, {}
+        for field, _ in pairs(self.meta.indices) do
+            table.insert(fields, field)
+        end
+        if # fields > 0 then
+            for i, value in ipairs(odm.redis.call('hmget', idkey, unpack(fields))) do
+                if value then
+                    values[fields[i]] = value
+                end
+            end
+        end
+        return values
+    end,
+    --[[
+        Record a change in an index. score is false when the member is
+        removed from the index, the score (or true for sets) otherwise.
+        Only the last change for a member is kept.
+    --]]
+    _index_op = function (self, key, member, score, sorted)
+        local op = self.index_ops[key]
+        if not op then
+            op = {sorted=sorted, members={}}
+            self.index_ops[key] = op
+        end
+        op.members[member] = score
+    end,
+    --
+    -- Apply index changes with one variadic command per index key
+    _flush_indices = function (self)
+        for key, op in pairs(self.index_ops) do
+            local adds, rems, batch = {}, {}, odm.INDEX_BATCH_SIZE
+            for member, score in pairs(op.members) do
+                if score == false then
+                    table.insert(rems, member)
+                elseif op.sorted then
+                    table.insert(adds, score)
+                    table.insert(adds, member)
+                else
+                    table.insert(adds, member)
+                end
+            end
+            for i = 1, # rems, batch do
+                odm.redis.call(op.sorted and 'zrem' or 'srem', key,
+                               unpack(rems, i, math.min(i + batch - 1, # rems)))
+            end
+            -- sorted sets take score, member pairs
+            if op.sorted then
+                batch = 2*odm.INDEX_BATCH_SIZE
+            end
+            for i = 1, # adds, batch do
+                odm.redis.call(op.sorted and 'zadd' or 'sadd', key,
+                               unpack(adds, i, math.min(i + batch - 1, # adds)))
+            end
+        end
+        self.index_ops = {}
+    end,
+    --
+    --      READ-ONLY QUERIES
+    --
+    -- Evaluate a child node with its own model. The second value is true
+    -- when the result is a list of field values.
+    _read_child = function (self, node)
+        return odm.model(node.meta):read_query(node), node.get ~= ''
+    end,
+    --
+    -- Convert the result of a child node into a table of ids and scores
+    _read_ids = function (self, members, is_list)
+        if not is_list then
+            return members
+        end
+        local ids = {}
+        for _, id in ipairs(members) do
+            self:_read_add(ids, id)
+        end
+        return ids
+    end,
+    --
+    _read_set = function (self, field, args)
+        local unique, ranges, ids, oper, nested = self.meta.indices[field], {}, {}, false
+        if field == self.meta.id_name and # args == 0 then
+            -- all instances
+            self:_read_index(ids, self.idset)
+            return ids
+        end
+        for _, arg in ipairs(args) do
+            local qtype, value = arg[1], arg[2]
+            if qtype == 'set' then
+                oper = true
+                local members, is_list = self:_read_child(value)
+                if is_list then
+                    for _, v in ipairs(members) do
+                        self:_read_value(ids, field, unique, v)
+                    end
+                else
+                    for v, _ in pairs(members) do
+                        self:_read_value(ids, field, unique, v)
+                    end
+                end
+            elseif qtype == 'value' then
+                oper = true
+                self:_read_value(ids, field, unique, value)
+            else
+                local selector = odm.range_selectors[qtype]
+                if selector then
+                    value, nested = unpack(cjson.decode(value))
+                    table.insert(ranges, {qtype=qtype, selector=selector, value=value, nested=nested})
+                else
+                    error('Cannot understand query type "' .. qtype .. '".')
+                end
+            end
+        end
+        if # ranges > 0 then
+            if not oper then
+                ids = self:_read_candidates(field, ranges)
+            end
+            ids = self:_read_ranges(ids, field, ranges)
+        end
+        return ids
+    end,
+    --
+    _read_value = function (self, ids, field, unique, value)
+        if field == self.meta.id_name then
+            self:_read_add(ids, value)
+        elseif unique then
+            self:_read_add(ids, odm.redis.call('hget', self:map_key(field), value))
+        elseif unique == false then
+            if self.meta.sorted_indices[field] and tonumber(value) then
+                for _, id in ipairs(odm.redis.call('zrangebyscore', self:sorted_index_key(field), value, value)) do
+                    self:_read_add(ids, id)
+                end
+            else
+                self:_read_index(ids, self:index_key(field, value))
+            end
+        else
+            error('Cannot query on field "' .. field .. '". Not an index.')
+        end
+    end,
+    --
+    -- Add id, if it exists, to ids
+    _read_add = function (self, ids, id)
+        if id then
+            if self.meta.sorted then
+                local score = odm.redis.call('zscore', self.idset, id)
+                if score then
+                    ids[id] = tonumber(score)
+                end
+            elseif odm.redis.call('sismember', self.idset, id) + 0 == 1 then
+                ids[id] = 0
+            end
+        end
+    end,
+    --
+    -- Add the members of the index at key to ids
+    _read_index = function (self, ids, key)
+        if self.meta.sorted then
+            local members = odm.redis.call('zrange', key, 0, -1, 'withscores')
+            for i = 1, # members, 2 do
+                ids[members[i]] = tonumber(members[i+1])
+            end
+        else
+            for _, id in ipairs(odm.redis.call('smembers', key)) do
+                ids[id] = 0
+            end
+        end
+    end,
+    --
+    -- Candidate ids for range selections, from the sorted index if possible
+    _read_candidates = function (self, field, ranges)
+        local ids, remaining, bounds = {}
+        if self.meta.sorted_indices[field] then
+            remaining, bounds = odm.score_range(ranges)
+        end
+        if bounds then
+            for _, id in ipairs(odm.redis.call('zrangebyscore', self:sorted_index_key(field), unpack(bounds))) do
+                self:_read_add(ids, id)
+            end
+        else
+            self:_read_index(ids, self.idset)
+        end
+        return ids
+    end,
+    --
+    _read_ranges = function (self, ids, field, ranges)
+        local key, value
+        if field ~= self.meta.id_name then
+            for _, range in ipairs(ranges) do
+                table.insert(range.nested, field)
+            end
+        end
+        for id, _ in pairs(ids) do
+            for _, range in ipairs(ranges) do
+                if # range.nested > 0 then
+                    key, value = self:_nested_field(id, range.nested)
+                else
+                    value = id
+                end
+                if not (value and range.selector(value, range.value)) then
+                    ids[id] = nil
+                    break
+                end
+            end
+        end
+        return ids
+    end,
+    --
+    -- Sort ids as the SORT command does and apply the LIMIT start, count
+    _read_ordering = function (self, ids, start, count, order)
+        local list, values, desc, alpha, value, key, status = {}, {}, order.desc, order.method == 'ALPHA'
+        for id, _ in pairs(ids) do
+            if order.field == '' then
+                value = id
+            else
+                value, key = odm.redis.call('hget', self:object_key(id), order.field)
+                if order.nested then
+                    for n, name in ipairs(order.nested) do
+                        if 2*math.floor(n/2) == n then
+                            value = odm.redis.call('hget', key, name)
+                        else
+                            status, key = pcall(function() return name .. ':obj:' .. value end)
+                            if not status then
+                                value = nil
+                                break
+                            end
+                        end
+                    end
+                end
+            end
+            if alpha then
+                values[id] = value or ''
+            else
+                values[id] = tonumber(value) or 0
+            end
+            table.insert(list, id)
+        end
+        -- ties are sorted by id
+        table.sort(list, function (a, b)
+            local va, vb = values[a], values[b]
+            if va == vb then
+                va, vb = a, b
+            end
+            if desc then
+                return va > vb
+            end
+            return va < vb
+        end)
+        if start > 0 or count > 0 then
+            start = math.max(start, 0)
+            if count < 0 then
+                count = # list
+            end
+            list = tabletools.slice(list, start + 1, math.min(start + count, # list))
+        end
+        return list
+    end,
+    --
+    -- Sort ids by score and select the ZRANGE start, stop
+    _read_range = function (self, ids, start, stop, desc)
+        local list, size = {}
+        for id, _ in pairs(ids) do
+            table.insert(list, id)
+        end
+        table.sort(list, function (a, b)
+            local sa, sb = ids[a], ids[b]
+            if sa == sb then
+                sa, sb = a, b
+            end
+            if desc then
+                return sa > sb
+            end
+            return sa < sb
+        end)
+        size = # list
+        if start < 0 then
+            start = math.max(start + size, 0)
+        end
+        if stop < 0 then
+            stop = stop + size
+        end
+        stop = math.min(stop, size - 1)
+        if start > stop then
+            return {}
+        end
+        return tabletools.slice(list, start + 1, stop + 1)
+    end,
+    --
     -- Perform explicit ordering via redis SORT command.
     _explicit_ordering = function (self, key, start, stop, order)
         local okey, tkeys, sortargs, bykey, ids, status = key, {}, {}
@@ -619,7 +1261,7 @@ odm.Model = {
 --
 -- Constructor
 function odm.model(meta)
-    return odm.Model:init(meta)
+    return setmetatable({}, {__index=odm.Model}):init(meta)
 end
 -- Return the module only when this module is not in REDIS
 if not redis then
@@ -647,9 +1289,19 @@ else
         load = function(self, model, keys, options, args)
             return model:load(first_key(keys), cjson.decode(options))
         end,
+        -- Evaluate and load a query without writing to the database
+        read = function(self, model, keys, node, args)
+            return model:read(cjson.decode(node), cjson.decode(args[1]))
+        end,
         -- delete a query
-        delete = function(self, model, keys, ...)
-            return model:delete(first_key(keys))
+        delete = function(self, model, keys, count, args)
+            local unlink = args ~= nil and args[1] == '1'
+            count = tonumber(count)
+            if count and redis.replicate_commands then
+                -- writes follow the random SPOP in redis 3.2 to 4
+                redis.replicate_commands()
+            end
+            return model:delete(first_key(keys), count, unlink)
         end,
         -- recursively add id to a set
         aggregate = function(self, model, keys, field, args)
@@ -9,6 +9,15 @@ tabletools.init = function (size, value)
     return vector
 end
 
+-- Number of keys in a table
+tabletools.count = function (tbl)
+    local n = 0
+    for _, _ in pairs(tbl) do
+        n = n + 1
+    end
+    return n
+end
+
 -- Check if two arrays are equals
 tabletools.equal = function (v1, v2)
     if # v1 == # v2 then
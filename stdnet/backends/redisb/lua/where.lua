@@ -9,7 +9,17 @@ if redis then
     local destkey, key = KEYS[1], KEYS[2]
     local meta = cjson.decode(ARGV[1])
     local load_only
-    local ids = redis.call('smembers', key)
+    local ids, scores = {{}}, {{}}
+    -- sorted id sets keep the score of the elements
+    if meta.sorted then
+        local members = redis.call('zrange', key, 0, -1, 'withscores')
+        for i = 1, # members, 2 do
+            ids[# ids + 1] = members[i]
+            scores[members[i]] = members[i+1]
+        end
+    else
+        ids = redis.call('smembers', key)
+    end
     if destkey == key then
         redis.call('del', key)
     end
@@ -47,7 +57,11 @@ if redis then
             end
         end
         if {0[where_clause]} then
-            redis.call('sadd', destkey, id)
+            if meta.sorted then
+                redis.call('zadd', destkey, scores[id], id)
+            else
+                redis.call('sadd', destkey, id)
+            end
         end
     end
 end
\ No newline at end of file
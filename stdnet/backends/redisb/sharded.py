@@ -0,0 +1,439 @@
+'''Horizontal sharding of model data across several redis servers.
+
+A sharded backend is obtained from a
+:ref:`connection string <connection-string>` with the ``redis+sharded``
+scheme and a comma separated list of addresses::
+
+    from stdnet import getdb
+
+    backend = getdb('redis+sharded://10.0.0.1:6379,10.0.0.2:6379?db=3')
+
+Instances are stored on the shard selected by a consistent hash of their
+primary key, unless their model is pinned to a shard with
+:meth:`ShardedBackendDataServer.pin`. Auto ids are allocated by the first
+shard so that they are unique across shards.
+
+Queries are sent to all the shards, or only to the shards storing the
+primary keys of the query, and the results are merged according to the
+ordering of the query. Queries on related models, ``load_related`` and
+unique fields are evaluated within each shard, so models queried together
+should be pinned to the same shard.
+
+A :class:`stdnet.odm.Session` commit is executed in one transaction on each
+shard involved. The commit is not atomic across shards: when a shard fails,
+the changes applied by the other shards are not rolled back.
+'''
+from bisect import bisect
+from collections import deque
+from hashlib import md5
+from itertools import islice
+
+import stdnet
+from stdnet import QuerySetError
+from stdnet.utils import zip, to_bytes, to_string
+from stdnet.backends import (session_result, get_connection_string,
+                             parse_backend, getdb)
+
+from . import BackendDataServer
+
+
+__all__ = ['HashRing', 'ShardedQuery', 'ShardedBackendDataServer']
+
+
+class HashRing(object):
+    '''Consistent hashing of keys into the indices of a list of ``nodes``.
+Each node is placed ``replicas`` times on the ring so that keys are evenly
+distributed and only a fraction of them move when a node is added.'''
+    def __init__(self, nodes, replicas=64):
+        ring = sorted(((self.hash('%s-%s' % (node, n)), index)
+                       for index, node in enumerate(nodes)
+                       for n in range(replicas)))
+        self._hashes = [h for h, _ in ring]
+        self._nodes = [index for _, index in ring]
+
+    def hash(self, key):
+        return int(md5(to_bytes(key)).hexdigest()[:8], 16)
+
+    def get(self, key):
+        '''The index of the node for ``key``.'''
+        index = bisect(self._hashes, self.hash(key)) % len(self._hashes)
+        return self._nodes[index]
+
+
+class ShardedQuery(stdnet.BackendQuery):
+    '''A query scattered to the shards of a
+:class:`ShardedBackendDataServer`. Each shard evaluates a
+:class:`RedisQuery` and the results are gathered by merge-sorting them.'''
+    def _build(self, **kwargs):
+        qs = self.queryelem
+        self.queries = [shard.Query(qs, backend=shard, timeout=self.timeout)
+                        for shard in self.backend.query_shards(qs)]
+
+    def _execute_query(self):
+        count = 0
+        for query in self.queries:
+            n = yield query.execute_query()
+            count += n
+        yield count
+
+    def _load_items(self, slic):
+        items = yield self._items(slic)
+        if not self.executed and all((q.executed for q in self.queries)):
+            self._got_count(sum((q.count() for q in self.queries)))
+        yield items
+
+    def _has(self, val):
+        shard = self.backend.shard(self.meta, val)
+        for query in self.queries:
+            if query.backend == shard:
+                return query._has(val)
+        return False
+
+    def _items(self, slic):
+        sort = self.sort_key(slic)
+        sub = None
+        if len(self.queries) == 1:
+            sub = slic
+        elif slic and sort:
+            start, stop = slic.start or 0, slic.stop
+            if start >= 0 and stop is not None and stop >= 0:
+                # the first stop elements of each shard
+                sub = slice(0, stop)
+        items = []
+        for query in self.queries:
+            result = yield query.backend.execute(query._load_items(sub))
+            items.extend(result)
+        if sort and len(self.queries) > 1:
+            key, desc = sort
+            items.sort(key=key, reverse=desc)
+        yield items[slic] if slic else items
+
+    def _page(self, cursor, chunk_size):
+        if self.sort_key() and len(self.queries) > 1:
+            page = yield self._merge_page(cursor, chunk_size)
+            yield page
+        else:
+            # pages through one shard at a time
+            index, cursor = cursor or (0, 0)
+            query = self.queries[index]
+            cursor, items = yield query.backend.execute(
+                query._page(cursor, chunk_size))
+            if cursor is not None:
+                cursor = (index, cursor)
+            elif index + 1 < len(self.queries):
+                cursor = (index + 1, 0)
+            yield cursor, items
+
+    def _merge_page(self, cursor, chunk_size):
+        # Merge the ordered elements of the shards. The cursor is the list
+        # of [position, loaded elements, exhausted] of each shard, which
+        # loads chunk_size elements when its loaded elements are consumed
+        key, desc = self.sort_key()
+        choose = max if desc else min
+        shards = cursor or [[0, deque(), False] for _ in self.queries]
+        items = []
+        while len(items) < chunk_size:
+            for query, shard in zip(self.queries, shards):
+                position, loaded, exhausted = shard
+                if not loaded and not exhausted:
+                    result = yield query.backend.execute(query._load_items(
+                        slice(position, position + chunk_size)))
+                    loaded.extend(result)
+                    shard[0] = position + chunk_size
+                    shard[2] = len(loaded) < chunk_size
+            heads = [shard[1] for shard in shards if shard[1]]
+            if not heads:
+                break
+            items.append(choose(heads, key=lambda l: key(l[0])).popleft())
+        if any((shard[1] or not shard[2] for shard in shards)):
+            yield shards, items
+        else:
+            yield None, items
+
+    def sort_key(self, slic=None):
+        '''A two elements tuple with the key function and the descending flag
+used to merge the elements loaded from the shards, consistent with the
+ordering applied by each shard. ``None`` if elements are not ordered.'''
+        qs = self.queryelem
+        meta = self.meta
+        if qs._get_field:
+            return None
+        scorefun = None
+        ordering = qs.ordering
+        if ordering:
+            if ordering.nested:
+                raise QuerySetError('Cannot sort by a related field with a '
+                                    'sharded backend')
+        elif meta.ordering:
+            ordering = meta.ordering
+            if ordering.auto:
+                # auto ids are allocated in insertion order
+                ordering = meta.get_sorting(meta.pkname())._replace(
+                    desc=ordering.desc)
+            else:
+                scorefun = ordering.field.scorefun
+        elif slic:
+            ordering = meta.get_sorting(meta.pkname())
+        else:
+            return None
+        attname = ordering.field.attname
+
+        def key(instance):
+            value = getattr(instance, attname, None)
+            if value is not None and scorefun:
+                value = scorefun(value)
+            return value is not None, value
+        return key, ordering.desc
+
+
+class ShardedBackendDataServer(stdnet.BackendDataServer):
+    '''A :class:`stdnet.BackendDataServer` partitioning model data across a
+list of redis :class:`BackendDataServer`.
+
+:parameter shards: optional list of redis :class:`BackendDataServer` or
+    :ref:`connection strings <connection-string>` to use as shards instead
+    of the addresses of the connection string.
+
+.. attribute:: shards
+
+    The list of redis :class:`BackendDataServer`.
+
+.. attribute:: shard_map
+
+    Dictionary mapping model keys to the index of the shard storing all
+    the instances of the model. Updated by :meth:`pin`.
+'''
+    Query = ShardedQuery
+    default_port = 6379
+    virtual_nodes = 64
+
+    def __init__(self, name=None, address=None, charset=None, namespace='',
+                 shards=None, **params):
+        self._addresses = (address or ':').split(',')
+        self._shards = shards
+        self.shard_map = {}
+        super(ShardedBackendDataServer, self).__init__(name, None, charset,
+                                                       namespace, **params)
+        addresses = [parse_backend(str(s))[1] for s in self.shards]
+        self.connection_string = get_connection_string(
+            self.name, (','.join(addresses),), self.params)
+
+    def setup_connection(self, address):
+        if self._shards:
+            shards = [getdb(s) for s in self._shards]
+            self.namespace = shards[0].namespace
+        else:
+            shards = [BackendDataServer('redis', a, self.charset,
+                                        self.namespace, **dict(self.params))
+                      for a in self._addresses]
+        self.shards = shards
+        self.ring = HashRing([str(s) for s in shards], self.virtual_nodes)
+        self.params = dict(shards[0].params)
+        return shards[0].client
+
+    def issame(self, other):
+        return self.shards == other.shards
+
+    def pin(self, model, index):
+        '''Store all the instances of ``model`` in the shard at ``index``.'''
+        meta = getattr(model, '_meta', model)
+        self.shard_map[meta.modelkey] = index
+
+    def shard_index(self, meta, pk):
+        '''The index of the shard storing the instance of model ``meta``
+with primary key ``pk``.'''
+        index = self.shard_map.get(meta.modelkey)
+        if index is None:
+            index = self.ring.get(to_string(pk))
+        return index
+
+    def shard(self, meta, pk):
+        '''The shard storing the instance of model ``meta`` with primary key
+``pk``.'''
+        return self.shards[self.shard_index(meta, pk)]
+
+    def query_shards(self, qs):
+        '''The list of shards storing the elements of the
+:class:`stdnet.odm.QueryElement` ``qs``. Queries on primary key values are
+routed to the shards storing them.'''
+        meta = qs.meta
+        index = self.shard_map.get(meta.modelkey)
+        if index is not None:
+            return [self.shards[index]]
+        if qs.keyword == 'set' and qs.name == meta.pkname() and len(qs):
+            indices = set()
+            for child in qs:
+                if getattr(child, 'lookup', None) != 'value':
+                    return self.shards
+                indices.add(self.shard_index(meta, child.value))
+            return [s for i, s in enumerate(self.shards) if i in indices]
+        return self.shards
+
+    def structure_shard(self, instance):
+        '''The shard storing the :class:`stdnet.odm.Structure` ``instance``.
+Structures of a model field are stored with the model instance.'''
+        field = instance.field
+        if field:
+            return self.shard(field.model._meta, instance._pkvalue or '')
+        return self.shard(instance._meta, instance.id)
+
+    def structure(self, instance, client=None):
+        return self.structure_shard(instance).structure(instance, client)
+
+    def auto_id_to_python(self, value):
+        return int(value)
+
+    def is_async(self):
+        return self.shards[0].is_async()
+
+    def ping(self):
+        return self.execute(self._broadcast('ping'), all)
+
+    def outstanding(self):
+        return sum((shard.outstanding() for shard in self.shards))
+
+    def disconnect(self):
+        for shard in self.shards:
+            shard.disconnect()
+
+    def setup_model(self, meta):
+        for shard in self.shards:
+            shard.setup_model(meta)
+
+    def flush(self, meta=None):
+        return self.execute(self._broadcast('flush', meta), sum)
+
+    def clean(self, meta):
+        return self.execute(self._broadcast('clean', meta))
+
+    def model_keys(self, meta):
+        return self.execute(self._broadcast('model_keys', meta),
+                            lambda r: [key for keys in r for key in keys])
+
+    def instance_keys(self, obj):
+        return self.shard(obj._meta, obj.pkvalue()).instance_keys(obj)
+
+    def execute_session(self, session_data):
+        '''Partition the session per shard and execute one pipeline for each
+shard.'''
+        return self.execute(self._execute_session(session_data))
+
+    def bulk_insert(self, meta, instances, batch_size, ids=False):
+        return self.execute(self._bulk_insert(meta, instances, batch_size,
+                                              ids))
+
+    def delete_query(self, query, batch_size, progress=None, callback=None):
+        return self.execute(self._delete_query(query, batch_size, progress,
+                                               callback))
+
+    def _broadcast(self, method, *args):
+        results = []
+        for shard in self.shards:
+            result = yield getattr(shard, method)(*args)
+            results.append(result)
+        yield results
+
+    def _group(self, instances, index):
+        # Group instances by shard index
+        groups = {}
+        for instance in instances:
+            groups.setdefault(index(instance), []).append(instance)
+        return sorted(groups.items())
+
+    def _assign_ids(self, meta, instances):
+        # Auto ids are allocated by the first shard
+        new = []
+        if meta.pk.type == 'auto':
+            new = [instance for instance in instances
+                   if not instance.pkvalue()]
+        if new:
+            shard = self.shards[0]
+            last = yield shard.client.incrby(shard.basekey(meta, 'ids'),
+                                             len(new))
+            last = int(last)
+            for id, instance in zip(range(last-len(new)+1, last+1), new):
+                # the state of a new instance is not affected by the id
+                instance.get_state()
+                setattr(instance, meta.pk.attname, id)
+        yield new
+
+    def _execute_session(self, session_data):
+        pipes = {}
+
+        def pipe(index):
+            if index not in pipes:
+                pipes[index] = self.shards[index].client.pipeline()
+            return pipes[index]
+        for sm in session_data:
+            meta = sm.meta
+            if sm.structures:
+                groups = self._group(
+                    sm.structures,
+                    lambda s: self.shards.index(self.structure_shard(s)))
+                for index, structures in groups:
+                    self.shards[index].flush_structure(structures, pipe(index))
+            if sm.deletes is not None:
+                for shard in self.query_shards(sm.deletes.construct()):
+                    index = self.shards.index(shard)
+                    p = pipe(index)
+                    shard.accumulate_delete(p, shard.bind_query(sm.deletes, p))
+            if sm.dirty:
+                yield self._assign_ids(meta, sm.dirty)
+                groups = self._group(
+                    sm.dirty, lambda i: self.shard_index(meta, i.pkvalue()))
+                for index, instances in groups:
+                    self.shards[index].commit_instances(pipe(index), meta,
+                                                        instances)
+        # Execute the pipelines and merge the results of each model
+        metas, results, response = [], {}, []
+        for index in sorted(pipes):
+            shard = self.shards[index]
+            if shard.invalidation:
+                result = yield shard.execute(
+                    shard._execute_session(pipes[index]))
+            else:
+                result = yield pipes[index].execute()
+            for r in result:
+                if not isinstance(r, session_result):
+                    response.append(r)
+                    continue
+                if r.meta not in results:
+                    metas.append(r.meta)
+                    results[r.meta] = []
+                results[r.meta].extend(r.results)
+        response.extend((session_result(meta, results[meta])
+                         for meta in metas))
+        yield response
+
+    def _delete_query(self, query, batch_size, progress, callback):
+        deleted = []
+        for shard in self.query_shards(query.construct()):
+            ids = yield shard.delete_query(query, batch_size, progress,
+                                           callback)
+            deleted.extend(ids)
+        yield deleted
+
+    def _bulk_insert(self, meta, instances, batch_size, ids):
+        instances = iter(instances)
+        saved = [] if ids else 0
+        while True:
+            batch = list(islice(instances, batch_size))
+            if not batch:
+                break
+            yield self._assign_ids(meta, batch)
+            # group the positions in the batch to return ids in order
+            groups = self._group(
+                range(len(batch)),
+                lambda n: self.shard_index(meta, batch[n].pkvalue()))
+            batch_ids = [None]*len(batch)
+            for index, positions in groups:
+                result = yield self.shards[index].bulk_insert(
+                    meta, [batch[n] for n in positions], batch_size, ids)
+                if ids:
+                    for n, id in zip(positions, result):
+                        batch_ids[n] = id
+                else:
+                    saved += result
+            if ids:
+                saved.extend(batch_ids)
+        yield saved
@@ -327,7 +327,13 @@ of fields names and a list of field attribute names.'''
                 'autoincr': self.ordering and self.ordering.auto,
                 'multi_fields': [field.name for field in self.multifields],
                 'indices': dict(((idx.attname, idx.unique)
-                                 for idx in self.indices))}
+                                 for idx in self.indices)),
+                'sorted_indices': dict(((idx.attname, True)
+                                        for idx in self.indices
+                                        if idx.sorted_index)),
+                'lex_indices': dict(((idx.attname, True)
+                                     for idx in self.indices
+                                     if idx.lex_index))}
 
 
 class autoincrement(object):
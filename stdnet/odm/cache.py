@@ -0,0 +1,210 @@
+'''Client side read-through cache for :class:`StdModel` instances.
+
+A :class:`ModelCache` is attached to a :class:`Manager` when registering
+a model::
+
+    models = odm.Router()
+    models.register(Currency, cache=odm.ModelCache(timeout=300))
+
+Primary key lookups via :meth:`Query.get`, and lazy foreign key
+dereferences, are then served from the cache. Entries are invalidated
+when instances are committed or deleted. A :class:`CacheInvalidator`
+evicts entries changed by other processes.
+'''
+import json
+import time
+import threading
+
+from stdnet import getdb
+from stdnet.utils import native_str
+from stdnet.utils.structures import OrderedDict
+
+
+__all__ = ['LocalCache', 'ModelCache', 'CacheInvalidator']
+
+
+class LocalCache(object):
+    '''An in-process least recently used cache with time-to-live.
+
+.. attribute:: max_size
+
+    Maximum number of entries. When exceeded, the least recently used
+    entry is evicted.
+
+All operations are thread safe, so that a :class:`CacheInvalidator` can
+evict entries while other threads read them.
+'''
+    def __init__(self, max_size=1000):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        data = self._data
+        with self._lock:
+            entry = data.get(key)
+            if entry is not None:
+                expiry, value = entry
+                if not expiry or expiry > time.time():
+                    self._touch(key)
+                    return value
+                del data[key]
+
+    def set(self, key, value, timeout=None):
+        data = self._data
+        expiry = time.time() + timeout if timeout else 0
+        with self._lock:
+            data.pop(key, None)
+            data[key] = (expiry, value)
+            while len(data) > self.max_size:
+                data.popitem(last=False)
+
+    def delete(self, *keys):
+        data = self._data
+        with self._lock:
+            for key in keys:
+                data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def _touch(self, key):
+        # Mark key as the most recently used, the lock is held
+        data = self._data
+        if hasattr(data, 'move_to_end'):
+            data.move_to_end(key)
+        else:
+            data[key] = data.pop(key)
+
+
+class ModelCache(object):
+    '''A read-through cache of serialised :class:`StdModel` states keyed
+by primary key. A state is a ``(pk, None, data)`` tuple where ``data``
+contains the database representation of the instance fields, the same
+state a backend server passes to :meth:`Metaclass.make_object`.
+
+:parameter timeout: time-to-live in seconds of an entry. If ``0`` entries
+    expire only when evicted or invalidated.
+:parameter max_size: maximum size of the default :class:`LocalCache`.
+:parameter backend: optional shared cache. It must implement the ``get``,
+    ``set``, ``delete`` and ``clear`` methods of :class:`LocalCache` and is
+    responsible for serialising values (with ``pickle`` for example).
+
+.. attribute:: hits
+
+    Number of lookups served from the cache.
+
+.. attribute:: misses
+
+    Number of lookups which required a round-trip to the backend server.
+'''
+    def __init__(self, timeout=60, max_size=1000, backend=None):
+        self.timeout = timeout
+        self.backend = backend if backend is not None else\
+            LocalCache(max_size)
+        self.meta = None
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, self.meta)
+    __str__ = __repr__
+
+    def key(self, pk):
+        return '%s:%s' % (self.meta.modelkey, pk)
+
+    def get(self, pk):
+        '''Retrieve the state of the instance with primary key ``pk`` or
+``None`` if not available.'''
+        state = self.backend.get(self.key(pk))
+        if state is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            # loading an instance consumes the data dictionary
+            pkvalue, loadedfields, data = state
+            return pkvalue, loadedfields, dict(data)
+
+    def set(self, instance):
+        '''Store the state of a fully loaded persistent ``instance``.'''
+        if instance.has_all_data and instance.is_valid():
+            pkvalue = instance.pkvalue()
+            data = dict(instance._dbdata['cleaned_data'])
+            self.backend.set(self.key(pkvalue), (pkvalue, None, data),
+                             self.timeout)
+        return instance
+
+    def invalidate(self, pks):
+        '''Remove the states of instances with primary keys ``pks``.'''
+        if pks:
+            self.backend.delete(*[self.key(pk) for pk in pks])
+
+    def clear(self):
+        '''Remove all entries.'''
+        self.backend.clear()
+
+
+class CacheInvalidator(threading.Thread):
+    '''A daemon thread which evicts entries of the :class:`ModelCache`
+of models registered with ``router`` when other processes commit or delete
+instances. The writers must use a backend which publishes invalidation
+messages, for redis the ``invalidation=1``
+:ref:`connection string <connection-string>` parameter::
+
+    models = odm.Router('redis://127.0.0.1:6379?invalidation=1')
+    models.register(Currency, cache=True)
+    invalidator = odm.CacheInvalidator(models)
+    invalidator.start()
+
+Messages received while evicting are coalesced so that each cache is
+invalidated once per model.
+
+:parameter router: the :class:`Router` with the cached models.
+:parameter backend: the backend to subscribe to. By default the
+    :attr:`Router.default_backend`.
+:parameter timeout: seconds to wait for messages before checking if the
+    thread has been stopped.
+'''
+    def __init__(self, router, backend=None, timeout=0.5):
+        super(CacheInvalidator, self).__init__(name='CacheInvalidator')
+        self.daemon = True
+        self.router = router
+        self.backend = getdb(backend or router.default_backend)
+        self.timeout = timeout
+        self._stopped = threading.Event()
+
+    def stop(self):
+        '''Stop listening for invalidation messages.'''
+        self._stopped.set()
+
+    def run(self):
+        pubsub = self.backend.subscribe_invalidations()
+        try:
+            while not self._stopped.is_set():
+                message = pubsub.get_message(timeout=self.timeout)
+                messages = []
+                while message:
+                    messages.append(message)
+                    message = pubsub.get_message()
+                if messages:
+                    self.invalidate(messages)
+        finally:
+            pubsub.close()
+
+    def invalidate(self, messages):
+        '''Evict the ids contained in ``messages`` from the caches.'''
+        ids = {}
+        for message in messages:
+            data = native_str(message['data'], self.backend.charset)
+            modelkey, pks = json.loads(data)
+            ids.setdefault(modelkey, set()).update(pks)
+        router = self.router
+        for model in router.registered_models:
+            manager = router[model]
+            cache = manager.cache
+            if cache is not None and manager._meta.modelkey in ids:
+                cache.invalidate(ids[manager._meta.modelkey])
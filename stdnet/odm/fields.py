@@ -55,6 +55,31 @@ Each field is specified as a :class:`StdModel` class attribute.
 
     Default ``True``.
 
+    For fields which can be ranked (:class:`IntegerField`,
+    :class:`FloatField`, :class:`DateField` and :class:`DateTimeField`)
+    ``index`` can also be set to ``'sorted'``. In this case
+    :attr:`sorted_index` is ``True``. For :class:`SymbolField`
+    ``index`` can be set to ``'lex'``, in which case :attr:`lex_index`
+    is ``True``.
+
+.. attribute:: sorted_index
+
+    If ``True`` the field is indexed by value in a sorted index so that
+    range lookups (``__gt``, ``__ge``, ``__lt`` and ``__le``) are
+    resolved by the backend without scanning all instances of the model.
+    Set via ``index='sorted'``.
+
+    Default ``False``.
+
+.. attribute:: lex_index
+
+    If ``True`` the field is indexed in lexicographical order as well so
+    that prefix lookups (``__startswith`` and ``__istartswith``) are
+    resolved by the backend without scanning all instances of the model.
+    Set via ``index='lex'``.
+
+    Default ``False``.
+
 .. attribute:: unique
 
     If ``True``, the field must be unique throughout the model.
@@ -134,12 +159,28 @@ Each field is specified as a :class:`StdModel` class attribute.
     charset = None
     hidden = False
     internal_type = None
+    sortable = False
+    lexsortable = False
     creation_counter = 0
 
     def __init__(self, unique=False, primary_key=False, required=True,
                  index=None, hidden=None, as_cache=False, **extras):
         self.primary_key = primary_key
         index = index if index is not None else self.index
+        self.sorted_index = False
+        self.lex_index = False
+        if index == 'sorted':
+            if not self.sortable:
+                raise FieldError('%s cannot have a sorted index' %
+                                 self.__class__.__name__)
+            self.sorted_index = not primary_key
+            index = True
+        elif index == 'lex':
+            if not self.lexsortable:
+                raise FieldError('%s cannot have a lexicographical index' %
+                                 self.__class__.__name__)
+            self.lex_index = not primary_key
+            index = True
         if primary_key:
             self.unique = True
             self.required = True
@@ -155,6 +196,8 @@ Each field is specified as a :class:`StdModel` class attribute.
             self.required = False
             self.unique = False
             self.index = False
+            self.sorted_index = False
+            self.lex_index = False
         self.charset = extras.pop('charset', self.charset)
         self.hidden = hidden if hidden is not None else self.hidden
         self.meta = None
@@ -406,6 +449,7 @@ class IntegerField(AtomField):
     type = 'integer'
     internal_type = 'numeric'
     python_type = int
+    sortable = True
 
     def to_python(self, value, backend=None):
         if value in NONE_EMPTY:
@@ -430,6 +474,7 @@ a :class:`datetime.date` instance.'''
     type = 'date'
     internal_type = 'numeric'
     python_type = date
+    sortable = True
     _default = None
 
     def set_get_value(self, instance, value):
@@ -487,6 +532,7 @@ or other entities. They are indexes by default.'''
     python_type = string_type
     internal_type = 'text'
     charset = 'utf-8'
+    lexsortable = True
     _default = ''
 
     def get_encoder(self, params):
@@ -544,6 +590,7 @@ or :class:`JSONField` fields as more general alternatives.
           attribute is ``True``.
 '''
     type = 'object'
+    lexsortable = False
     _default = None
 
     def set_get_value(self, instance, value):
@@ -748,6 +795,7 @@ behaviour and how the field is stored in the back-end server.
 '''
     type = 'json object'
     internal_type = 'serialized'
+    lexsortable = False
     _default = {}
 
     def get_encoder(self, params):
@@ -835,6 +883,7 @@ with a unique hash attribute ``hash`` and it is
 registered in the model hash table, it can be used.'''
     type = 'model'
     internal_type = 'text'
+    lexsortable = False
 
     def to_python(self, value, backend=None):
         if value and not hasattr(value, '_meta'):
@@ -7,6 +7,8 @@ from stdnet import getdb
 from .base import ModelType, Model
 from .session import Manager, Session, ModelDictionary, StructureManager
 from .struct import Structure
+from .cache import ModelCache
+from .replicas import ReadReplicas
 from .globals import Event, get_model_from_hash
 
 
@@ -115,7 +117,7 @@ tutorial for information.'''
         self._search_engine.set_router(self)
 
     def register(self, model, backend=None, read_backend=None,
-                 include_related=True, **params):
+                 include_related=True, cache=None, **params):
         '''Register a :class:`Model` with this :class:`Router`. If the
 model was already registered it does nothing.
 
@@ -125,15 +127,25 @@ model was already registered it does nothing.
 :param read_backend: Optional :class:`stdnet.BackendDataServer` for read
     operations. This is useful when the server has a master/slave
     configuration, where the master accept write and read operations
-    and the ``slave`` read only operations.
+    and the ``slave`` read only operations. It can also be a
+    :class:`ReadReplicas` or a list of backends, to balance reads across
+    several replicas.
 :param include_related: ``True`` if related models to ``model`` needs to be
     registered. Default ``True``.
+:param cache: Optional :class:`ModelCache` for ``model``. If ``True`` a
+    :class:`ModelCache` with default parameters is used. Related models
+    are registered without a cache.
 :param params: Additional parameters for the :func:`getdb` function.
 :return: the number of models registered.
 '''
         backend = backend or self._default_backend
         backend = getdb(backend=backend, **params)
-        if read_backend:
+        if isinstance(read_backend, (list, tuple)):
+            read_backend = ReadReplicas(read_backend)
+        if isinstance(read_backend, ReadReplicas):
+            if read_backend.primary is None:
+                read_backend.primary = backend
+        elif read_backend:
             read_backend = getdb(read_backend)
         registered = 0
         if isinstance(model, Structure):
@@ -147,7 +159,14 @@ model was already registered it does nothing.
             default_manager = backend.default_manager or Manager
             manager_class = getattr(model, 'manager_class', default_manager)
             manager = manager_class(model, backend, read_backend, self)
+            if cache:
+                if cache is True:
+                    cache = ModelCache()
+                cache.meta = manager._meta
+                manager.cache = cache
+                cache = None
             self._registered_models[model] = manager
+            backend.setup_model(manager._meta)
             if isinstance(model, ModelType):
                 attr_name = model._meta.name
             else:
@@ -259,6 +278,15 @@ method for::
 '''
         return self.session().add(instance)
 
+    def gather(self, *queries):
+        '''Load the elements of several ``queries`` in a batch. This is a
+shortcut method for::
+
+    self.session().gather(*queries)
+
+Check :meth:`Session.gather` for details.'''
+        return self.session().gather(*queries)
+
     # PRIVATE METHODS
 
     def _register_applications(self, applications, models, backends):
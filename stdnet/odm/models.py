@@ -265,18 +265,26 @@ proxy for the :attr:`Metaclass.pk` attribute.'''
             if val is None:
                 return self.__set_related_value(field)
             else:
-                pkname = field.relmodel._meta.pkname()
                 qs = self.session.query(field.relmodel)
+                rel_obj = qs._cached_instance(val)
+                if rel_obj is not None:
+                    setattr(self, cache_name, rel_obj)
+                    return qs.backend.execute(rel_obj)
+                pkname = field.relmodel._meta.pkname()
+                cache = qs.session.manager(field.relmodel).cache
                 if load_only:
                     qs = qs.load_only(*load_only)
                 if dont_load:
                     qs = qs.dont_load(*dont_load)
-                callback = partial(self.__set_related_value, field)
+                callback = partial(self.__set_related_value, field,
+                                   cache=cache)
                 return qs.filter(**{pkname: val}).items(callback=callback)
 
-    def __set_related_value(self, field, items=None):
+    def __set_related_value(self, field, items=None, cache=None):
         try:
             rel_obj = self.get_unique_instance(items)
+            if cache is not None:
+                cache.set(rel_obj)
         except self.DoesNotExist:
             if field.required:
                 raise
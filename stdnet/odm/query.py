@@ -3,7 +3,7 @@ from inspect import isgenerator
 from functools import partial
 from collections import Mapping
 
-from stdnet import range_lookups
+from stdnet import range_lookups, AsyncQueryIterator
 from stdnet.utils import JSPLITTER, iteritems, unique_tuple
 from stdnet.utils.exceptions import *
 
@@ -14,6 +14,7 @@ __all__ = ['Q', 'QueryBase', 'Query', 'QueryElement', 'EmptyQuery',
            'intersect', 'union', 'difference']
 
 iterables = (tuple, list, set, frozenset, Mapping)
+score_lookups = ('gt', 'ge', 'lt', 'le')
 
 
 def iterable(value):
@@ -96,6 +97,17 @@ class Q(object):
     def _get_field(self):
         return self.data['get_field']
 
+    @property
+    def _restricted(self):
+        # a where clause or a subset of loaded fields, the result may differ
+        # from the instance with the same primary key
+        return bool(self.data.get('where') or self.fields or
+                    getattr(self, 'exclude_fields', None))
+
+    @property
+    def _atomic(self):
+        return bool(self.data.get('atomic'))
+
     @property
     def backend(self):
         return self.session.model(self._meta).read_backend
@@ -257,6 +269,9 @@ class QueryBase(Q):
     def __iter__(self):
         return iter(self.items())
 
+    def __aiter__(self):
+        return self.iterator()
+
     def __len__(self):
         return self.count()
 
@@ -272,6 +287,11 @@ class EmptyQuery(QueryBase):
     def items(self, slic=None):
         return []
 
+    def iterator(self, chunk_size=None):
+        if self.backend.is_async():
+            return AsyncQueryIterator(self.backend, self, chunk_size)
+        return iter(())
+
     def count(self):
         return 0
 
@@ -509,6 +529,21 @@ each element in the query. The *coe* should reference an instance of
         else:
             return self
 
+    def atomic(self, value=True):
+        '''Evaluate the query in a transaction. Backends evaluate queries
+without a transaction when possible, for example the
+:ref:`redis backend <redis-server>` does not wrap the commands of a query
+in ``MULTI``/``EXEC``, so that concurrent commits may be visible while the
+query is evaluated. Use this method when the query must see a consistent
+snapshot of the data.
+
+:parameter value: ``False`` to evaluate without a transaction again.
+:return: a new :class:`Query`
+'''
+        q = self._clone()
+        q.data['atomic'] = value
+        return q
+
     def search_queries(self, q):
         '''Return a new :class:`QueryElem` for *q* applying a text search.'''
         if self.text:
@@ -591,13 +626,43 @@ to load all fields except a subset specified by *fields*.
         '''Retrieve all items for this :class:`Query`.'''
         return self.backend_query().items(callback=callback)
 
+    def iterator(self, chunk_size=1000):
+        '''Generator over the items of this :class:`Query`, loaded from the
+backend server ``chunk_size`` items at a time. Use this method rather than
+:meth:`all` when iterating over very large queries, since items are neither
+cached nor added to the :attr:`session`. With asynchronous backends it
+returns a :class:`stdnet.AsyncQueryIterator` for the ``async for``
+statement, which is also used when iterating asynchronously over the
+:class:`Query` itself.'''
+        query = self.backend_query()
+        if self.backend.is_async():
+            return AsyncQueryIterator(self.backend, query, chunk_size)
+        return query.iterator(chunk_size)
+
     def get(self, **kwargs):
         '''Return an instance of a model matching the query. A special case is
 the query on ``id`` which provides a direct access to the :attr:`session`
 instances. If the given primary key is present in the session, the object
-is returned directly without performing any query.'''
-        return self.filter(**kwargs).items(
-            callback=self.model.get_unique_instance)
+is returned directly without performing any query. Otherwise, if the
+:class:`Manager` of the model has a :attr:`Manager.cache`, the instance is
+served from the cache, which is populated on misses.
+Queries with a :meth:`where` clause or loading a subset of fields always
+hit the server and leave the cache untouched.'''
+        callback = self.model.get_unique_instance
+        if len(kwargs) == 1 and not self._get_field and not (
+                self.fargs or self.eargs or self.unions or
+                self.intersections or self.text):
+            name, value = tuple(kwargs.items())[0]
+            if name == self._meta.pkname() and not isinstance(
+                    value, (list, tuple, set, frozenset, Q)) and (
+                    not self._restricted):
+                instance = self._cached_instance(value)
+                if instance is not None:
+                    return self.backend.execute(instance)
+                cache = self.session.manager(self._meta).cache
+                if cache is not None:
+                    callback = partial(self._cache_unique, cache)
+        return self.filter(**kwargs).items(callback=callback)
 
     def count(self):
         '''Return the number of objects in ``self``.
@@ -607,9 +672,24 @@ It construct the queries and count the
 objects on the server side.'''
         return self.backend_query().count()
 
-    def delete(self):
+    def delete(self, batch_size=None, progress=None):
         '''Delete all matched elements of the :class:`Query`. It returns the
-list of ids deleted.'''
+list of ids deleted.
+
+:param batch_size: if given, elements are deleted ``batch_size`` at a time
+    with several calls to the backend server rather than in one transaction,
+    so that deleting a very large query does not block the server. The
+    :attr:`session` is not used and no signals are sent. The deleted
+    instances are invalidated in the :attr:`Manager.cache` after each batch.
+:param progress: optional callable invoked after each batch with the model
+    metaclass, the number of elements of the model deleted so far and the
+    number of elements left.
+'''
+        if batch_size:
+            if isinstance(self.construct(), EmptyQuery):
+                return []
+            return self.backend.delete_query(self, batch_size, progress,
+                                             self._invalidate_cache)
         return self.session.delete(self)
 
     def construct(self):
@@ -719,6 +799,10 @@ an exception is raised.
                 if lookup:  # this is a range lookup
                     attname, nested = field.get_lookup(remaining,
                                                        QuerySetError)
+                    # sorted indices are ranked by the serialised value
+                    if (field.sorted_index and not nested and
+                            lookup in score_lookups):
+                        value = field.serialise(value, lookup)
                     lookups = get_lookups(attname, field_lookups)
                     lookups.append(lookup_value(lookup, (value, nested)))
                     continue
@@ -741,6 +825,26 @@ an exception is raised.
         return [queryset(self, name=name, underlying=field_lookups[name])
                 for name in sorted(field_lookups)]
 
+    def _cached_instance(self, pk):
+        # Instance with primary key ``pk`` from the session identity map or
+        # from the manager cache. ``None`` if not available.
+        sm = self.session.model(self._meta)
+        instance = sm.get(pk)
+        if instance is None and sm.manager.cache is not None:
+            state = sm.manager.cache.get(pk)
+            if state is not None:
+                instance = self._meta.make_object(state, self.backend)
+                self.session.add(instance, modified=False)
+        return instance
+
+    def _invalidate_cache(self, meta, ids):
+        cache = self.session.manager(meta).cache
+        if cache is not None:
+            cache.invalidate(ids)
+
+    def _cache_unique(self, cache, items):
+        return cache.set(self.model.get_unique_instance(items))
+
     def _test_unique(self, fieldname, value, instance, exception, items):
         if items:
             r = self.model.get_unique_instance(items)
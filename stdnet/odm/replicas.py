@@ -0,0 +1,140 @@
+'''Load balancing of read operations across a pool of
+:class:`stdnet.BackendDataServer`, usually replicas of the server
+accepting writes.
+
+A :class:`ReadReplicas` is used as the ``read_backend`` of a model::
+
+    models = odm.Router('redis://127.0.0.1:6379')
+    models.register(Instrument, read_backend=odm.ReadReplicas(
+        ['redis://127.0.0.1:6380?read_only=1',
+         'redis://127.0.0.1:6381?read_only=1'],
+        policy='latency'))
+
+A list of :ref:`connection strings <connection-string>` is equivalent to a
+:class:`ReadReplicas` with the default policy. A :class:`Session` selects a
+replica the first time it reads and uses it until it is discarded, so that
+the queries of a session are evaluated by the same server.
+'''
+import random
+import threading
+import time
+
+from stdnet import getdb
+
+
+__all__ = ['ReadReplicas']
+
+
+class ReadReplicas(object):
+    '''A pool of read :class:`stdnet.BackendDataServer` with a selection
+policy and periodic health checks.
+
+:parameter backends: a list of :class:`stdnet.BackendDataServer` or
+    :ref:`connection strings <connection-string>`.
+:parameter policy: the selection policy, one of
+
+    * ``round_robin`` (default) cycles through the healthy backends.
+    * ``least_outstanding`` selects the backend with the least number of
+      requests in progress, see
+      :meth:`stdnet.BackendDataServer.outstanding`.
+    * ``latency`` selects a backend at random, with a probability inversely
+      proportional to the latency measured by the last health check.
+:parameter check_interval: seconds between health checks. A backend is
+    healthy when it replies to a ``ping``. The first check is performed
+    by the first :meth:`get`, the following ones by a background thread
+    while reads use the results of the previous check. Health checks of
+    asynchronous backends are not performed.
+:parameter primary: the backend used when no replica is healthy. Set by
+    :meth:`Router.register` to the backend of the model if not given.
+
+.. attribute:: healthy
+
+    The list of backends which replied to the last health check.
+'''
+    policies = ('round_robin', 'least_outstanding', 'latency')
+
+    def __init__(self, backends, policy='round_robin', check_interval=5,
+                 primary=None):
+        if policy not in self.policies:
+            raise ValueError('Unknown read replicas policy "%s"' % policy)
+        self.backends = [getdb(b) for b in backends]
+        if not self.backends:
+            raise ValueError('Read replicas require at least one backend')
+        self.policy = policy
+        self.check_interval = check_interval
+        self.primary = primary
+        self.healthy = list(self.backends)
+        self.latency = {}
+        self._last_check = 0
+        self._next = 0
+        self._checker = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__,
+                           ', '.join((str(b) for b in self.backends)))
+    __str__ = __repr__
+
+    def get(self):
+        '''Select a healthy backend according to :attr:`policy`. If no
+backend is healthy returns the :attr:`primary`.'''
+        if time.time() - self._last_check >= self.check_interval:
+            self._schedule_check()
+        healthy = self.healthy
+        if not healthy:
+            return self.primary or self.backends[0]
+        return getattr(self, '_%s' % self.policy)(healthy)
+
+    def check(self):
+        '''Ping the backends and update :attr:`healthy` and the latencies.'''
+        healthy = []
+        latency = {}
+        for backend in self.backends:
+            if backend.is_async():
+                healthy.append(backend)
+                continue
+            start = time.time()
+            try:
+                backend.ping()
+            except Exception:
+                pass
+            else:
+                latency[backend] = time.time() - start
+                healthy.append(backend)
+        with self._lock:
+            self.healthy = healthy
+            self.latency = latency
+            self._last_check = time.time()
+            self._checker = None
+
+    def _schedule_check(self):
+        # Start a health check unless one is in progress
+        with self._lock:
+            if self._checker or (time.time() - self._last_check <
+                                 self.check_interval):
+                return
+            self._checker = checker = threading.Thread(
+                target=self.check, name='read-replicas-check')
+            checker.daemon = True
+            first = not self._last_check
+        if first:
+            # the health of the backends is not known yet
+            checker.run()
+        else:
+            checker.start()
+
+    def _round_robin(self, healthy):
+        self._next = n = (self._next + 1) % len(healthy)
+        return healthy[n]
+
+    def _least_outstanding(self, healthy):
+        return min(healthy, key=lambda b: b.outstanding())
+
+    def _latency(self, healthy):
+        weights = [1/max(self.latency.get(b, 0), 1e-6) for b in healthy]
+        value = random.random()*sum(weights)
+        for backend, weight in zip(healthy, weights):
+            value -= weight
+            if value <= 0:
+                return backend
+        return healthy[-1]
@@ -1,11 +1,15 @@
+import sys
+import threading
 from itertools import chain
+from weakref import WeakValueDictionary
 
-from stdnet import session_result, session_data, async
-from stdnet.utils import itervalues, iteritems
+from stdnet import session_result, session_data
+from stdnet.utils import itervalues, iteritems, raise_error_trace
 from stdnet.utils.structures import OrderedDict
 from stdnet.utils.exceptions import *
 
 from .query import Q, Query, EmptyQuery
+from .replicas import ReadReplicas
 
 
 __all__ = ['Session',
@@ -20,6 +24,42 @@ def is_query(query):
     return isinstance(query, Q)
 
 
+def execute_sessions(backends_data):
+    '''Execute the session data of several backends and return the list of
+responses in the same order. Synchronous backends are dispatched concurrently,
+each one in its own thread, so that a session touching several servers waits
+for the slowest server only. Asynchronous backends are dispatched in the
+calling thread since they return immediately.
+
+All backends are executed even when one of them fails. The first error, in
+the order of ``backends_data``, is then raised.'''
+    calls = list(backends_data)
+    responses = [None]*len(calls)
+    errors = [None]*len(calls)
+
+    def execute(index):
+        backend, data = calls[index]
+        try:
+            responses[index] = backend.execute_session(data)
+        except Exception:
+            errors[index] = sys.exc_info()
+
+    sync = [i for i, (backend, _) in enumerate(calls)
+            if not backend.is_async()]
+    threads = [threading.Thread(target=execute, args=(i,)) for i in sync[1:]]
+    for thread in threads:
+        thread.start()
+    for index in range(len(calls)):
+        if index not in sync[1:]:
+            execute(index)
+    for thread in threads:
+        thread.join()
+    for exc_info in errors:
+        if exc_info:
+            raise_error_trace(exc_info[1], exc_info[2])
+    return responses
+
+
 class ModelDictionary(dict):
 
     def __contains__(self, model):
@@ -44,14 +84,16 @@ class ModelDictionary(dict):
 class SessionModel(object):
     '''A :class:`SessionModel` is the container of all objects for a given
 :class:`Model` in a stdnet :class:`Session`.'''
-    def __init__(self, manager):
+    def __init__(self, manager, read_backend=None):
         self.manager = manager
+        self._read_backend = read_backend
         self._new = OrderedDict()
         self._deleted = OrderedDict()
         self._delete_query = []
         self._modified = OrderedDict()
         self._queries = []
         self._structures = set()
+        self._identity = WeakValueDictionary()
 
     def __len__(self):
         return (len(self._new) + len(self._modified) + len(self._deleted) +
@@ -69,7 +111,7 @@ class SessionModel(object):
     @property
     def read_backend(self):
         '''The read-only backend for this :class:`SessionModel`.'''
-        return self.manager.read_backend
+        return self._read_backend or self.manager.read_backend
 
     @property
     def model(self):
@@ -147,6 +189,8 @@ within this :class:`SessionModel`.'''
         if state.persistent:
             if modified:
                 self._modified[iid] = instance
+            if instance.has_all_data:
+                self._identity[self._pk(iid)] = instance
         else:
             self._new[iid] = instance
         return instance
@@ -160,6 +204,7 @@ within this :class:`SessionModel`.'''
         if instance is not None:
             state = instance.get_state()
             if state.persistent:
+                self._identity.pop(self._pk(state.iid), None)
                 state.deleted = True
                 self._deleted[state.iid] = instance
                 instance.session = session
@@ -197,10 +242,23 @@ could be a :class:`Model` or an id.
 :rtype: the :class:`Model` removed from session or ``None`` if
     it was not in the session.
 '''
+        if isinstance(instance, self.model):
+            iid = instance.get_state().iid
+        else:
+            iid = instance
+        self._identity.pop(self._pk(iid), None)
         instance = self.pop(instance)
         instance.session = None
         return instance
 
+    def get(self, pk):
+        '''Retrieve a persistent instance with primary key ``pk`` from the
+identity map of this :class:`SessionModel`.
+
+:parameter pk: the primary key value.
+:rtype: the :class:`Model` instance or ``None`` if not available.'''
+        return self._identity.get(self._pk(pk))
+
     def post_commit(self, results):
         '''\
 Process results after a commit.
@@ -223,6 +281,7 @@ Process results after a commit.
             instance = self.pop(result.iid)
             id = tpy(result.id, self.backend)
             if result.deleted:
+                self._identity.pop(id, None)
                 deleted.append(id)
             else:
                 if instance is None:
@@ -235,11 +294,17 @@ Process results after a commit.
                 instance.get_state().score = result.score
                 if instance.get_state().persistent:
                     instances.append(instance)
+        cache = self.manager.cache
+        if cache is not None:
+            cache.invalidate(deleted)
+            cache.invalidate([instance.pkvalue() for instance in instances])
         return instances, deleted, errors
 
     def flush(self):
         '''Completely flush :attr:`model` from the database. No keys
 associated with the model will exists after this operation.'''
+        if self.manager.cache is not None:
+            self.manager.cache.clear()
         return self.backend.flush(self._meta)
 
     def clean(self):
@@ -253,6 +318,12 @@ empty keys associated with the model will exists after this operation.'''
         return self.read_backend.model_keys(self._meta)
 
     ## INTERNALS
+    def _pk(self, pk):
+        try:
+            return self._meta.pk_to_python(pk, self.backend)
+        except Exception:
+            return pk
+
     def get_delete_query(self, session):
         queries = self._delete_query
         deleted = self.deleted
@@ -443,15 +514,17 @@ class Transaction(object):
 
     # INTERNAL FUNCTIONS
     def _commit(self, session, callback):
-        asy = False
+        asy = None
         try:
-            asy = False
-            responses = []
-            for backend, data in session.backends_data():
-                responses.append(backend.execute_session(data))
-                asy = asy or backend.is_async()
+            backends_data = tuple(session.backends_data())
+            responses = execute_sessions(backends_data)
+            for backend, _ in backends_data:
+                if backend.is_async():
+                    asy = backend
             if asy:
-                return async(self._async_commit(session, responses, callback))
+                # the asynchronous backend runs the commit
+                return asy.execute(self._async_commit(session, responses,
+                                                      callback))
             for response in responses:
                 tuple(self._post_commit(session, response))
             return callback() if callback else True
@@ -524,6 +597,7 @@ class Session(object):
     def __init__(self, router):
         self.transaction = None
         self._models = OrderedDict()
+        self._replicas = {}
         self._router = router
 
     def __str__(self):
@@ -597,6 +671,41 @@ which is equivalent to::
         '''Returns an empty :class:`Query` for ``model``.'''
         return EmptyQuery(self.manager(model)._meta, self)
 
+    def gather(self, *queries):
+        '''Load the elements of several independent ``queries`` with one
+round-trip to each backend server rather than one or two round-trips per
+query::
+
+    instruments, funds = session.gather(
+        session.query(Instrument).filter(ccy='EUR'),
+        session.query(Fund).filter(ccy='EUR'))
+
+Each query is counted and its elements are stored in its cache, so that
+:meth:`Query.count` and :meth:`Query.all` do not contact the server again.
+Loaded instances are added to the session of their query.
+
+:param queries: :class:`Query` instances, possibly of different models and
+    backends.
+:return: the list of elements of each query, in the same order.
+'''
+        results = [None]*len(queries)
+        backends = OrderedDict()
+        for index, query in enumerate(queries):
+            q = query.construct()
+            if isinstance(q, EmptyQuery):
+                results[index] = []
+            else:
+                backends.setdefault(q.backend, []).append((index, q))
+        if not backends:
+            return results
+        # an asynchronous backend waits for the results of all backends
+        backend = next(iter(backends))
+        for be in backends:
+            if be.is_async():
+                backend = be
+                break
+        return backend.execute(self._gather(backends, results))
+
     def update_or_create(self, model, **kwargs):
         '''Update or create a new instance of ``model``.
 
@@ -688,10 +797,21 @@ of :class:`Model`.'''
         manager = self.manager(model)
         sm = self._models.get(manager)
         if sm is None and create:
-            sm = SessionModel(manager)
+            sm = SessionModel(manager, self._replica(manager))
             self._models[manager] = sm
         return sm
 
+    def _replica(self, manager):
+        # The backend selected from the read replicas of manager. It is
+        # the same for all models reading from the same replicas.
+        replicas = manager.read_replicas
+        if replicas is not None:
+            backend = self._replicas.get(replicas)
+            if backend is None:
+                backend = replicas.get()
+                self._replicas[replicas] = backend
+            return backend
+
     def expunge(self, instance=None):
         '''Remove ``instance`` from this :class:`Session`. If ``instance``
 is not given, it removes all instances from this :class:`Session`.'''
@@ -722,7 +842,7 @@ values valid for the :meth:`model` method.'''
             raise InvalidTransaction('"%s" not valid in this session' % meta)
 
     def backends_data(self):
-        backends = {}
+        backends = OrderedDict()
         for sm in self:
             for backend, data in sm.backends_data(self):
                 be = backends.get(backend)
@@ -733,6 +853,13 @@ values valid for the :meth:`model` method.'''
 
     #######################################################################
     #    INTERNALS
+    def _gather(self, backends, results):
+        for backend, queries in backends.items():
+            items = yield backend.gather([q for _, q in queries])
+            for (index, _), value in zip(queries, items):
+                results[index] = value
+        yield results
+
     def _update_or_create(self, model, **kwargs):
         pkname = model._meta.pkname()
         pk = kwargs.pop(pkname, None)
@@ -863,13 +990,25 @@ so by setting the ``manager_class`` attribute in the :class:`StdModel`::
 .. attribute:: read_backend
 
     A :class:`stdnet.BackendDataServer` for read-only operations (Queries).
+    When the manager reads from :attr:`read_replicas`, a backend selected
+    by their policy.
+
+.. attribute:: read_replicas
+
+    Optional :class:`ReadReplicas` for read-only operations.
 
 .. attribute:: query_class
 
     Class for querying. Default is :class:`Query`.
+
+.. attribute:: cache
+
+    Optional :class:`ModelCache` for instances of :attr:`model`. Set via
+    the :meth:`Router.register` method.
 '''
     session_factory = Session
     query_class = None
+    cache = None
 
     def __init__(self, model, backend=None, read_backend=None, router=None):
         self.model = model
@@ -891,8 +1030,15 @@ so by setting the ``manager_class`` attribute in the :class:`StdModel`::
 
     @property
     def read_backend(self):
+        if isinstance(self._read_backend, ReadReplicas):
+            return self._read_backend.get()
         return self._read_backend or self._backend
 
+    @property
+    def read_replicas(self):
+        if isinstance(self._read_backend, ReadReplicas):
+            return self._read_backend
+
     def __getattr__(self, attrname):
         if attrname.startswith('__'):  # required for copy
             raise AttributeError
@@ -937,6 +1083,26 @@ method for the more verbose::
 '''
         return self.session().add(instance)
 
+    def bulk_insert(self, iterable, batch_size=1000, ids=False):
+        '''Insert new instances of :attr:`model` into the :attr:`backend`,
+``batch_size`` instances at a time. The ``iterable`` can yield
+:attr:`model` instances or dictionaries of field values.
+
+Instances are not added to a :class:`Session` and no signals are sent,
+which keeps memory bounded when loading large datasets.
+
+:param iterable: iterable over instances or dictionaries.
+:param batch_size: number of instances committed in one call to the
+    backend server.
+:param ids: if ``True`` return the list of ids of the inserted instances.
+:return: the number of instances inserted, or their ids.
+'''
+        model = self.model
+        instances = (row if isinstance(row, model) else model(**row)
+                     for row in iterable)
+        return self.backend.bulk_insert(self._meta, instances, batch_size,
+                                        ids=ids)
+
     def update_or_create(self, **kwargs):
         '''Invokes the :class:`Session.update_or_create` method.'''
         return self.session().update_or_create(self.model, **kwargs)
@@ -290,7 +290,7 @@ class Structure(ModelBase):
         if self.cache.cache is None:
             return self.read_backend_structure().size()
         else:
-            return len(self.cache.cache)
+            return self.read_backend.execute(len(self.cache.cache))
 
     def __contains__(self, value):
         return self.pickler.dumps(value) in self.read_backend_structure()
@@ -349,9 +349,10 @@ structure :class:`Zset`.
         '''Iterator over items (pairs) of :class:`PairMixin`.'''
         if self.cache.cache is None:
             backend = self.read_backend
-            backend.execute(backend.structure(self).items(),
-                            lambda data: self.load_data(data, self._items))
-        return self.cache.items()
+            return backend.execute(
+                backend.structure(self).items(),
+                lambda data: self.load_data(data, self._items))
+        return self.read_backend.execute(self.cache.items())
 
     def values(self):
         '''Iteratir over values of :class:`PairMixin`.'''
@@ -360,7 +361,7 @@ structure :class:`Zset`.
             return backend.execute(backend.structure(self).values(),
                                    self.load_values)
         else:
-            return self.cache.cache.values()
+            return self.read_backend.execute(self.cache.cache.values())
 
     def pair(self, pair):
         '''Add a *pair* to the structure.'''
@@ -441,7 +442,7 @@ methods, while its iterator is over keys.'''
             return backend.execute(backend.structure(self).keys(),
                                    self.load_keys)
         else:
-            return self.cache.cache
+            return self.read_backend.execute(self.cache.cache)
 
     def __delitem__(self, key):
         '''Remove an element. Same as the :meth:`remove` method`.'''
@@ -454,7 +455,7 @@ methods, while its iterator is over keys.'''
             res = backend.structure(self).get(dkey)
             return backend.execute(res, lambda r: self._load_get_data(r, key))
         else:
-            return self.cache.cache[key]
+            return self.read_backend.execute(self.cache.cache[key])
 
     def get(self, key, default=None):
         '''Retrieve a single element from the structure.
@@ -469,7 +470,8 @@ If the element is not available return the default value.
             return backend.execute(
                 res, lambda r: self._load_get_data(r, key, default))
         else:
-            return self.cache.cache.get(key, default)
+            return self.read_backend.execute(self.cache.cache.get(key,
+                                                                  default))
 
     def pop(self, key, *args):
         if len(args) <= 1:
@@ -577,7 +579,7 @@ sequence.'''
             return backend.execute(
                 backend.structure(self).range(),
                 lambda data: self.load_data(data, self._items))
-        return self.cache.items()
+        return self.read_backend.execute(self.cache.items())
 
     @commit_when_no_transaction
     def push_back(self, value):
@@ -646,16 +648,20 @@ the front of the list in an efficient manner.'''
     def block_pop_back(self, timeout=10):
         '''Remove the last element from of the list. If no elements are
 available, blocks for at least ``timeout`` seconds.'''
-        value = yield self.backend_structure().block_pop_back(timeout)
-        if value is not None:
-            yield self.value_pickler.loads(value)
+        return self.backend.execute(
+            self.backend_structure().block_pop_back(timeout),
+            self._load_value)
 
     def block_pop_front(self, timeout=10):
         '''Remove the first element from of the list. If no elements are
 available, blocks for at least ``timeout`` seconds.'''
-        value = yield self.backend_structure().block_pop_front(timeout)
+        return self.backend.execute(
+            self.backend_structure().block_pop_front(timeout),
+            self._load_value)
+
+    def _load_value(self, value):
         if value is not None:
-            yield self.value_pickler.loads(value)
+            return self.value_pickler.loads(value)
 
     @commit_when_no_transaction
     def push_front(self, value):
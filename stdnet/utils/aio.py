@@ -0,0 +1,132 @@
+'''Utilities for backends running on an asyncio_ event loop.
+
+Stdnet asynchronous components are generators yielding asynchronous
+results. :func:`maybe_async` runs them on the event loop and returns a
+:class:`Future` with the last value yielded. Available for python 3.4 and
+above.
+
+.. _asyncio: https://docs.python.org/3/library/asyncio.html
+'''
+from inspect import isgenerator
+
+import asyncio
+
+
+__all__ = ['Future', 'maybe_async', 'is_async', 'get_event_loop']
+
+
+get_event_loop = asyncio.get_event_loop
+is_async = lambda value: isinstance(value, asyncio.Future)
+
+
+class Future(asyncio.Future):
+    '''An :class:`asyncio.Future` with the ``add_callback`` method used by
+stdnet to chain asynchronous results.'''
+    def add_callback(self, callback, errback=None):
+        '''Return a new :class:`Future` called back with the result of
+``callback`` once this future is done. If this future fails, the ``errback``,
+if given, is called with the exception instead.'''
+        future = Future(loop=self._loop)
+
+        def _done(fut):
+            if fut.cancelled():
+                future.cancel()
+                return
+            exc = fut.exception()
+            try:
+                if exc is None:
+                    result = callback(fut.result())
+                elif errback is not None:
+                    result = errback(exc)
+                else:
+                    future.set_exception(exc)
+                    return
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                chain(maybe_async(result, self._loop), future)
+
+        self.add_done_callback(_done)
+        return future
+
+
+def chain(value, future):
+    '''Set the outcome of ``value`` into ``future`` once available.'''
+    if not is_async(value):
+        future.set_result(value)
+    elif value.done():
+        _copy(value, future)
+    else:
+        value.add_done_callback(lambda fut: _copy(fut, future))
+
+
+def maybe_async(value, loop=None):
+    '''Run ``value`` on the event ``loop`` and return a :class:`Future`.
+
+If ``value`` is a generator, it is run until exhausted: every asynchronous
+result it yields is waited for and sent back into it, nested generators are
+run in the same way. The result of the future is the last value yielded.
+Other values are wrapped into a done future.'''
+    if isinstance(value, Future):
+        return value
+    future = Future(loop=loop or get_event_loop())
+    if isgenerator(value):
+        _step(value, future, None, None)
+    else:
+        chain(value, future)
+    return future
+
+
+def _copy(source, future):
+    if future.cancelled():
+        return
+    if source.cancelled():
+        future.cancel()
+    elif source.exception() is not None:
+        future.set_exception(source.exception())
+    else:
+        future.set_result(source.result())
+
+
+def _step(gen, future, value, exc):
+    # Drive the generator until it waits for a pending result or it is
+    # exhausted. Results already available are sent back without going
+    # through the event loop.
+    while True:
+        try:
+            if exc is not None:
+                result = gen.throw(exc)
+            else:
+                result = gen.send(value)
+        except StopIteration:
+            future.set_result(value)
+            return
+        except Exception as e:
+            future.set_exception(e)
+            return
+        exc = None
+        if isgenerator(result):
+            result = maybe_async(result, future._loop)
+        if is_async(result):
+            if not result.done():
+                result.add_done_callback(
+                    lambda fut: _resume(gen, future, fut))
+                return
+            if result.cancelled():
+                exc = asyncio.CancelledError()
+            else:
+                exc = result.exception()
+            value = None if exc is not None else result.result()
+        else:
+            value = result
+
+
+def _resume(gen, future, fut):
+    if future.cancelled():
+        gen.close()
+    elif fut.cancelled():
+        _step(gen, future, None, asyncio.CancelledError())
+    elif fut.exception() is not None:
+        _step(gen, future, None, fut.exception())
+    else:
+        _step(gen, future, fut.result(), None)
@@ -24,6 +24,7 @@ class TestBackend(test.TestCase):
         self.assertFalse(b.clean(None))
         self.assertRaises(NotImplementedError, b.execute_session, None, None)
         self.assertRaises(NotImplementedError, b.model_keys, None)
+        self.assertRaises(NotImplementedError, b.bulk_insert, None, (), 10)
         self.assertRaises(NotImplementedError, b.flush)
 
     def testMissingStructure(self):
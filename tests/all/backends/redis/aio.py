@@ -0,0 +1,223 @@
+'''Test the asyncio redis client and backend'''
+from stdnet import odm, getdb, ImproperlyConfigured
+from stdnet.utils import test
+from stdnet.backends import StopAsyncIteration
+from stdnet.backends.redisb.client import RedisError as ResponseError
+from stdnet.backends.redisb.client import aio
+
+from examples.models import SimpleModel
+
+if aio:
+    import asyncio
+    from stdnet.utils.aio import Future, maybe_async
+
+
+@test.skipUnless(aio, 'Requires asyncio')
+class TestAsyncioBackend(test.TestWrite):
+    multipledb = 'redis'
+    models = (SimpleModel,)
+
+    def setUp(self):
+        cs = self.backend.connection_string.replace('redis://',
+                                                    'redis+asyncio://')
+        self.router = odm.Router(getdb(cs))
+        self.router.register(SimpleModel)
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.router.simplemodel.backend.disconnect()
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def run_async(self, gen):
+        return self.loop.run_until_complete(maybe_async(gen))
+
+    def populate(self, size=10):
+        with self.router.session().begin() as t:
+            for n in range(size):
+                t.add(SimpleModel(code='c%s' % n, group='g%s' % (n % 2),
+                                  number=n))
+        yield t.on_result
+
+    def test_parser(self):
+        parser = aio.RedisParser()
+        parser.feed(b'*3\r\n$3\r\nfoo\r\n*2\r\n:1\r\n$-1')
+        self.assertEqual(parser.get(), False)
+        parser.feed(b'\r\n$-1\r\n-ERR bla\r\n+OK\r\n')
+        self.assertEqual(parser.get(), [b'foo', [1, None], None])
+        error = parser.get()
+        self.assertIsInstance(error, ResponseError)
+        self.assertEqual(str(error), 'bla')
+        self.assertEqual(parser.get(), b'OK')
+        self.assertEqual(parser.get(), False)
+
+    def test_query_cache(self):
+        cs = self.backend.connection_string.replace('redis://',
+                                                    'redis+asyncio://')
+        self.assertRaises(ImproperlyConfigured, getdb, cs, query_cache=60)
+
+    def test_stray_reply(self):
+        protocol = aio.RedisProtocol(self.loop)
+        # no request is waiting, the reply is dropped
+        protocol.data_received(b'+OK\r\n')
+        self.assertEqual(protocol.pending, 0)
+
+    def test_connection_setup(self):
+        client = self.router.simplemodel.backend.client
+        address = client.connection_pool.address
+
+        def _test():
+            pool = aio.ConnectionPool(address, db=7, loop=self.loop)
+            connection = yield pool.acquire()
+            # SELECT was replied before the connection is available
+            self.assertEqual(connection.pending, 0)
+            pool.release(connection)
+            pool.disconnect()
+            # the password is refused since the server has none
+            pool = aio.ConnectionPool(address, password='bla', loop=self.loop)
+            try:
+                yield pool.request([('PING',)])
+            except ResponseError:
+                pass
+            else:
+                self.fail('ResponseError not raised')
+            pool.disconnect()
+        self.run_async(_test())
+
+    def test_client(self):
+        client = self.router.simplemodel.backend.client
+        self.assertTrue(client.is_async)
+
+        def _test():
+            result = client.ping()
+            self.assertIsInstance(result, Future)
+            result = yield result
+            self.assertTrue(result)
+            pipe = client.pipeline()
+            pipe.set('bla', 1).get('bla').incr('bla')
+            result = yield pipe.execute()
+            self.assertEqual(result, [True, b'1', 2])
+            yield client.delete('bla')
+        self.run_async(_test())
+
+    def test_commit_and_query(self):
+        models = self.router
+
+        def _test():
+            yield self.populate()
+            query = models.simplemodel.filter(group='g1')
+            count = query.count()
+            self.assertIsInstance(count, Future)
+            count = yield count
+            self.assertEqual(count, 5)
+            objs = yield query.sort_by('-number').all()
+            self.assertEqual([o.number for o in objs], [9, 7, 5, 3, 1])
+            obj = yield models.simplemodel.get(code='c4')
+            self.assertEqual(obj.number, 4)
+            yield query.delete()
+            count = yield models.simplemodel.query().count()
+            self.assertEqual(count, 5)
+        self.run_async(_test())
+
+    def test_async_iterator(self):
+        models = self.router
+
+        def _test():
+            yield self.populate(12)
+            query = models.simplemodel.query().sort_by('number')
+            iterator = query.iterator(5)
+            self.assertTrue(iterator.__aiter__() is iterator)
+            numbers = []
+            while True:
+                try:
+                    obj = yield iterator.__anext__()
+                except StopAsyncIteration:
+                    break
+                numbers.append(obj.number)
+            self.assertEqual(numbers, list(range(12)))
+            iterator = models.simplemodel.filter(code='foo').__aiter__()
+            try:
+                yield iterator.__anext__()
+            except StopAsyncIteration:
+                pass
+            else:
+                self.fail('StopAsyncIteration not raised')
+        self.run_async(_test())
+
+    def test_noscript_retry(self):
+        models = self.router
+        client = models.simplemodel.backend.client
+
+        def _test():
+            yield self.populate(4)
+            yield client.script_flush()
+            count = yield models.simplemodel.filter(group='g1').count()
+            self.assertEqual(count, 2)
+            yield client.script_flush()
+            # commit in a pipeline
+            with models.session().begin() as t:
+                t.add(SimpleModel(code='d0', group='g0'))
+                t.add(SimpleModel(code='d1', group='g1'))
+            yield t.on_result
+            count = yield models.simplemodel.query().count()
+            self.assertEqual(count, 6)
+            yield client.script_flush()
+            value = yield client.zpopbyrank('nokey', 0)
+            self.assertEqual(value, [])
+        self.run_async(_test())
+
+    def test_gather(self):
+        models = self.router
+
+        def _test():
+            yield self.populate()
+            q1 = models.simplemodel.filter(group='g0').sort_by('number')
+            q2 = models.simplemodel.filter(code='c3')
+            results = models.gather(q1, q2)
+            self.assertIsInstance(results, Future)
+            results = yield results
+            self.assertEqual([o.number for o in results[0]], [0, 2, 4, 6, 8])
+            self.assertEqual([o.code for o in results[1]], ['c3'])
+            count = yield q1.count()
+            self.assertEqual(count, 5)
+        self.run_async(_test())
+
+    def test_scan_pattern(self):
+        models = self.router
+        backend = models.simplemodel.backend
+
+        def _test():
+            yield self.populate(5)
+            keys = backend.model_keys(SimpleModel._meta)
+            self.assertIsInstance(keys, Future)
+            keys = yield keys
+            self.assertTrue(backend.basekey(SimpleModel._meta, 'id') in keys)
+            pattern = backend.basekey(SimpleModel._meta, 'obj', '*')
+            count = yield backend.client.countpattern(pattern, 2)
+            self.assertEqual(count, 5)
+            yield backend.flush(SimpleModel._meta)
+            count = yield models.simplemodel.query().count()
+            self.assertEqual(count, 0)
+            keys = yield backend.model_keys(SimpleModel._meta)
+            self.assertEqual(keys, [])
+        self.run_async(_test())
+
+    def test_structures(self):
+        models = self.router
+
+        def _test():
+            with models.session().begin() as t:
+                l = t.add(models.register(odm.List()))
+                l.push_back('a')
+                l.push_back('b')
+            yield t.on_result
+            items = yield l.items()
+            self.assertEqual(items, ['a', 'b'])
+            size = l.size()
+            self.assertIsInstance(size, Future)
+            size = yield size
+            self.assertEqual(size, 2)
+            value = yield l.block_pop_front(1)
+            self.assertEqual(value, 'a')
+        self.run_async(_test())
@@ -1,5 +1,6 @@
 '''Test additional commands for redis client.'''
 import json
+import threading
 from hashlib import sha1
 
 from stdnet import getdb
@@ -59,6 +60,123 @@ class TestExtraClientCommands(TestCase):
         self.assertTrue(script.script)
         sha = sha1(script.script.encode('utf-8')).hexdigest()
         self.assertEqual(script.sha1,sha)
+
+    def test_lazy_script(self):
+        script = redisb.RedisScript((redisb.lua_file('commands.utils'),
+                                     'return 1'), 'lazy_script')
+        self.assertFalse('_script' in script.__dict__)
+        self.assertEqual(script.script,
+                         redisb.read_lua_file('commands.utils') + '\nreturn 1')
+
+    def test_preload_scripts(self):
+        c = self.backend.client
+        shas = yield c.preload_scripts()
+        self.assertEqual(len(shas), len(redisb.registered_scripts()))
+        self.assertEqual(shas[0], redisb.get_script(
+            redisb.registered_scripts()[0]).sha1)
+        exists = yield c.script_exists(*shas)
+        self.assertTrue(all(exists))
+        self.assertRaises(redisb.RedisError, c.preload_scripts, ['bla'])
+
+    def test_noscript_retry(self):
+        c = self.client
+        self.make_zset('a', {'a1': 1, 'a2': 2, 'a3': 3})
+        yield c.script_flush()
+        yield self.async.assertEqual(c.zpopbyrank('a', 0), [b'a1'])
+        yield c.script_flush()
+        # only scripts are executed again
+        pipe = self.backend.client.pipeline()
+        pipe.set(self.namespace + 'b', 1)
+        pipe.zpopbyrank(self.namespace + 'a', 0)
+        pipe.incr(self.namespace + 'b')
+        result = yield pipe.execute()
+        self.assertEqual(result, [True, [b'a2'], 2])
+        yield self.async.assertEqual(c.get('b'), b'2')
+
+    def test_noscript_retry_not_idempotent(self):
+        c = self.client
+        ns = self.namespace
+        self.make_zset('a', {'a1': 1, 'a2': 2, 'a3': 3})
+        yield c.set('b', 'foo')
+        yield c.set('d', 'bla')
+        yield c.script_flush()
+        pipe = self.backend.client.pipeline()
+        pipe.rename(ns + 'b', ns + 'c')
+        pipe.zpopbyrank(ns + 'a', 0)
+        pipe.delete(ns + 'd')
+        pipe.setnx(ns + 'd', 'new')
+        pipe.zpopbyrank(ns + 'a', 0)
+        result = yield pipe.execute()
+        self.assertEqual(result, [True, [b'a1'], 1, True, [b'a2']])
+        yield self.async.assertEqual(c.get('c'), b'foo')
+        yield self.async.assertEqual(c.get('d'), b'new')
+        yield self.async.assertEqual(c.zcard('a'), 1)
+
+    def test_where_scripts(self):
+        script = redisb.where_script('this.a > 1')
+        name = script.name
+        self.assertEqual(redisb.where_script('this.a > 1'), script)
+        self.assertEqual(redisb.get_script(name), script)
+        self.assertTrue('this.a > 1' in script.script)
+        max_scripts = redisb.MAX_WHERE_SCRIPTS
+        redisb.MAX_WHERE_SCRIPTS = 2
+        try:
+            name2 = redisb.where_script('this.a > 2').name
+            # the first script is the most recently used
+            self.assertEqual(redisb.where_script('this.a > 1'), script)
+            name3 = redisb.where_script('this.a > 3').name
+            self.assertFalse(redisb.get_script(name2))
+            self.assertTrue(redisb.get_script(name))
+            self.assertTrue(redisb.get_script(name3))
+        finally:
+            redisb.MAX_WHERE_SCRIPTS = max_scripts
+
+    def test_unregistered_where_script(self):
+        # a where script unregistered by another thread before the pipeline
+        # has run is still loaded and executed
+        c = self.backend.client
+        ns = self.namespace
+        meta = json.dumps({'namespace': ns + 'm'})
+        yield c.hmset(ns + 'm:obj:1', {'a': 2})
+        yield c.hmset(ns + 'm:obj:2', {'a': 0})
+        yield c.sadd(ns + 'ids', 1, 2)
+        script = redisb.where_script('this.a > 1')
+        # evict the script as the least recently used does
+        with redisb._where_scripts_lock:
+            redisb._where_scripts.pop(script.name)
+            redisb.unregister_script(script.name)
+        self.assertFalse(redisb.get_script(script.name))
+        pipe = c.pipeline()
+        pipe.execute_script(script, (ns + 'a', ns + 'ids'), meta)
+        yield pipe.execute()
+        yield self.async.assertEqual(c.smembers(ns + 'a'), set((b'1',)))
+        # scripts flushed from the server are loaded again
+        yield c.script_flush()
+        pipe = c.pipeline()
+        pipe.execute_script(script, (ns + 'b', ns + 'ids'), meta)
+        yield pipe.execute()
+        yield self.async.assertEqual(c.smembers(ns + 'b'), set((b'1',)))
+
+    def test_where_scripts_threads(self):
+        max_scripts = redisb.MAX_WHERE_SCRIPTS
+        redisb.MAX_WHERE_SCRIPTS = 5
+
+        def _register(n):
+            for m in range(50):
+                redisb.where_script('this.a > %s' % ((n + m) % 12))
+        threads = [threading.Thread(target=_register, args=(n,))
+                   for n in range(4)]
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            scripts = redisb._where_scripts
+            self.assertEqual(len(scripts), 5)
+            for name in scripts:
+                self.assertTrue(redisb.get_script(name))
+        finally:
+            redisb.MAX_WHERE_SCRIPTS = max_scripts
         
     def test_del_pattern(self):
         c = self.client
@@ -78,6 +196,37 @@ class TestExtraClientCommands(TestCase):
         yield self.async.assertEqual(c.get('xxxx'), b'moon')
         N = yield c.delpattern('x*')
         self.assertEqual(N, 2)
+
+    def test_scan_pattern(self):
+        c = self.client
+        items = []
+        for n in range(9):
+            items.extend(('key%s' % n, n))
+        yield self.async.assertTrue(c.execute_command('MSET', 'foo', 1,
+                                                      *items))
+        yield self.async.assertEqual(c.countpattern('key*', 2), 9)
+        yield self.async.assertEqual(c.countpattern('*'), 10)
+        keys = yield c.scankeys('key*', 4)
+        self.assertEqual(sorted(keys),
+                         sorted((('key%s' % n).encode('utf-8')
+                                 for n in range(9))))
+        keys = yield c.keyinfo('*', 3)
+        self.assertEqual(len(keys), 10)
+        self.assertEqual(set((k.key for k in keys if k.key != 'foo')),
+                         set(('key%s' % n for n in range(9))))
+        yield self.async.assertEqual(c.delpattern('key*', 2), 9)
+        yield self.async.assertEqual(c.scankeys('*'), [b'foo'])
+
+    def test_countpattern_duplicates(self):
+        c = self.client
+        # SCAN may return a key more than once
+        keys = [c.prefix + k for k in ('a', 'b', 'c')]
+        batches = iter(((5, keys[:2]), (3, keys[1:]), (0, keys[:1])))
+        c.scan = lambda cursor, **params: next(batches)
+        try:
+            self.assertEqual(c.countpattern('*'), 3)
+        finally:
+            del c.scan
         
     def testMove2Set(self):
         yield self.multi_async((self.client.sadd('foo', 1, 2, 3, 4, 5),
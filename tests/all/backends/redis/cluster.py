@@ -0,0 +1,83 @@
+from datetime import date
+
+from stdnet import odm, getdb
+from stdnet.utils import test
+
+from examples.models import Instrument, Fund, Position
+
+
+class TestClusterKeyLayout(test.TestWrite):
+    multipledb = 'redis'
+    models = (Instrument, Fund, Position)
+
+    def router(self, **params):
+        backend = getdb(self.backend.connection_string, cluster=1, **params)
+        self.assertTrue(backend.cluster)
+        self.assertTrue('cluster=1' in backend.connection_string)
+        models = odm.Router(backend)
+        for model in self.models:
+            models.register(model)
+        return models
+
+    def populate(self, models):
+        session = models.session()
+        with session.begin() as t:
+            eni = t.add(Instrument(name='eni', ccy='EUR', type='equity'))
+            ibm = t.add(Instrument(name='ibm', ccy='USD', type='equity'))
+            fund = t.add(Fund(name='bla', ccy='EUR'))
+        yield t.on_result
+        with session.begin() as t:
+            t.add(Position(instrument=eni, fund=fund, dt=date.today()))
+            t.add(Position(instrument=ibm, fund=fund, dt=date.today()))
+        yield t.on_result
+        yield eni
+
+    def hash_tag(self, model):
+        return '{%s}' % model._meta.modelkey
+
+    def test_basekey(self):
+        models = self.router()
+        backend = models.position.backend
+        self.assertEqual(backend.basekey(Position._meta, 'id'),
+                         '%s%s:id' % (backend.namespace,
+                                      self.hash_tag(Position)))
+        yield self.populate(models)
+        for model in self.models:
+            keys = yield backend.model_keys(model._meta)
+            self.assertTrue(keys)
+            for key in keys:
+                self.assertTrue(self.hash_tag(model) in key)
+
+    def test_related_query(self):
+        models = self.router()
+        eni = yield self.populate(models)
+        qs = models.position.filter(instrument__ccy='EUR')
+        self.assertTrue(self.hash_tag(Position) in
+                        qs.backend_query().query_key)
+        objs = yield qs.load_related('instrument').all()
+        self.assertEqual(len(objs), 1)
+        self.assertEqual(objs[0].instrument, eni)
+        qs = models.position.filter(instrument__ccy='JPY')
+        yield self.async.assertEqual(qs.count(), 0)
+        qs = models.position.exclude(instrument__ccy='EUR')
+        yield self.async.assertEqual(qs.count(), 1)
+
+    def test_related_delete(self):
+        models = self.router()
+        yield self.populate(models)
+        yield models.instrument.filter(ccy='EUR').delete()
+        yield self.async.assertEqual(models.position.query().count(), 1)
+
+    def test_read_only(self):
+        models = self.router()
+        eni = yield self.populate(models)
+        models = self.router(read_only=1)
+        self.assertTrue(models.position.backend.read_only)
+        session = models.session()
+        qs = session.query(Position).filter(instrument__ccy='EUR')
+        self.assertTrue(qs.backend_query().read_only)
+        objs = yield qs.all()
+        self.assertEqual(len(objs), 1)
+        self.assertEqual(objs[0].instrument_id, eni.id)
+        qs = session.query(Position).filter(instrument__ccy='JPY')
+        yield self.async.assertEqual(qs.count(), 0)
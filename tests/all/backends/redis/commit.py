@@ -0,0 +1,92 @@
+'''Large commits split in several script calls'''
+from stdnet import odm, getdb
+from stdnet.utils import test
+
+from examples.models import SimpleModel
+
+
+class TestCommitChunks(test.TestWrite):
+    multipledb = 'redis'
+    models = (SimpleModel,)
+
+    def router(self, **params):
+        backend = getdb(self.backend.connection_string, **params)
+        models = odm.Router(backend)
+        models.register(SimpleModel)
+        return models
+
+    def test_connection_string(self):
+        backend = getdb(self.backend.connection_string, commit_chunk_size=2,
+                        commit_chunk_bytes=100)
+        self.assertEqual(backend.commit_chunk_size, 2)
+        self.assertEqual(backend.commit_chunk_bytes, 100)
+        self.assertTrue('commit_chunk_size=2' in backend.connection_string)
+        self.assertEqual(self.backend.commit_chunk_size, 0)
+
+    def test_commit_instances(self):
+        models = self.router(commit_chunk_size=2)
+        backend = models.simplemodel.backend
+        session = models.session()
+        instances = [session.add(SimpleModel(code='a%s' % n))
+                     for n in range(5)]
+        pipe = backend.client.pipeline()
+        backend.commit_instances(pipe, SimpleModel._meta, instances)
+        # the transaction mode of the pipeline is not changed
+        self.assertTrue(pipe.transaction)
+        self.assertEqual(len(self.scripts(pipe)), 3)
+        pipe.reset()
+        # chunks are added to their own pipeline
+        pipe = backend.client.pipeline()
+        chunked = backend.client.pipeline(transaction=False)
+        backend.commit_instances(pipe, SimpleModel._meta, instances, chunked)
+        self.assertTrue(pipe.transaction)
+        self.assertEqual(self.scripts(pipe), [])
+        self.assertEqual(len(self.scripts(chunked)), 3)
+        chunked.reset()
+        backend.commit_instances(pipe, SimpleModel._meta, instances[:2],
+                                 chunked)
+        self.assertEqual(len(self.scripts(pipe)), 1)
+        self.assertEqual(chunked.command_stack, [])
+        pipe.reset()
+
+    def scripts(self, pipe):
+        return [c for c in pipe.command_stack if c[0][0] == 'EVALSHA']
+
+    def test_commit(self):
+        models = self.router(commit_chunk_size=2)
+        committed = []
+
+        def post_commit(signal, sender, instances=None, **kwargs):
+            committed.append(len(instances))
+        models.post_commit.bind(post_commit, sender=SimpleModel)
+        with models.session().begin() as t:
+            for n in range(5):
+                t.add(SimpleModel(code='b%s' % n, group='g'))
+        yield t.on_result
+        self.assertEqual(committed, [5])
+        self.assertEqual(len(t.saved[SimpleModel._meta]), 5)
+        ids = [m.id for m in t.saved[SimpleModel._meta]]
+        self.assertEqual(len(set(ids)), 5)
+        yield self.async.assertEqual(models.simplemodel.filter(group='g')
+                                     .count(), 5)
+        objs = yield models.simplemodel.filter(id=ids).sort_by('code').all()
+        self.assertEqual([o.code for o in objs],
+                         ['b0', 'b1', 'b2', 'b3', 'b4'])
+
+    def test_commit_bytes(self):
+        models = self.router(commit_chunk_bytes=30)
+        with models.session().begin() as t:
+            for n in range(4):
+                t.add(SimpleModel(code='c%s' % n, description='x' * 20))
+        yield t.on_result
+        self.assertEqual(len(t.saved[SimpleModel._meta]), 4)
+        yield self.async.assertEqual(models.simplemodel.query().count(), 4)
+        # update existing instances in several chunks
+        objs = yield models.simplemodel.all()
+        with models.session().begin() as t:
+            for m in objs:
+                m.description = 'y' * 20
+                t.add(m)
+        yield t.on_result
+        objs = yield models.simplemodel.all()
+        self.assertEqual(set((o.description for o in objs)), set(('y' * 20,)))
@@ -1,6 +1,7 @@
 import time
 
 from stdnet.backends.redisb import RedisDb, RedisKey, RedisDataFormatter
+from stdnet.backends.redisb.client.extensions import KeyQuery
 
 from . import client
 
@@ -37,6 +38,55 @@ class TestInfo(client.TestCase):
         keys = yield client.execute_script('keyinfo', ('planet', 'bla'))
         self.assertEqual(len(keys), 2)
         
+    def test_key_query(self):
+        client = self.client
+        for n in range(7):
+            yield client.set('key%s' % n, n)
+        yield client.set('planet', 'mars')
+        db = RedisDb(db=self.backend.params['db'])
+        db.client = client
+        query = KeyQuery(RedisKey._meta, self.session()).filter(db)
+        query.scan_count = 2
+        self.assertEqual(query.count(), 8)
+        keys = query.all()
+        self.assertEqual(len(keys), 8)
+        self.assertEqual(query[2:5], keys[2:5])
+        q = query.search('key*')
+        self.assertNotEqual(q, query)
+        self.assertEqual(q.pattern, 'key*')
+        self.assertEqual(len(q), 7)
+        self.assertEqual(len(q[-3:]), 3)
+        self.assertEqual(query.search('plan*')[0].key, 'planet')
+
+    def test_key_query_duplicates(self):
+        client = self.client
+        for n in range(7):
+            yield client.set('key%s' % n, n)
+        db = RedisDb(db=self.backend.params['db'])
+        db.client = client
+        query = KeyQuery(RedisKey._meta, self.session()).filter(db)
+        scan = client.scan
+        pages = []
+
+        def _scan(cursor, **kwargs):
+            # the first page is half of the keys, the second page all the
+            # keys again
+            keys, cursor = [], 0
+            while True:
+                cursor, page = scan(cursor, **kwargs)
+                keys.extend(page)
+                if not int(cursor):
+                    break
+            pages.append(keys)
+            if len(pages) == 1:
+                return 1, keys[:len(keys)//2]
+            return 0, keys
+        client.scan = _scan
+        keys = [k.key for k in query.search('key*')]
+        self.assertEqual(len(pages), 2)
+        self.assertEqual(len(keys), 7)
+        self.assertEqual(set(keys), set(('key%s' % n for n in range(7))))
+
     def test_manager(self):
         redisdb = yield self.get_manager()
         self.assertTrue(redisdb.client)
@@ -0,0 +1,30 @@
+import json
+
+from stdnet import odm
+from stdnet.utils import test
+
+from examples.models import SimpleModel
+
+
+class TestMetaInfo(test.TestCase):
+    multipledb = 'redis'
+    model = SimpleModel
+
+    def test_cached(self):
+        backend = self.mapper.simplemodel.backend
+        meta = self.model._meta
+        info = backend.meta_info(meta)
+        self.assertEqual(json.loads(info), backend.meta(meta))
+        self.assertTrue(backend.meta_info(meta) is info)
+        query = self.query().filter(code='a').backend_query()
+        self.assertTrue(query.meta_info is info)
+
+    def test_invalidated_on_registration(self):
+        backend = self.mapper.simplemodel.backend
+        meta = self.model._meta
+        info = backend.meta_info(meta)
+        models = odm.Router()
+        models.register(self.model, backend)
+        info2 = backend.meta_info(meta)
+        self.assertEqual(info2, info)
+        self.assertFalse(info2 is info)
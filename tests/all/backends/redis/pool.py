@@ -0,0 +1,72 @@
+'''Connection pools shared by redis backends'''
+import os
+
+from stdnet import getdb
+from stdnet.utils import test
+from stdnet.backends.redisb.client import ConnectionPool, pools, redis
+
+
+class TestConnectionPools(test.TestWrite):
+    multipledb = 'redis'
+
+    def pool(self, **params):
+        backend = getdb(self.backend.connection_string, **params)
+        pool = backend.client.connection_pool
+        self.assertIsInstance(pool, ConnectionPool)
+        return pool
+
+    def test_shared(self):
+        pool = self.pool()
+        self.assertEqual(self.pool(), pool)
+        self.assertEqual(self.backend.client.connection_pool, pool)
+        db = int(self.backend.params['db']) + 1
+        self.assertNotEqual(self.pool(db=db), pool)
+        self.assertNotEqual(self.pool(max_connections=5), pool)
+
+    def test_max_connections(self):
+        backend = getdb(self.backend.connection_string, max_connections=2)
+        self.assertTrue('max_connections=2' in backend.connection_string)
+        pool = backend.client.connection_pool
+        self.assertEqual(pool.max_connections, 2)
+        c1 = pool.get_connection('PING')
+        c2 = pool.get_connection('PING')
+        try:
+            self.assertRaises(redis.ConnectionError, pool.get_connection,
+                              'PING')
+        finally:
+            pool.release(c1)
+            pool.release(c2)
+        self.assertTrue(backend.ping())
+
+    def test_idle_timeout(self):
+        pool = self.pool(idle_timeout=60)
+        self.assertEqual(pool.idle_timeout, 60)
+        pool.disconnect()
+        c1 = pool.get_connection('PING')
+        c2 = pool.get_connection('PING')
+        c1.connect()
+        pool.release(c1)
+        pool.release(c2)
+        c1.last_used -= 120
+        created = pool._created_connections
+        self.assertEqual(pool.get_connection('PING'), c2)
+        self.assertTrue(c1._sock is None)
+        self.assertEqual(pool._available_connections, [])
+        self.assertEqual(pool._created_connections, created - 1)
+        pool.release(c2)
+
+    def test_fork(self):
+        pool = self.pool()
+        connection = pool.get_connection('PING')
+        connection.connect()
+        pool.release(connection)
+        # simulate a forked process
+        pool.pid = -1
+        pools._pid = -1
+        other = pool.get_connection('PING')
+        self.assertNotEqual(other, connection)
+        # the socket is still used by the parent process
+        self.assertTrue(connection._sock is not None)
+        pool.release(other)
+        self.assertNotEqual(self.pool(), pool)
+        self.assertEqual(pools._pid, os.getpid())
@@ -0,0 +1,110 @@
+from datetime import date
+
+from stdnet import odm, getdb
+from stdnet.utils import test
+
+from examples.models import SimpleModel, Instrument, Fund, Position
+
+
+class TestQueryCache(test.TestWrite):
+    multipledb = 'redis'
+    models = (SimpleModel, Instrument, Fund, Position)
+
+    def router(self):
+        backend = getdb(self.backend.connection_string, query_cache=60)
+        self.assertEqual(backend.query_cache, 60)
+        self.assertTrue('query_cache=60' in backend.connection_string)
+        models = odm.Router(backend)
+        for model in self.models:
+            models.register(model)
+        return models
+
+    def populate(self, models):
+        with models.session().begin() as t:
+            t.add(models.simplemodel(code='pluto', group='planet'))
+            t.add(models.simplemodel(code='venus', group='planet'))
+            t.add(models.simplemodel(code='mars', group='planet'))
+            t.add(models.simplemodel(code='sun', group='star'))
+        return t.on_result
+
+    def test_same_key(self):
+        models = self.router()
+        yield self.populate(models)
+        qs1 = models.simplemodel.filter(group='planet')
+        qs2 = models.simplemodel.filter(group='planet')
+        bq1, bq2 = qs1.backend_query(), qs2.backend_query()
+        self.assertEqual(bq1.query_key, bq2.query_key)
+        self.assertFalse(bq1.temporary_key)
+        yield self.async.assertEqual(qs1.count(), 3)
+        qs3 = models.simplemodel.filter(group='planet')
+        self.assertEqual(qs3.backend_query().query_key, bq1.query_key)
+        yield self.async.assertEqual(qs3.count(), 3)
+        # a different query
+        qs4 = models.simplemodel.filter(group='star')
+        self.assertNotEqual(qs4.backend_query().query_key, bq1.query_key)
+        yield self.async.assertEqual(qs4.count(), 1)
+
+    def test_canonical(self):
+        models = self.router()
+        yield self.populate(models)
+        query = models.simplemodel.query()
+        qs1 = query.filter(group='planet').filter(code=('pluto', 'mars'))
+        yield self.async.assertEqual(qs1.count(), 2)
+        qs2 = query.filter(code=('mars', 'pluto')).filter(group='planet')
+        self.assertEqual(qs1.backend_query().query_key,
+                         qs2.backend_query().query_key)
+        yield self.async.assertEqual(qs2.count(), 2)
+        qs3 = query.exclude(code='pluto').exclude(group='star')
+        qs4 = query.exclude(group='star').exclude(code='pluto')
+        yield self.async.assertEqual(qs3.count(), 2)
+        self.assertEqual(qs3.backend_query().query_key,
+                         qs4.backend_query().query_key)
+        codes = yield qs4.get_field('code').all()
+        self.assertEqual(set(codes), set(('venus', 'mars')))
+        codes = yield qs3.get_field('code').all()
+        self.assertEqual(set(codes), set(('venus', 'mars')))
+
+    def test_commit_expires(self):
+        models = self.router()
+        yield self.populate(models)
+        qs = models.simplemodel.filter(group='planet')
+        key = qs.backend_query().query_key
+        yield self.async.assertEqual(qs.count(), 3)
+        yield models.simplemodel.new(code='earth', group='planet')
+        qs = models.simplemodel.filter(group='planet')
+        self.assertNotEqual(qs.backend_query().query_key, key)
+        yield self.async.assertEqual(qs.count(), 4)
+        key = qs.backend_query().query_key
+        yield models.simplemodel.filter(code='sun').delete()
+        qs = models.simplemodel.filter(group='planet')
+        self.assertNotEqual(qs.backend_query().query_key, key)
+        yield self.async.assertEqual(qs.count(), 4)
+
+    def test_related_model(self):
+        models = self.router()
+        session = models.session()
+        with session.begin() as t:
+            inst = t.add(Instrument(name='eni', ccy='EUR', type='equity'))
+            fund = t.add(Fund(name='bla', ccy='EUR'))
+        yield t.on_result
+        yield models.position.new(instrument=inst, fund=fund,
+                                  dt=date.today())
+        qs = models.position.filter(instrument__ccy='EUR')
+        key = qs.backend_query().query_key
+        yield self.async.assertEqual(qs.count(), 1)
+        qs = models.position.filter(instrument__ccy='EUR')
+        self.assertEqual(qs.backend_query().query_key, key)
+        inst.ccy = 'USD'
+        yield models.instrument.save(inst)
+        qs = models.position.filter(instrument__ccy='EUR')
+        self.assertNotEqual(qs.backend_query().query_key, key)
+        yield self.async.assertEqual(qs.count(), 0)
+
+    def test_disabled(self):
+        yield self.populate(self.mapper)
+        qs = self.mapper.simplemodel.filter(group='planet')
+        bq = qs.backend_query()
+        self.assertTrue(bq.temporary_key)
+        self.assertNotEqual(
+            self.mapper.simplemodel.filter(group='planet').backend_query(
+            ).query_key, bq.query_key)
@@ -0,0 +1,119 @@
+from datetime import date
+
+from stdnet import odm, getdb, QuerySetError
+from stdnet.utils import test
+
+from examples.models import SimpleModel, Instrument, Fund, Position
+
+
+class TestReadOnlyQuery(test.TestWrite):
+    multipledb = 'redis'
+    models = (SimpleModel, Instrument, Fund, Position)
+
+    def router(self):
+        backend = getdb(self.backend.connection_string, read_only=1)
+        self.assertTrue(backend.read_only)
+        self.assertTrue('read_only=1' in backend.connection_string)
+        models = odm.Router(self.backend)
+        for model in self.models:
+            models.register(model, read_backend=backend)
+        return models
+
+    def populate(self, models):
+        with models.session().begin() as t:
+            t.add(models.simplemodel(code='pluto', group='planet',
+                                     number=3))
+            t.add(models.simplemodel(code='venus', group='planet',
+                                     number=1))
+            t.add(models.simplemodel(code='mars', group='planet',
+                                     number=2))
+            t.add(models.simplemodel(code='sun', group='star', number=0))
+        return t.on_result
+
+    def temp_keys(self, model):
+        backend = self.backend
+        return backend.client.keys(backend.basekey(model._meta, 'tmp', '*'))
+
+    def test_filter(self):
+        models = self.router()
+        yield self.populate(models)
+        qs = models.simplemodel.filter(group='planet')
+        bq = qs.backend_query()
+        self.assertTrue(bq.read_only)
+        self.assertEqual(bq.query_key, None)
+        yield self.async.assertEqual(qs.count(), 3)
+        objs = yield qs.all()
+        self.assertEqual(set((o.code for o in objs)),
+                         set(('pluto', 'venus', 'mars')))
+        qs = models.simplemodel.exclude(code=('pluto', 'sun'))
+        objs = yield qs.all()
+        self.assertEqual(set((o.code for o in objs)), set(('venus', 'mars')))
+        qs = models.simplemodel.filter(code='sun').union(
+            models.simplemodel.filter(code='mars'))
+        yield self.async.assertEqual(qs.count(), 2)
+        qs = models.simplemodel.filter(number__ge=2)
+        objs = yield qs.all()
+        self.assertEqual(set((o.code for o in objs)), set(('pluto', 'mars')))
+        yield self.async.assertEqual(self.temp_keys(SimpleModel), [])
+
+    def test_sorting_and_slicing(self):
+        models = self.router()
+        yield self.populate(models)
+        qs = models.simplemodel.query().sort_by('code')
+        codes = yield qs.get_field('code').all()
+        self.assertEqual(set(codes), set(('pluto', 'venus', 'mars', 'sun')))
+        objs = yield qs.all()
+        self.assertEqual([o.code for o in objs],
+                         ['mars', 'pluto', 'sun', 'venus'])
+        qs = models.simplemodel.query().sort_by('code')
+        objs = yield qs[1:3]
+        self.assertEqual([o.code for o in objs], ['pluto', 'sun'])
+        qs = models.simplemodel.filter(group='planet').sort_by('-number')
+        objs = yield qs[-2:]
+        self.assertEqual([o.code for o in objs], ['mars', 'venus'])
+        yield self.async.assertEqual(qs.count(), 3)
+        yield self.async.assertEqual(self.temp_keys(SimpleModel), [])
+
+    def test_related(self):
+        models = self.router()
+        session = models.session()
+        with session.begin() as t:
+            eni = t.add(Instrument(name='eni', ccy='EUR', type='equity'))
+            ibm = t.add(Instrument(name='ibm', ccy='USD', type='equity'))
+            fund = t.add(Fund(name='bla', ccy='EUR'))
+        yield t.on_result
+        with session.begin() as t:
+            t.add(Position(instrument=eni, fund=fund, dt=date.today()))
+            t.add(Position(instrument=ibm, fund=fund, dt=date.today()))
+        yield t.on_result
+        qs = models.position.filter(instrument__ccy='EUR')
+        objs = yield qs.load_related('instrument').all()
+        self.assertEqual(len(objs), 1)
+        self.assertEqual(objs[0].instrument, eni)
+        qs = models.position.exclude(instrument__ccy='EUR')
+        yield self.async.assertEqual(qs.count(), 1)
+        yield self.async.assertEqual(self.temp_keys(Position), [])
+        yield self.async.assertEqual(self.temp_keys(Instrument), [])
+
+    def test_contains(self):
+        models = self.router()
+        yield self.populate(models)
+        sun = yield models.simplemodel.get(code='sun')
+        qs = models.simplemodel.filter(group='planet')
+        self.assertFalse(sun in qs)
+        qs = models.simplemodel.filter(group='star')
+        self.assertTrue(sun in qs)
+
+    def test_delete_after_read(self):
+        models = self.router()
+        yield self.populate(models)
+        qs = models.simplemodel.filter(group='planet')
+        yield self.async.assertEqual(qs.count(), 3)
+        yield qs.delete()
+        qs = models.simplemodel.query()
+        yield self.async.assertEqual(qs.count(), 1)
+
+    def test_where(self):
+        models = self.router()
+        qs = models.simplemodel.query().where('this.number > 1')
+        self.assertRaises(QuerySetError, qs.backend_query)
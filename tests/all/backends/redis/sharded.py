@@ -0,0 +1,169 @@
+from datetime import date
+
+from stdnet import odm, getdb, QuerySetError
+from stdnet.backends.redisb.sharded import HashRing
+from stdnet.utils import test
+
+from examples.models import SimpleModel, Instrument, Fund, Position
+
+
+class TestShardedBackend(test.TestWrite):
+    multipledb = 'redis'
+    models = (SimpleModel, Instrument, Fund, Position)
+    sharded = None
+
+    def router(self):
+        cs = self.backend.connection_string
+        db = int(self.backend.params['db']) + 1
+        self.sharded = getdb('redis+sharded://',
+                             shards=[cs, getdb(cs, db=db)])
+        models = odm.Router(self.sharded)
+        for model in self.models:
+            models.register(model)
+        return models
+
+    def tearDown(self):
+        if self.sharded:
+            return self.sharded.flush()
+
+    def populate(self, models, size=20):
+        with models.session().begin() as t:
+            for n in range(size):
+                t.add(models.simplemodel(code='c%02d' % n,
+                                         group='g%s' % (n % 2), number=n))
+        return t.on_result
+
+    def keys(self, model):
+        return [len(shard.client.keys(shard.basekey(model._meta, 'obj', '*')))
+                for shard in self.sharded.shards]
+
+    def test_connection_string(self):
+        backend = getdb('redis+sharded://127.0.0.1:6379,127.0.0.1:6380?db=3')
+        self.assertEqual(len(backend.shards), 2)
+        self.assertEqual(backend.shards[1].connection_string,
+                         'redis://127.0.0.1:6380?db=3')
+        self.assertEqual(backend.connection_string,
+                         'redis+sharded://127.0.0.1:6379,127.0.0.1:6380?db=3')
+        other = getdb(backend.connection_string)
+        self.assertEqual([str(s) for s in other.shards],
+                         [str(s) for s in backend.shards])
+        self.assertRaises(NotImplementedError, getdb, 'redis+bla://')
+
+    def test_hash_ring(self):
+        ring = HashRing(['a', 'b', 'c'])
+        nodes = [ring.get(str(n)) for n in range(300)]
+        self.assertEqual(set(nodes), set((0, 1, 2)))
+        # adding a node only moves keys to the new node
+        ring = HashRing(['a', 'b', 'c', 'd'])
+        for n, node in enumerate(nodes):
+            self.assertTrue(ring.get(str(n)) in (node, 3))
+
+    def test_commit_and_count(self):
+        models = self.router()
+        yield self.populate(models)
+        counts = yield self.keys(SimpleModel)
+        self.assertEqual(sum(counts), 20)
+        self.assertTrue(min(counts) > 0)
+        objs = yield models.simplemodel.query().all()
+        self.assertEqual(sorted((o.id for o in objs)), list(range(1, 21)))
+        yield self.async.assertEqual(models.simplemodel.query().count(), 20)
+        qs = models.simplemodel.filter(group='g1')
+        yield self.async.assertEqual(qs.count(), 10)
+
+    def test_pk_routing(self):
+        models = self.router()
+        yield self.populate(models)
+        qs = models.simplemodel.filter(id=7)
+        self.assertEqual(len(qs.backend_query().queries), 1)
+        obj = yield models.simplemodel.get(id=7)
+        self.assertEqual(obj.code, 'c06')
+        qs = models.simplemodel.filter(group='g0')
+        self.assertEqual(len(qs.backend_query().queries), 2)
+        self.assertTrue(obj in qs)
+        self.assertFalse(obj in models.simplemodel.filter(group='g1'))
+
+    def test_sorting_and_slicing(self):
+        models = self.router()
+        yield self.populate(models)
+        qs = models.simplemodel.query().sort_by('-number')
+        objs = yield qs[2:6]
+        self.assertEqual([o.number for o in objs], [17, 16, 15, 14])
+        objs = yield models.simplemodel.query()[:5]
+        self.assertEqual([o.id for o in objs], [1, 2, 3, 4, 5])
+        qs = models.simplemodel.filter(group='g1').sort_by('code')
+        objs = yield qs[-3:]
+        self.assertEqual([o.code for o in objs], ['c15', 'c17', 'c19'])
+        qs = models.position.query().sort_by('instrument__ccy')
+        self.assertRaises(QuerySetError, qs.all)
+
+    def test_iterator(self):
+        models = self.router()
+        yield self.populate(models)
+        ids = [o.id for o in models.simplemodel.query().iterator(3)]
+        self.assertEqual(sorted(ids), list(range(1, 21)))
+        qs = models.simplemodel.query().sort_by('number')
+        self.assertEqual([o.number for o in qs.iterator(3)], list(range(20)))
+        qs = models.simplemodel.query().sort_by('-number')
+        bq = qs.backend_query()
+        self.assertEqual(len(bq.queries), 2)
+        # pages of the shards are loaded once only
+        loaded = []
+        for query in bq.queries:
+            load = query._load_items
+
+            def _load_items(slic, load=load):
+                items = list((yield load(slic)))
+                loaded.append(len(items))
+                yield items
+            query._load_items = _load_items
+        numbers = [o.number for o in bq.iterator(3)]
+        self.assertEqual(numbers, list(reversed(range(20))))
+        self.assertTrue(sum(loaded) <= 20 + 2*3)
+
+    def test_delete(self):
+        models = self.router()
+        yield self.populate(models)
+        yield models.simplemodel.filter(group='g0').delete()
+        yield self.async.assertEqual(models.simplemodel.query().count(), 10)
+        counts = yield self.keys(SimpleModel)
+        self.assertEqual(sum(counts), 10)
+
+    def test_delete_batches(self):
+        models = self.router()
+        yield self.populate(models)
+        ids = yield models.simplemodel.filter(group='g1').delete(batch_size=3)
+        self.assertEqual(sorted(ids), list(range(2, 21, 2)))
+        yield self.async.assertEqual(models.simplemodel.query().count(), 10)
+        counts = yield self.keys(SimpleModel)
+        self.assertEqual(sum(counts), 10)
+
+    def test_bulk_insert(self):
+        models = self.router()
+        instances = [models.simplemodel(code='c%s' % n) for n in range(5)]
+        ids = yield models.simplemodel.bulk_insert(instances, batch_size=2,
+                                                  ids=True)
+        self.assertEqual(ids, [1, 2, 3, 4, 5])
+        yield self.async.assertEqual(models.simplemodel.query().count(), 5)
+
+    def test_pinned_models(self):
+        models = self.router()
+        for model in (Instrument, Fund, Position):
+            self.sharded.pin(model, 1)
+        session = models.session()
+        with session.begin() as t:
+            eni = t.add(Instrument(name='eni', ccy='EUR', type='equity'))
+            ibm = t.add(Instrument(name='ibm', ccy='USD', type='equity'))
+            fund = t.add(Fund(name='bla', ccy='EUR'))
+        yield t.on_result
+        with session.begin() as t:
+            t.add(Position(instrument=eni, fund=fund, dt=date.today()))
+            t.add(Position(instrument=ibm, fund=fund, dt=date.today()))
+        yield t.on_result
+        counts = yield self.keys(Position)
+        self.assertEqual(counts, [0, 2])
+        qs = models.position.filter(instrument__ccy='EUR')
+        objs = yield qs.load_related('instrument').all()
+        self.assertEqual(len(objs), 1)
+        self.assertEqual(objs[0].instrument, eni)
+        yield models.instrument.filter(ccy='EUR').delete()
+        yield self.async.assertEqual(models.position.query().count(), 1)
@@ -0,0 +1,61 @@
+'''Queries evaluated with and without MULTI/EXEC'''
+from stdnet.utils import test
+
+from examples.models import SimpleModel
+
+
+class TestQueryTransaction(test.TestWrite):
+    multipledb = 'redis'
+    models = (SimpleModel,)
+
+    def populate(self):
+        with self.mapper.session().begin() as t:
+            for n in range(6):
+                t.add(SimpleModel(code='c%s' % n, group='g%s' % (n % 2)))
+        return t.on_result
+
+    def test_not_atomic(self):
+        yield self.populate()
+        qs = self.query(SimpleModel).filter(group='g1')
+        self.assertFalse(qs._atomic)
+        self.assertFalse(qs.backend_query().pipe.transaction)
+        yield self.async.assertEqual(qs.count(), 3)
+        objs = yield self.query(SimpleModel).exclude(group='g1').all()
+        self.assertEqual(len(objs), 3)
+
+    def test_atomic(self):
+        yield self.populate()
+        qs = self.query(SimpleModel).filter(group='g1').atomic()
+        self.assertTrue(qs._atomic)
+        self.assertTrue(qs.backend_query().pipe.transaction)
+        objs = yield qs.all()
+        self.assertEqual(len(objs), 3)
+        qs = qs.atomic(False)
+        self.assertFalse(qs.backend_query().pipe.transaction)
+        yield self.async.assertEqual(qs.count(), 3)
+
+    def test_gather(self):
+        yield self.populate()
+        q1 = self.query(SimpleModel).filter(group='g1')
+        q2 = self.query(SimpleModel).filter(group='g0').atomic()
+        results = yield self.mapper.gather(q1, q2)
+        self.assertEqual([len(r) for r in results], [3, 3])
+        self.assertTrue(q1.backend_query().pipe.transaction)
+
+    def test_noscript_set_operations(self):
+        yield self.populate()
+        client = self.backend.client
+        query = self.query(SimpleModel)
+        for atomic in (False, True):
+            g0 = query.filter(group='g0')
+            c0 = query.filter(code=('c0', 'c1', 'c2'))
+            yield client.script_flush()
+            qs = g0.intersect(c0).atomic(atomic)
+            objs = yield qs.all()
+            self.assertEqual(set((o.code for o in objs)), set(('c0', 'c2')))
+            yield client.script_flush()
+            qs = g0.union(c0).atomic(atomic)
+            yield self.async.assertEqual(qs.count(), 4)
+            yield client.script_flush()
+            codes = yield g0.get_field('code').atomic(atomic).all()
+            self.assertEqual(sorted(codes), ['c0', 'c2', 'c4'])
@@ -0,0 +1,291 @@
+'''Client side read-through cache of model instances.'''
+import sys
+import json
+import time
+import threading
+from datetime import date
+
+from stdnet import odm, getdb
+from stdnet.utils import test, native_str
+
+from examples.models import Instrument, Fund, Position
+
+
+class TestLocalCache(test.TestCase):
+    multipledb = False
+
+    def test_lru(self):
+        cache = odm.LocalCache(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        cache.delete('a', 'c', 'd')
+        self.assertEqual(len(cache), 0)
+
+    def test_timeout(self):
+        cache = odm.LocalCache()
+        cache.set('a', 1, -1)
+        cache.set('b', 2, 60)
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.get('b'), 2)
+        self.assertEqual(len(cache), 1)
+
+    def test_threads(self):
+        cache = odm.LocalCache()
+        stop = threading.Event()
+
+        def _read():
+            while not stop.is_set():
+                cache.get('a')
+        readers = [threading.Thread(target=_read) for _ in range(2)]
+        if hasattr(sys, 'setswitchinterval'):
+            interval = sys.getswitchinterval()
+            sys.setswitchinterval(1e-6)
+        else:
+            interval = sys.getcheckinterval()
+            sys.setcheckinterval(1)
+        for reader in readers:
+            reader.start()
+        try:
+            for n in range(2000):
+                cache.set('a', n)
+                cache.delete('a')
+                # a concurrent get does not bring the entry back
+                self.assertEqual(cache.get('a'), None)
+        finally:
+            stop.set()
+            for reader in readers:
+                reader.join()
+            if hasattr(sys, 'setswitchinterval'):
+                sys.setswitchinterval(interval)
+            else:
+                sys.setcheckinterval(interval)
+
+
+class TestModelCache(test.TestWrite):
+    multipledb = 'redis'
+    models = (Instrument, Fund, Position)
+
+    def router(self, **params):
+        models = odm.Router(self.backend)
+        models.register(Instrument, cache=True, **params)
+        models.register(Position)
+        return models
+
+    def test_register(self):
+        models = self.router()
+        cache = models.instrument.cache
+        self.assertTrue(isinstance(cache, odm.ModelCache))
+        self.assertEqual(cache.meta, Instrument._meta)
+        self.assertEqual(models.fund.cache, None)
+        cache = odm.ModelCache(timeout=10)
+        models = odm.Router(self.backend)
+        models.register(Position, cache=cache)
+        self.assertEqual(models.position.cache, cache)
+        self.assertEqual(cache.meta, Position._meta)
+        # related models have no cache
+        self.assertEqual(models.instrument.cache, None)
+        self.assertEqual(models.fund.cache, None)
+
+    def test_read_through(self):
+        models = self.router()
+        cache = models.instrument.cache
+        inst = yield models.instrument.new(name='eni', ccy='EUR',
+                                           type='equity')
+        self.assertEqual(cache.misses, 0)
+        inst2 = yield models.instrument.get(id=inst.id)
+        self.assertEqual(cache.misses, 1)
+        self.assertEqual(cache.hits, 0)
+        self.assertEqual(inst2, inst)
+        # now from the cache
+        inst3 = yield models.instrument.get(id=inst.id)
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(inst3, inst)
+        self.assertFalse(inst3 is inst2)
+        self.assertEqual(inst3.name, 'eni')
+        self.assertEqual(inst3.ccy, 'EUR')
+        self.assertEqual(inst3.type, 'equity')
+        self.assertTrue(inst3.get_state().persistent)
+        self.assertTrue(inst3.session)
+        inst4 = yield models.instrument.get(id=inst.id)
+        self.assertEqual(cache.hits, 2)
+        self.assertEqual(inst4.name, 'eni')
+        self.assertEqual(inst4.ccy, 'EUR')
+
+    def test_invalidate_on_commit(self):
+        models = self.router()
+        cache = models.instrument.cache
+        inst = yield models.instrument.new(name='eni', ccy='EUR',
+                                           type='equity')
+        yield models.instrument.get(id=inst.id)
+        inst = yield models.instrument.get(id=inst.id)
+        self.assertEqual(cache.hits, 1)
+        inst.ccy = 'USD'
+        yield models.instrument.save(inst)
+        inst = yield models.instrument.get(id=inst.id)
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(inst.ccy, 'USD')
+        inst = yield models.instrument.get(id=inst.id)
+        self.assertEqual(cache.hits, 2)
+        self.assertEqual(inst.ccy, 'USD')
+
+    def test_invalidate_on_delete(self):
+        models = self.router()
+        cache = models.instrument.cache
+        inst = yield models.instrument.new(name='eni', ccy='EUR',
+                                           type='equity')
+        yield models.instrument.get(id=inst.id)
+        self.assertEqual(len(cache.backend), 1)
+        yield models.instrument.query().filter(ccy='EUR').delete()
+        self.assertEqual(len(cache.backend), 0)
+        query = models.instrument.query()
+        yield self.async.assertRaises(Instrument.DoesNotExist, query.get,
+                                      id=inst.id)
+
+    def test_invalidate_on_batch_delete(self):
+        models = self.router()
+        cache = models.instrument.cache
+        for n in range(3):
+            yield models.instrument.new(name='i%s' % n, ccy='EUR',
+                                        type='equity')
+        objs = yield models.instrument.all()
+        for obj in objs:
+            yield models.instrument.get(id=obj.id)
+        self.assertEqual(len(cache.backend), 3)
+        ids = yield models.instrument.filter(ccy='EUR').delete(batch_size=2)
+        self.assertEqual(len(ids), 3)
+        self.assertEqual(len(cache.backend), 0)
+
+    def test_load_only_not_cached(self):
+        models = self.router()
+        cache = models.instrument.cache
+        inst = yield models.instrument.new(name='eni', ccy='EUR',
+                                           type='equity')
+        qs = models.instrument.query().load_only('name')
+        inst2 = yield qs.get(id=inst.id)
+        self.assertEqual(inst2.name, 'eni')
+        self.assertEqual(len(cache.backend), 0)
+        self.assertEqual(cache.misses, 0)
+
+    def test_restricted_query_bypass(self):
+        models = self.router()
+        cache = models.instrument.cache
+        inst = yield models.instrument.new(name='eni', ccy='EUR',
+                                           type='equity')
+        qs = models.instrument.query().where('false')
+        yield self.async.assertRaises(Instrument.DoesNotExist, qs.get,
+                                      id=inst.id)
+        self.assertEqual(len(cache.backend), 0)
+        # populate the cache
+        yield models.instrument.get(id=inst.id)
+        self.assertEqual(len(cache.backend), 1)
+        self.assertEqual(cache.misses, 1)
+        yield self.async.assertRaises(Instrument.DoesNotExist, qs.get,
+                                      id=inst.id)
+        inst2 = yield models.instrument.query().dont_load('ccy').get(
+            id=inst.id)
+        self.assertEqual(inst2.name, 'eni')
+        self.assertEqual(cache.hits, 0)
+        self.assertEqual(cache.misses, 1)
+
+    def test_foreign_key(self):
+        models = self.router()
+        cache = models.instrument.cache
+        inst = yield models.instrument.new(name='eni', ccy='EUR',
+                                           type='equity')
+        fund = yield models.fund.new(name='bla', ccy='EUR')
+        yield models.position.new(instrument=inst, fund=fund, dt=date.today())
+        pos = yield models.position.get(fund=fund)
+        instrument = yield pos.load_related_model('instrument')
+        self.assertEqual(instrument, inst)
+        self.assertEqual(cache.misses, 1)
+        pos = yield models.position.get(fund=fund)
+        instrument = yield pos.load_related_model('instrument')
+        self.assertEqual(instrument, inst)
+        self.assertEqual(cache.hits, 1)
+
+
+class TestCacheInvalidation(test.TestWrite):
+    multipledb = 'redis'
+    models = (Instrument,)
+
+    def publisher(self):
+        backend = getdb(self.backend.connection_string, invalidation=1)
+        self.assertTrue(backend.invalidation)
+        self.assertTrue('invalidation=1' in backend.connection_string)
+        models = odm.Router(backend)
+        models.register(Instrument)
+        return models
+
+    def wait(self, cache, size):
+        for _ in range(50):
+            if len(cache.backend) == size:
+                break
+            time.sleep(0.05)
+        self.assertEqual(len(cache.backend), size)
+
+    def test_messages(self):
+        publisher = self.publisher()
+        backend = publisher.instrument.backend
+        backend.invalidation_batch_size = 2
+        pubsub = backend.subscribe_invalidations()
+        # consume the subscribe message
+        pubsub.get_message(timeout=1)
+        with publisher.session().begin() as t:
+            for n in range(5):
+                t.add(Instrument(name='i%s' % n, ccy='EUR', type='equity'))
+        yield t.on_result
+        messages = []
+        for _ in range(3):
+            message = pubsub.get_message(timeout=1)
+            self.assertTrue(message)
+            messages.append(message)
+        pubsub.close()
+        ids = []
+        for message in messages:
+            data = native_str(message['data'])
+            modelkey, pks = json.loads(data)
+            self.assertEqual(modelkey, Instrument._meta.modelkey)
+            ids.extend(pks)
+        self.assertEqual(len(ids), 5)
+        query = publisher.instrument.query()
+        all = yield query.all()
+        self.assertEqual(sorted((str(o.id) for o in all)),
+                         sorted((str(id) for id in ids)))
+
+    def test_evict(self):
+        publisher = self.publisher()
+        inst = yield publisher.instrument.new(name='eni', ccy='EUR',
+                                              type='equity')
+        models = odm.Router(self.backend)
+        models.register(Instrument, cache=True)
+        cache = models.instrument.cache
+        invalidator = odm.CacheInvalidator(models, timeout=0.05)
+        invalidator.start()
+        try:
+            yield models.instrument.get(id=inst.id)
+            self.assertEqual(len(cache.backend), 1)
+            inst.ccy = 'USD'
+            yield publisher.instrument.save(inst)
+            self.wait(cache, 0)
+            inst2 = yield models.instrument.get(id=inst.id)
+            self.assertEqual(inst2.ccy, 'USD')
+            self.assertEqual(len(cache.backend), 1)
+            yield publisher.instrument.query().delete()
+            self.wait(cache, 0)
+            # batched deletes publish invalidation messages too
+            inst = yield publisher.instrument.new(name='ibm', ccy='USD',
+                                                  type='equity')
+            yield models.instrument.get(id=inst.id)
+            self.assertEqual(len(cache.backend), 1)
+            yield publisher.instrument.filter(ccy='USD').delete(batch_size=2)
+            self.wait(cache, 0)
+        finally:
+            invalidator.stop()
+            invalidator.join()
+        self.assertFalse(invalidator.is_alive())
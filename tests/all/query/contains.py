@@ -1,7 +1,8 @@
+from stdnet import odm, FieldError
 from stdnet.utils import test
 from stdnet.utils.py2py3 import zip
 
-from examples.models import SimpleModel
+from examples.models import SimpleModel, PrefixData
 from examples.wordsearch.basicwords import basic_english_words
 
 class TextGenerator(test.DataGenerator):
@@ -58,4 +59,70 @@ class TestFieldSerach(test.TestCase):
         self.assertTrue(all)
         for m in all:
             self.assertTrue(m.description.startswith(start))
-        self.assertEqual(len(all), count[start])
\ No newline at end of file
+        self.assertEqual(len(all), count[start])
+
+
+class TestLexIndex(test.TestCase):
+    multipledb = 'redis'
+    model = PrefixData
+    data_cls = TextGenerator
+
+    @classmethod
+    def after_setup(cls):
+        with cls.session().begin() as t:
+            for code, des in zip(cls.data.names, cls.data.descriptions):
+                t.add(cls.model(code=code, name=des.split(' ')[0]))
+        yield t.on_result
+
+    def test_meta(self):
+        meta = self.model._meta
+        self.assertTrue(meta.dfields['code'].lex_index)
+        self.assertTrue(meta.dfields['name'].lex_index)
+        self.assertFalse(meta.dfields['group'].lex_index)
+        self.assertEqual(meta.as_dict()['lex_indices'],
+                         {'code': True, 'name': True})
+        self.assertRaises(FieldError, odm.IntegerField, index='lex')
+        self.assertRaises(FieldError, odm.ModelField, index='lex')
+        self.assertFalse(odm.PickleObjectField.lexsortable)
+        self.assertFalse(odm.JSONField.lexsortable)
+
+    def test_startswith(self):
+        start = self.data.names[0][:2]
+        qs = self.query().filter(code__startswith=start)
+        all = yield qs.all()
+        self.assertTrue(all)
+        for m in all:
+            self.assertTrue(m.code.startswith(start))
+        expected = [n for n in self.data.names if n.startswith(start)]
+        self.assertEqual(len(all), len(expected))
+
+    def test_istartswith(self):
+        start = self.data.names[0][:2]
+        qs = self.query().filter(code__istartswith=start.upper())
+        all = yield qs.all()
+        self.assertTrue(all)
+        for m in all:
+            self.assertTrue(m.code.lower().startswith(start.lower()))
+        expected = [n for n in self.data.names
+                    if n.lower().startswith(start.lower())]
+        self.assertEqual(len(all), len(expected))
+
+    def test_with_equality(self):
+        name = self.data.descriptions[0].split(' ')[0]
+        qs = self.query().filter(name=name, name__startswith=name[:1])
+        all = yield qs.all()
+        self.assertTrue(all)
+        for m in all:
+            self.assertEqual(m.name, name)
+
+    def test_update(self):
+        models = self.mapper
+        instance = yield models.prefixdata.new(code='xyzprefix', name='foo')
+        qs = yield self.query().filter(code__startswith='xyzp').all()
+        self.assertEqual(qs, [instance])
+        instance.code = 'zyxprefix'
+        yield models.prefixdata.save(instance)
+        qs = yield self.query().filter(code__startswith='xyzp').all()
+        self.assertFalse(qs)
+        qs = yield self.query().filter(code__startswith='zyxp').all()
+        self.assertEqual(qs, [instance])
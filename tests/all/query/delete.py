@@ -1,11 +1,13 @@
 '''Delete objects and queries'''
 import datetime
+import time
 from random import randint
 
 from stdnet import odm
 from stdnet.utils import test, zip
 
-from examples.models import Instrument, Fund, Position, Dictionary, SimpleModel
+from examples.models import (Instrument, Fund, Position, Dictionary, SimpleModel,
+                            SportAtDate)
 from examples.data import finance_data, FinanceTest
 
 
@@ -248,3 +250,97 @@ class TestDeleteStructuredFields(test.TestWrite):
         if backend.name == 'redis':
             keys = yield session.keys(Dictionary)
             self.assertEqual(keys, [])
+
+    def test_delete_batches(self):
+        yield self.fill('test')
+        yield self.fill('test2')
+        session = self.session()
+        ids = yield session.query(Dictionary).delete(batch_size=1)
+        self.assertEqual(len(ids), 2)
+        yield self.async.assertEqual(session.query(Dictionary).count(), 0)
+        backend = self.mapper.dictionary.backend
+        if backend.name == 'redis':
+            # only the auto id and the temporary query keys are left
+            tmp = backend.basekey(Dictionary._meta, 'tmp')
+            keys = yield session.keys(Dictionary)
+            keys = [k for k in keys if not k.startswith(tmp)]
+            self.assertEqual(keys, [backend.basekey(Dictionary._meta, 'ids')])
+
+
+class TestDeleteBatches(test.TestWrite):
+    '''Delete queries in batches with :meth:`Query.delete`.'''
+    data_cls = finance_data
+    models = (Instrument, Fund, Position)
+
+    def test_delete_related(self):
+        session = yield self.data.makePositions(self)
+        N = yield session.query(Instrument).count()
+        P = yield session.query(Position).count()
+        self.assertTrue(P)
+        progress = []
+        ids = yield session.query(Instrument).delete(
+            batch_size=3, progress=lambda *args: progress.append(args))
+        self.assertEqual(len(ids), N)
+        self.assertEqual(len(set(ids)), N)
+        yield self.async.assertEqual(session.query(Instrument).all(), [])
+        yield self.async.assertEqual(session.query(Position).all(), [])
+        yield self.async.assertEqual(session.query(Fund).count(),
+                                     len(self.data.fund_names))
+        # positions are deleted before the instruments
+        self.assertEqual(progress[0][0], Position._meta)
+        self.assertEqual(progress[-1], (Instrument._meta, N, 0))
+        batches = [p for p in progress if p[0] == Instrument._meta]
+        self.assertEqual(len(batches), (N + 2) // 3)
+        self.assertEqual(progress[len(progress) - len(batches) - 1],
+                         (Position._meta, P, 0))
+
+    def test_delete_filter(self):
+        session = yield self.data.create(self)
+        query = session.query(Instrument).filter(ccy='EUR')
+        N = yield query.count()
+        ids = yield query.delete(batch_size=2)
+        self.assertEqual(len(ids), N)
+        yield self.async.assertEqual(query.filter(id=ids).count(), 0)
+        yield self.async.assertEqual(session.query(Instrument).count(),
+                                     len(self.data.inst_names) - N)
+        empty = session.query(Instrument).filter(id=[])
+        self.assertEqual(empty.delete(batch_size=2), [])
+        version = yield session.model(Instrument).backend.server_version()
+        self.assertTrue(version >= (3, 2))
+
+    def test_delete_slow(self):
+        session = yield self.data.create(self)
+        backend = session.model(Instrument).backend
+        pattern = backend.basekey(Instrument._meta, 'tmp', '*')
+        query = session.query(Instrument).exclude(ccy='XYZ')
+        N = yield query.count()
+        self.assertTrue(N > 3)
+        batches = []
+
+        def progress(meta, deleted, left):
+            if not batches:
+                # the query key is about to expire
+                for key in backend.client.keys(pattern):
+                    backend.client.pexpire(key, 300)
+            batches.append(deleted)
+            time.sleep(0.1)
+        ids = yield query.delete(batch_size=N // 8, progress=progress)
+        self.assertTrue(len(batches) > 3)
+        self.assertEqual(len(ids), N)
+        yield self.async.assertEqual(session.query(Instrument).count(), 0)
+        self.assertEqual(backend.client.keys(pattern), [])
+
+
+class TestDeleteBatchesSorted(test.TestWrite):
+    model = SportAtDate
+
+    def test_delete(self):
+        models = self.mapper
+        with models.session().begin() as t:
+            for n in range(7):
+                t.add(SportAtDate(person='p%s' % n, name='run',
+                                  dt=datetime.date(2013, 1, n+1)))
+        yield t.on_result
+        ids = yield models.sportatdate.filter(name='run').delete(batch_size=3)
+        self.assertEqual(len(ids), 7)
+        yield self.async.assertEqual(models.sportatdate.query().count(), 0)
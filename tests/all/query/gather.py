@@ -0,0 +1,92 @@
+'''Load several queries in a batch'''
+from stdnet import odm, getdb
+from stdnet.utils import test
+
+from examples.models import SimpleModel, Instrument
+
+
+def populate(models):
+    with models.session().begin() as t:
+        for n in range(10):
+            t.add(models.simplemodel(code='c%s' % n, group='g%s' % (n % 2),
+                                     number=n))
+        t.add(models.instrument(name='eni', ccy='EUR', type='equity'))
+        t.add(models.instrument(name='ibm', ccy='USD', type='equity'))
+        t.add(models.instrument(name='bnd', ccy='EUR', type='bond'))
+    return t.on_result
+
+
+class TestGather(test.TestWrite):
+    models = (SimpleModel, Instrument)
+
+    def test_gather(self):
+        models = self.mapper
+        yield populate(models)
+        session = models.session()
+        q1 = session.query(SimpleModel).filter(group='g1').sort_by('-number')
+        q2 = session.query(Instrument).filter(ccy='EUR')
+        q3 = session.query(SimpleModel).filter(code='c3')
+        q4 = session.query(Instrument).filter(ccy='JPY')
+        results = yield session.gather(q1, q2, q3, q4)
+        self.assertEqual(len(results), 4)
+        self.assertEqual([o.number for o in results[0]], [9, 7, 5, 3, 1])
+        self.assertEqual(set((o.name for o in results[1])),
+                         set(('eni', 'bnd')))
+        self.assertEqual([o.code for o in results[2]], ['c3'])
+        self.assertEqual(results[3], [])
+        for q, items in zip((q1, q2, q3, q4), results):
+            self.assertTrue(q.backend_query().executed)
+            yield self.async.assertEqual(q.count(), len(items))
+            yield self.async.assertEqual(q.all(), items)
+        m = results[2][0]
+        self.assertTrue(session.model(SimpleModel).get(m.id) is m)
+
+    def test_mixed_queries(self):
+        models = self.mapper
+        yield populate(models)
+        session = models.session()
+        q1 = session.query(SimpleModel).filter(group='g0')
+        # already built in its own pipeline
+        q1.backend_query()
+        q2 = session.query(SimpleModel).filter(group='g1').get_field('code')
+        q3 = session.empty(Instrument)
+        q4 = session.query(Instrument).exclude(ccy='EUR')
+        results = yield models.gather(q1, q2, q3, q4)
+        self.assertEqual(len(results[0]), 5)
+        self.assertEqual(set(results[1]),
+                         set(('c1', 'c3', 'c5', 'c7', 'c9')))
+        self.assertEqual(results[2], [])
+        self.assertEqual([o.name for o in results[3]], ['ibm'])
+        self.assertEqual(session.gather(), [])
+
+
+class TestGatherRedis(test.TestWrite):
+    multipledb = 'redis'
+    models = (SimpleModel, Instrument)
+
+    def router(self, **params):
+        backend = getdb(self.backend.connection_string, **params)
+        models = odm.Router(backend)
+        for model in self.models:
+            models.register(model)
+        return models
+
+    def test_read_only(self):
+        yield populate(self.mapper)
+        models = self.router(read_only=1)
+        q1 = models.simplemodel.filter(group='g1')
+        q2 = models.instrument.filter(type='equity').sort_by('name')
+        self.assertTrue(q1.backend_query().read_only)
+        results = yield models.gather(q1, q2)
+        self.assertEqual(len(results[0]), 5)
+        self.assertEqual([o.name for o in results[1]], ['eni', 'ibm'])
+        yield self.async.assertEqual(q1.count(), 5)
+
+    def test_cluster(self):
+        models = self.router(cluster=1)
+        yield populate(models)
+        q1 = models.simplemodel.filter(group='g0')
+        q2 = models.instrument.filter(ccy='USD')
+        results = yield models.gather(q1, q2)
+        self.assertEqual(len(results[0]), 5)
+        self.assertEqual([o.name for o in results[1]], ['ibm'])
@@ -0,0 +1,102 @@
+'''Iterate over large queries in chunks.'''
+from stdnet.utils import test
+
+from examples.models import SportAtDate
+from examples.data import FinanceTest
+
+from .sorting import SortGenerator
+
+
+class TestIterator(FinanceTest):
+    multipledb = 'redis'
+
+    @classmethod
+    def after_setup(cls):
+        yield cls.data.create(cls)
+
+    def test_unsorted(self):
+        qs = self.query()
+        all = yield qs.all()
+        ids = [o.id for o in qs.iterator(chunk_size=7)]
+        self.assertEqual(len(ids), len(all))
+        self.assertEqual(set(ids), set((o.id for o in all)))
+
+    def test_scan_duplicates(self):
+        qs = self.query()
+        all = yield qs.all()
+        bq = qs.backend_query()
+        load = bq._items
+        pages = []
+
+        def _items(slic, scan=None, **kwargs):
+            # small sets are returned by SSCAN in one call. The first page
+            # is half of the set, the second page the whole set again
+            cursor, items = load(slic, scan=(0, scan[1]), **kwargs)
+            self.assertEqual(cursor, 0)
+            items = list(items)
+            pages.append(items)
+            if len(pages) == 1:
+                return 1, items[:len(items)//2]
+            return 0, items
+        bq._items = _items
+        ids = [o.id for o in bq.iterator(7)]
+        self.assertEqual(len(pages), 2)
+        self.assertEqual(len(ids), len(all))
+        self.assertEqual(set(ids), set((o.id for o in all)))
+
+    def test_filter(self):
+        qs = self.query().filter(ccy='EUR')
+        all = yield qs.all()
+        self.assertTrue(all)
+        ids = [o.id for o in qs.iterator(chunk_size=3)]
+        self.assertEqual(sorted(ids), sorted((o.id for o in all)))
+
+    def test_no_cache(self):
+        qs = self.query().filter(ccy='EUR')
+        bq = qs.backend_query()
+        items = list(bq.iterator(5))
+        self.assertTrue(items)
+        self.assertFalse(bq.cache)
+        for item in items:
+            self.assertFalse(item in qs.session)
+
+    def test_sort_by(self):
+        qs = self.query().sort_by('-id')
+        all = yield qs.all()
+        items = list(qs.iterator(chunk_size=4))
+        self.assertEqual(items, all)
+
+    def test_empty(self):
+        qs = self.query().filter(ccy='XXX')
+        self.assertEqual(list(qs.iterator()), [])
+        self.assertEqual(list(self.session().empty(self.model).iterator()),
+                         [])
+
+
+class TestSortedIterator(test.TestCase):
+    multipledb = 'redis'
+    model = SportAtDate
+    data_cls = SortGenerator
+
+    @classmethod
+    def after_setup(cls):
+        d = cls.data
+        with cls.session().begin() as t:
+            for p, n, dt in zip(d.persons, d.groups, d.dates):
+                t.add(cls.model(person=p, name=n, dt=dt))
+        yield t.on_result
+
+    def test_ordering(self):
+        qs = self.query()
+        all = yield qs.all()
+        self.assertEqual(len(all), len(self.data.dates))
+        items = list(qs.iterator(chunk_size=6))
+        self.assertEqual(items, all)
+
+    def test_slice(self):
+        qs = self.query()
+        all = yield qs.all()
+        items = yield self.query()[2:5]
+        self.assertEqual(items, all[2:5])
+        items = yield self.query()[-3:-1]
+        self.assertEqual(items, all[-3:-1])
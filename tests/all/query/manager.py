@@ -103,3 +103,38 @@ class TestManager(test.TestCase):
         self.assertTrue(all)
         for o in all:
             self.assertEqual(models.simplemodel.pkvalue(o), o.pkvalue())
+
+
+class TestBulkInsert(test.TestWrite):
+    multipledb = 'redis'
+    model = SimpleModel
+
+    def test_bulk_insert(self):
+        objects = self.mapper.simplemodel
+        rows = ({'code': 'bulk%s' % n, 'group': 'g%s' % (n % 3)}
+                for n in range(25))
+        n = yield objects.bulk_insert(rows, batch_size=10)
+        self.assertEqual(n, 25)
+        yield self.async.assertEqual(objects.query().count(), 25)
+        yield self.async.assertEqual(objects.filter(group='g0').count(), 9)
+        obj = yield objects.get(code='bulk7')
+        self.assertEqual(obj.group, 'g1')
+
+    def test_bulk_insert_instances(self):
+        objects = self.mapper.simplemodel
+        instances = [objects(code='inst%s' % n) for n in range(5)]
+        ids = yield objects.bulk_insert(instances, batch_size=2, ids=True)
+        self.assertEqual(len(ids), 5)
+        all = yield objects.filter(code__in=['inst%s' % n for n in range(5)]
+                                   ).sort_by('code').all()
+        self.assertEqual([o.id for o in all], ids)
+        for instance in instances:
+            self.assertEqual(instance.session, None)
+
+    def test_bulk_insert_unique_error(self):
+        objects = self.mapper.simplemodel
+        yield objects.bulk_insert([{'code': 'a'}, {'code': 'b'}])
+        rows = [{'code': 'c'}, {'code': 'a'}]
+        yield self.async.assertRaises(stdnet.CommitException,
+                                      objects.bulk_insert, rows)
+        yield self.async.assertEqual(objects.query().count(), 3)
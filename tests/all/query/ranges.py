@@ -1,7 +1,11 @@
+from datetime import date
+
 from stdnet.utils import test
+from stdnet import odm, FieldError
 from stdnet.utils.py2py3 import zip
 
-from examples.models import NumericData, CrossData, Feed1
+from examples.models import (NumericData, CrossData, Feed1, SortedNumericData,
+                             SortedOptionalData)
 
 
 class NumberGenerator(test.DataGenerator):
@@ -173,4 +177,124 @@ class TestNumericRangeForeignKey(test.TestCase):
         qs = yield self.query(Feed1).filter(live__data__a__gt=-1).load_related('live').all()
         self.assertTrue(qs)
         for feed in qs:
-            self.assertTrue(feed.live.data__a >= -1)
\ No newline at end of file
+            self.assertTrue(feed.live.data__a >= -1)
+
+
+class TestSortedIndexRange(test.TestCase):
+    multipledb = 'redis'
+    data_cls = NumberGenerator
+    model = SortedNumericData
+
+    @classmethod
+    def after_setup(cls):
+        d = cls.data
+        with cls.session().begin() as t:
+            for a, b, c in zip(d.d1, d.d2, d.d5):
+                t.add(cls.model(pv=a, vega=b, delta=c))
+        yield t.on_result
+
+    def test_meta(self):
+        meta = self.model._meta
+        self.assertTrue(meta.dfields['pv'].sorted_index)
+        self.assertTrue(meta.dfields['delta'].sorted_index)
+        self.assertFalse(meta.dfields['vega'].sorted_index)
+        self.assertEqual(meta.as_dict()['sorted_indices'],
+                         {'pv': True, 'delta': True})
+
+    def test_not_sortable(self):
+        self.assertRaises(FieldError, odm.SymbolField, index='sorted')
+
+    def test_equal(self):
+        session = self.session()
+        qs = yield session.query(self.model).filter(delta=2).all()
+        self.assertTrue(qs)
+        for v in qs:
+            self.assertEqual(v.delta, 2)
+        n = yield session.query(self.model).filter(delta=(1, 2)).count()
+        self.assertEqual(n, len([v for v in self.data.d5 if v in (1, 2)]))
+
+    def test_gt_lt(self):
+        session = self.session()
+        qs = yield session.query(self.model).filter(pv__gt=-2, pv__le=3).all()
+        self.assertTrue(qs)
+        for v in qs:
+            self.assertTrue(v.pv > -2 and v.pv <= 3)
+        n = len([v for v in self.data.d1 if v > -2 and v <= 3])
+        self.assertEqual(len(qs), n)
+
+    def test_with_other_lookups(self):
+        session = self.session()
+        qs = session.query(self.model).filter(delta=(-1, 0, 1), pv__ge=0)
+        qs = yield qs.all()
+        for v in qs:
+            self.assertTrue(v.delta in (-1, 0, 1))
+            self.assertTrue(v.pv >= 0)
+
+    def test_update(self):
+        session = self.session()
+        models = self.mapper
+        instance = yield models.sortednumericdata.new(pv=100, delta=100)
+        qs = yield session.query(self.model).filter(delta__ge=100).all()
+        self.assertEqual(qs, [instance])
+        instance.delta = -100
+        yield models.sortednumericdata.save(instance)
+        qs = yield session.query(self.model).filter(delta__ge=100).all()
+        self.assertFalse(qs)
+        qs = yield session.query(self.model).filter(delta__lt=-99).all()
+        self.assertEqual(qs, [instance])
+        with session.begin() as t:
+            t.delete(instance)
+        yield t.on_result
+        qs = yield session.query(self.model).filter(delta__lt=-99).all()
+        self.assertFalse(qs)
+
+
+class TestSortedIndexNull(test.TestCase):
+    multipledb = 'redis'
+    model = SortedOptionalData
+
+    @classmethod
+    def after_setup(cls):
+        with cls.session().begin() as t:
+            t.add(cls.model(number=3, dt=date(2014, 1, 1)))
+            t.add(cls.model(number=3))
+            t.add(cls.model(dt=date(2014, 1, 1)))
+            t.add(cls.model())
+        yield t.on_result
+
+    def test_equal_null(self):
+        query = self.query()
+        qs = yield query.filter(number=None).all()
+        self.assertEqual(len(qs), 2)
+        for v in qs:
+            self.assertEqual(v.number, None)
+        qs = yield query.filter(dt=None).all()
+        self.assertEqual(len(qs), 2)
+        for v in qs:
+            self.assertEqual(v.dt, None)
+        qs = yield query.filter(number=None, dt=None).all()
+        self.assertEqual(len(qs), 1)
+        n = yield query.filter(number=(3, None)).count()
+        self.assertEqual(n, 4)
+        qs = yield query.filter(number=3).all()
+        self.assertEqual(len(qs), 2)
+        n = yield query.filter(number__ge=0).count()
+        self.assertEqual(n, 2)
+
+    def test_update_null(self):
+        models = self.mapper
+        query = self.query()
+        instance = yield models.sortedoptionaldata.new()
+        yield self.async.assertEqual(query.filter(number=None).count(), 3)
+        instance.number = 5
+        yield models.sortedoptionaldata.save(instance)
+        yield self.async.assertEqual(query.filter(number=None).count(), 2)
+        yield self.async.assertEqual(query.filter(number=5).all(), [instance])
+        instance.number = None
+        yield models.sortedoptionaldata.save(instance)
+        yield self.async.assertEqual(query.filter(number=None).count(), 3)
+        yield self.async.assertEqual(query.filter(number=5).count(), 0)
+        with models.session().begin() as t:
+            t.delete(instance)
+        yield t.on_result
+        yield self.async.assertEqual(query.filter(number=None).count(), 2)
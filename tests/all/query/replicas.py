@@ -0,0 +1,105 @@
+'''Load balanced read replicas.'''
+import time
+from datetime import date
+
+from stdnet import odm, getdb
+from stdnet.utils import test
+
+from examples.models import SimpleModel, Instrument, Fund, Position
+
+
+class TestReadReplicas(test.TestWrite):
+    multipledb = 'redis'
+    models = (SimpleModel, Instrument, Fund, Position)
+
+    def replicas(self, n=2, **params):
+        cs = self.backend.connection_string
+        return odm.ReadReplicas([getdb(cs) for _ in range(n)], **params)
+
+    def test_register(self):
+        cs = self.backend.connection_string
+        models = odm.Router(self.backend)
+        models.register(SimpleModel, read_backend=[cs, cs])
+        replicas = models.simplemodel.read_replicas
+        self.assertTrue(isinstance(replicas, odm.ReadReplicas))
+        self.assertEqual(replicas.policy, 'round_robin')
+        self.assertEqual(replicas.primary, self.backend)
+        self.assertEqual(len(replicas.backends), 2)
+        self.assertTrue(models.simplemodel.read_backend in replicas.backends)
+        self.assertRaises(ValueError, odm.ReadReplicas, [cs], policy='bla')
+        self.assertRaises(ValueError, odm.ReadReplicas, [])
+
+    def test_round_robin(self):
+        replicas = self.replicas(3)
+        selected = [replicas.get() for _ in range(6)]
+        self.assertEqual(selected[:3], selected[3:])
+        self.assertEqual(len(set(selected[:3])), 3)
+
+    def test_least_outstanding(self):
+        # backends with the same address and db share the connection pool
+        cs = self.backend.connection_string
+        db = int(self.backend.params['db']) + 1
+        replicas = odm.ReadReplicas([getdb(cs), getdb(cs, db=db)],
+                                    policy='least_outstanding')
+        busy, idle = replicas.backends
+        pool = busy.client.connection_pool
+        connection = pool.get_connection('PING')
+        try:
+            self.assertEqual(busy.outstanding(), 1)
+            self.assertEqual(replicas.get(), idle)
+        finally:
+            pool.release(connection)
+        self.assertEqual(busy.outstanding(), 0)
+
+    def test_latency(self):
+        replicas = self.replicas(policy='latency')
+        replicas.check()
+        self.assertEqual(len(replicas.latency), 2)
+        self.assertTrue(replicas.get() in replicas.backends)
+
+    def test_health_check(self):
+        down = getdb('redis://127.0.0.1:1')
+        replicas = odm.ReadReplicas([down, self.backend], check_interval=60)
+        self.assertEqual(replicas.get(), self.backend)
+        self.assertEqual(replicas.healthy, [self.backend])
+        self.assertEqual(replicas.get(), self.backend)
+        # next checks are performed in the background
+        replicas.healthy = list(replicas.backends)
+        replicas._last_check = 1
+        self.assertTrue(replicas.get() in replicas.backends)
+        for _ in range(100):
+            if replicas._last_check > 1:
+                break
+            time.sleep(0.05)
+        self.assertEqual(replicas._checker, None)
+        self.assertEqual(replicas.healthy, [self.backend])
+        # fallback to the primary
+        replicas = odm.ReadReplicas([down], primary=self.backend)
+        self.assertEqual(replicas.get(), self.backend)
+        self.assertEqual(replicas.healthy, [])
+
+    def test_session(self):
+        replicas = self.replicas()
+        models = odm.Router(self.backend)
+        models.register(Position, read_backend=replicas)
+        self.assertEqual(models.instrument.read_replicas, replicas)
+        session = models.session()
+        backend = session.model(Position).read_backend
+        self.assertTrue(backend in replicas.backends)
+        self.assertEqual(session.model(Instrument).read_backend, backend)
+        self.assertEqual(session.model(Position).backend, self.backend)
+        with session.begin() as t:
+            eni = t.add(Instrument(name='eni', ccy='EUR', type='equity'))
+            ibm = t.add(Instrument(name='ibm', ccy='USD', type='equity'))
+            fund = t.add(Fund(name='bla', ccy='EUR'))
+        yield t.on_result
+        with session.begin() as t:
+            t.add(Position(instrument=eni, fund=fund, dt=date.today()))
+            t.add(Position(instrument=ibm, fund=fund, dt=date.today()))
+        yield t.on_result
+        for _ in range(2):
+            qs = models.position.filter(instrument__ccy='EUR')
+            self.assertTrue(qs.backend in replicas.backends)
+            objs = yield qs.all()
+            self.assertEqual(len(objs), 1)
+            self.assertEqual(objs[0].instrument_id, eni.id)
@@ -1,8 +1,10 @@
 '''Sessions and transactions management'''
+import threading
+from datetime import date
 from stdnet import odm, getdb
 from stdnet.utils import test, gen_unique_id
 
-from examples.models import SimpleModel, Instrument
+from examples.models import SimpleModel, Instrument, Fund, Position
 
 
 class TestSession(test.TestWrite):
@@ -90,3 +92,147 @@ class TestSession(test.TestWrite):
         # now filter on old group
         qs = session.query(self.model).filter(group='planet')
         yield self.async.assertEqual(qs.count(), 0)
+
+
+class TestIdentityMap(test.TestWrite):
+    models = (SimpleModel, Instrument, Fund, Position)
+
+    def test_get_from_session(self):
+        session = self.session()
+        with session.begin() as t:
+            m = t.add(SimpleModel(code='pluto', group='planet'))
+        yield t.on_result
+        self.assertTrue(session.model(SimpleModel).get(m.id) is m)
+        m2 = yield session.query(SimpleModel).get(id=m.id)
+        self.assertTrue(m2 is m)
+        # a filtered query still goes to the server
+        qs = session.query(SimpleModel).filter(group='star')
+        yield self.async.assertRaises(SimpleModel.DoesNotExist, qs.get,
+                                      id=m.id)
+        # a different session does not share instances
+        m3 = yield self.query().get(id=m.id)
+        self.assertEqual(m3, m)
+        self.assertFalse(m3 is m)
+
+    def test_loaded_instances(self):
+        session = self.session()
+        with session.begin() as t:
+            t.add(SimpleModel(code='pluto', group='planet'))
+        yield t.on_result
+        all = yield session.query(SimpleModel).all()
+        m = all[0]
+        m2 = yield session.query(SimpleModel).get(id=m.id)
+        self.assertTrue(m2 is m)
+        # partially loaded instances are not in the identity map
+        qs = session.query(SimpleModel).load_only('code')
+        m3 = yield qs.filter(id=m.id).all()
+        self.assertFalse(session.model(SimpleModel).get(m.id) is m3[0])
+
+    def test_restricted_get(self):
+        session = self.session()
+        with session.begin() as t:
+            m = t.add(SimpleModel(code='pluto', group='planet'))
+        yield t.on_result
+        qs = session.query(SimpleModel)
+        # a where clause is evaluated by the server
+        yield self.async.assertRaises(SimpleModel.DoesNotExist,
+                                      qs.where('false').get, id=m.id)
+        # a subset of fields is loaded from the server
+        m2 = yield qs.load_only('code').get(id=m.id)
+        self.assertFalse(m2 is m)
+        self.assertEqual(m2.code, 'pluto')
+        m3 = yield qs.dont_load('group').get(id=m.id)
+        self.assertFalse(m3 is m)
+        self.assertTrue(session.model(SimpleModel).get(m.id) is m)
+
+    def test_deleted(self):
+        session = self.session()
+        with session.begin() as t:
+            m = t.add(SimpleModel(code='pluto', group='planet'))
+        yield t.on_result
+        id = m.id
+        with session.begin() as t:
+            t.delete(m)
+        yield t.on_result
+        self.assertEqual(session.model(SimpleModel).get(id), None)
+        qs = session.query(SimpleModel)
+        yield self.async.assertRaises(SimpleModel.DoesNotExist, qs.get,
+                                      id=id)
+
+    def test_expunge(self):
+        session = self.session()
+        with session.begin() as t:
+            m = t.add(SimpleModel(code='pluto', group='planet'))
+        yield t.on_result
+        session.expunge()
+        self.assertEqual(session.model(SimpleModel).get(m.id), None)
+
+    def test_related(self):
+        session = self.session()
+        with session.begin() as t:
+            inst = t.add(Instrument(name='eni', ccy='EUR', type='equity'))
+            fund = t.add(Fund(name='bla', ccy='EUR'))
+        yield t.on_result
+        with session.begin() as t:
+            t.add(Position(instrument=inst, fund=fund, dt=date.today()))
+        yield t.on_result
+        pos = yield session.query(Position).get(fund=fund)
+        field = Position._meta.dfields['instrument']
+        self.assertFalse(hasattr(pos, field.get_cache_name()))
+        instrument = yield pos.load_related_model('instrument')
+        self.assertTrue(instrument is inst)
+
+
+class TestMultipleBackends(test.TestWrite):
+    multipledb = 'redis'
+    models = (SimpleModel, Instrument)
+    other = None
+
+    def router(self):
+        cs = self.backend.connection_string
+        self.other = getdb(cs, db=int(self.backend.params['db']) + 1)
+        models = odm.Router(self.backend)
+        models.register(SimpleModel)
+        models.register(Instrument, backend=self.other)
+        return models
+
+    def tearDown(self):
+        if self.other:
+            return self.other.flush()
+
+    def record(self, backend, threads):
+        execute_session = backend.execute_session
+
+        def _(data):
+            threads.append(threading.current_thread())
+            return execute_session(data)
+        backend.execute_session = _
+
+    def test_concurrent_commit(self):
+        models = self.router()
+        threads = []
+        self.record(self.backend, threads)
+        self.record(self.other, threads)
+        with models.session().begin() as t:
+            t.add(models.simplemodel(code='pluto', group='planet'))
+            t.add(models.instrument(name='bla', ccy='EUR', type='equity'))
+        yield t.on_result
+        self.assertEqual(len(threads), 2)
+        self.assertNotEqual(threads[0], threads[1])
+        self.assertEqual(len(t.saved), 2)
+        yield self.async.assertEqual(models.simplemodel.query().count(), 1)
+        yield self.async.assertEqual(models.instrument.query().count(), 1)
+
+    def test_error(self):
+        models = self.router()
+
+        def _(data):
+            raise ValueError('server down')
+        self.backend.execute_session = _
+        t = models.session().begin()
+        t.add(models.simplemodel(code='pluto', group='planet'))
+        t.add(models.instrument(name='bla', ccy='EUR', type='equity'))
+        t.add(models.instrument(name='foo', ccy='EUR', type='equity'))
+        self.assertRaises(ValueError, t.commit)
+        # the other backend was committed
+        yield self.async.assertEqual(models.instrument.query().count(), 2)
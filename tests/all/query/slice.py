@@ -69,6 +69,33 @@ class TestFilter(FinanceTest):
         self.assertEqual(len(q1),1)
         self.assertEqual(q1[0].id,N-1)
 
+    def test_count_after_slice(self):
+        session = self.session()
+        N = yield session.query(self.model).count()
+        qs = session.query(self.model)
+        bq = qs.backend_query()
+        self.assertFalse(bq.executed)
+        q1 = yield qs[-3:]
+        self.assertTrue(bq.executed)
+        self.assertEqual([q.id for q in q1], [N-2, N-1, N])
+        yield self.async.assertEqual(qs.count(), N)
+
+    def test_count_after_sorted_load(self):
+        session = self.session()
+        qs = session.query(self.model).filter(ccy='EUR').sort_by('-id')
+        bq = qs.backend_query()
+        q1 = yield qs.all()
+        self.assertTrue(bq.executed)
+        self.assertTrue(q1)
+        self.assertEqual([q.id for q in q1],
+                         sorted((q.id for q in q1), reverse=True))
+        yield self.async.assertEqual(qs.count(), len(q1))
+        qs = session.query(self.model).filter(ccy='XXX')
+        q1 = yield qs[1:]
+        self.assertEqual(q1, [])
+        self.assertTrue(qs.backend_query().executed)
+        yield self.async.assertEqual(qs.count(), 0)
+
     def testSliceGetField(self):
         '''test slice in conjunction with get_field method'''
         session = self.session()
@@ -70,6 +70,30 @@ class TestTransactions(test.TestWrite):
             self.assertTrue(state.persistent)
         yield t.on_result
 
+    def test_update_indices(self):
+        session = self.session()
+        query = session.query(self.model)
+        with session.begin() as t:
+            for n in range(10):
+                t.add(self.model(code='idx%s' % n, group='a'))
+        yield t.on_result
+        qs = yield query.filter(group='a').load_only('group').all()
+        self.assertEqual(len(qs), 10)
+        with session.begin() as t:
+            for n, m in enumerate(qs):
+                m.group = 'b' if n % 2 else 'a'
+                t.add(m)
+        yield t.on_result
+        yield self.async.assertEqual(query.filter(group='a').count(), 5)
+        yield self.async.assertEqual(query.filter(group='b').count(), 5)
+        qs = yield query.filter(code=('idx1', 'idx2')).all()
+        self.assertEqual(len(qs), 2)
+        with session.begin() as t:
+            t.delete(query.filter(group='b'))
+        yield t.on_result
+        yield self.async.assertEqual(query.filter(group='b').count(), 0)
+        yield self.async.assertEqual(query.filter(group='a').count(), 5)
+
 
 class TestMultiFieldTransaction(test.TestCase):
     model = Dictionary
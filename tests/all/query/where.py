@@ -1,3 +1,9 @@
+import datetime
+
+from stdnet.utils import test
+
+from examples.models import SportAtDate
+
 from . import ranges
 
 
@@ -30,4 +36,25 @@ class TestWhere(ranges.NumericTest):
         qs = yield qs.all()
         self.assertTrue(qs)
         for m in qs:
-            self.assertTrue(m.vega > m.delta)
\ No newline at end of file
+            self.assertTrue(m.vega > m.delta)
+
+
+class TestWhereSorted(test.TestWrite):
+    multipledb = 'redis'
+    model = SportAtDate
+
+    def populate(self):
+        with self.session().begin() as t:
+            for n in range(6):
+                t.add(SportAtDate(person='p%s' % n, name='run%s' % (n % 2),
+                                  dt=datetime.date(2013, 1, 6-n)))
+        return t.on_result
+
+    def test_where(self):
+        yield self.populate()
+        query = self.query()
+        qs = yield query.where("this.person ~= 'p2'").all()
+        self.assertEqual([m.person for m in qs], ['p5', 'p4', 'p3', 'p1', 'p0'])
+        qs = query.filter(name='run1').where("this.person ~= 'p3'")
+        qs = yield qs.all()
+        self.assertEqual([m.person for m in qs], ['p5', 'p1'])